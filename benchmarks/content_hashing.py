@@ -0,0 +1,61 @@
+"""Throughput of the content hashers (see mwedittypes.utils.set_content_hasher) on large synthetic articles.
+
+Reported per hasher:
+* hashing the text of every node (nested nodes included) and section -- fresh copies of the strings because
+  Python caches hash() of a str once it has been computed
+* building and expanding the trees of both revisions and diffing them (engine='python'; best of 3)
+
+Usage: python benchmarks/content_hashing.py [number of entries]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from tree_differ_engines import footnote_article  # noqa: E402
+
+from mwedittypes.tree_differ import Differ, WikitextTree  # noqa: E402
+from mwedittypes.utils import (  # noqa: E402
+    CONTENT_HASHERS,
+    content_hash,
+    set_content_hasher,
+    xxhash,
+)
+
+
+def time_hashing(texts):
+    start = time.perf_counter()
+    for text in texts:
+        content_hash(text)
+    return time.perf_counter() - start
+
+
+def time_diff(prev_wikitext, curr_wikitext):
+    start = time.perf_counter()
+    prev_tree = WikitextTree(prev_wikitext)
+    curr_tree = WikitextTree(curr_wikitext)
+    Differ(prev_tree, curr_tree, expand_nodes=True).get_corresponding_nodes()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    prev_wikitext = footnote_article(entries)
+    curr_wikitext = footnote_article(entries, edited=True)
+    tree = WikitextTree(prev_wikitext)
+    tree.expand_nested()
+    texts = [n.text for n in tree.root.postorder()]
+    num_chars = sum(len(t) for t in texts)
+    print(f"{len(texts)} nodes with {num_chars / 1e6:.1f}M characters of text")
+    for hasher in CONTENT_HASHERS:
+        if hasher == "xxhash" and xxhash is None:
+            print(f"{hasher:>8}: skipped (pip install xxhash)")
+            continue
+        set_content_hasher(hasher)
+        elapsed = min(time_hashing(["".join(list(t)) for t in texts]) for _ in range(3))
+        print(
+            f"{hasher:>8}: hashing {elapsed * 1e3:.1f}ms ({num_chars / elapsed / 1e6:.0f}M chars/s); "
+            f"tree build + diff {min(time_diff(prev_wikitext, curr_wikitext) for _ in range(3)):.2f}s"
+        )
+    set_content_hasher()
@@ -0,0 +1,90 @@
+"""Agreement between the exact structured diff and algorithm='fast' (plus how long each takes).
+
+Edits are generated from the wikitext fixtures used by the tests (tests/context.py): each edit removes,
+swaps, moves, inserts, or modifies a few random lines. Reported per fixture:
+* identical: share of edits where both algorithms give exactly the same edit-type summary
+* node edits: precision / recall of the fast node edits (type, edit type, name) w.r.t. the exact ones
+* time spent by each algorithm
+
+Usage: python benchmarks/fast_agreement.py [number of edits per fixture]
+"""
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "tests"))
+)
+
+from context import cjk_prev_wikitext, prev_wikitext  # noqa: E402
+
+from mwedittypes import StructuredEditTypes  # noqa: E402
+
+INSERTIONS = [
+    "{{citation needed}}",
+    "''new'' text [[Link]]",
+    "<ref>{{cite web|title=X}}</ref>",
+    "==New Section==",
+    "[[Category:Foo]]",
+]
+
+
+def random_edit(wikitext, rnd):
+    """Apply 1-4 random line-level edits to wikitext."""
+    lines = wikitext.split("\n")
+    for _ in range(rnd.randint(1, 4)):
+        op = rnd.randint(0, 5)
+        i = rnd.randrange(len(lines))
+        if op == 0 and len(lines) > 1:
+            lines.pop(i)
+        elif op == 1:
+            j = rnd.randrange(len(lines))
+            lines[i], lines[j] = lines[j], lines[i]
+        elif op == 2:
+            lines.insert(i, rnd.choice(INSERTIONS))
+        elif op == 3:
+            lines[i] = lines[i].replace("a", "e", 1)
+        elif op == 4:
+            lines[i] = lines[i] + " [[Extra link]]"
+        else:
+            lines.insert(rnd.randrange(len(lines)), lines.pop(i))
+    return "\n".join(lines)
+
+
+def node_edits(diff):
+    return Counter((ne.type, ne.edittype, ne.name) for ne in diff["node-edits"])
+
+
+def run(algorithm, prev, curr):
+    start = time.perf_counter()
+    diff = StructuredEditTypes(prev, curr, lang="en", algorithm=algorithm).get_diff()
+    return diff, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    num_edits = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    rnd = random.Random(42)
+    for name, fixture in (("en", prev_wikitext), ("ja", cjk_prev_wikitext)):
+        identical = 0
+        shared = exact_total = fast_total = 0
+        exact_time = fast_time = 0
+        for _ in range(num_edits):
+            curr = random_edit(fixture, rnd)
+            exact, elapsed = run("exact", fixture, curr)
+            exact_time += elapsed
+            fast, elapsed = run("fast", fixture, curr)
+            fast_time += elapsed
+            identical += exact == fast
+            exact_nodes = node_edits(exact)
+            fast_nodes = node_edits(fast)
+            shared += sum((exact_nodes & fast_nodes).values())
+            exact_total += sum(exact_nodes.values())
+            fast_total += sum(fast_nodes.values())
+        print(
+            f"{name}: identical {identical}/{num_edits}; "
+            f"node edits precision {shared / max(fast_total, 1):.2f} recall {shared / max(exact_total, 1):.2f}; "
+            f"exact {exact_time:.2f}s, fast {fast_time:.2f}s"
+        )
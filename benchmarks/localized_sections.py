@@ -0,0 +1,48 @@
+"""Time diffs of a one-line edit with and without localizing it to the changed sections first (localize=True).
+
+Uses the sports-season-like article from section_workers.py at a few sizes: with localize=True only the edited
+section of each revision is parsed and built into a tree so the time should barely grow with the article.
+
+Usage: python benchmarks/localized_sections.py [rows per section]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from section_workers import season_article  # noqa: E402
+
+from mwedittypes import SimpleEditTypes, StructuredEditTypes  # noqa: E402
+
+
+def time_diff(cls, prev_wikitext, curr_wikitext, localize):
+    et = cls(prev_wikitext, curr_wikitext, lang="en", localize=localize)
+    start = time.perf_counter()
+    diff = et.get_diff()
+    return time.perf_counter() - start, et.num_parses, diff
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    for sections in (10, 40, 160):
+        prev_wikitext = season_article(sections, rows)
+        curr_wikitext = prev_wikitext.replace(
+            "==Round 5==\n", "==Round 5==\nA [[new]] line.\n", 1
+        )
+        print(f"{sections} sections ({len(prev_wikitext) / 1e6:.2f}M characters)")
+        for cls in (StructuredEditTypes, SimpleEditTypes):
+            results = []
+            for localize in (False, True):
+                elapsed, num_parses, diff = min(
+                    (
+                        time_diff(cls, prev_wikitext, curr_wikitext, localize)
+                        for _ in range(3)
+                    ),
+                    key=lambda r: r[0],
+                )
+                results.append(diff)
+                print(
+                    f"  {cls.__name__:>19} localize={localize!s:<5}: {elapsed:.3f}s ({num_parses} parses)"
+                )
+            assert results[0] == results[1]
@@ -0,0 +1,49 @@
+"""Time by-section structured diffs with a pool of worker processes (workers=N) on a sports-season-like article.
+
+Every section has one edited line so each pair of sections is its own sub-problem.
+
+Usage: python benchmarks/section_workers.py [number of sections] [rows per section]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from mwedittypes import StructuredEditTypes  # noqa: E402
+
+
+def season_article(sections, rows, edited=False):
+    """One section per round with a row per team, each with a link, a template and a reference."""
+    lines = ["'''Season''' summary."]
+    for s in range(sections):
+        lines.append(f"==Round {s}==")
+        for r in range(rows):
+            lines.append(
+                f"* [[Team {r}]] {{{{flagicon|Country {r % 9}}}}} {r * s} points"
+                f"<ref>{{{{cite web|title=Round {s} match {r}|url=https://example.org/{s}/{r}}}}}</ref>"
+            )
+    if edited:
+        for s in range(sections):
+            i = 2 + s * (rows + 1) + (s * 7) % rows
+            lines[i] = lines[i].replace("points", "points [[Bonus]]")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    sections = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    prev_wikitext = season_article(sections, rows)
+    curr_wikitext = season_article(sections, rows, edited=True)
+    results = {}
+    for workers in (1, 2, 4):
+        start = time.perf_counter()
+        et = StructuredEditTypes(
+            prev_wikitext, curr_wikitext, by_section=True, workers=workers
+        )
+        et.get_diff()
+        results[workers] = et.tree_diff
+        print(
+            f"workers={workers}: {time.perf_counter() - start:.2f}s ({os.cpu_count()} CPUs)"
+        )
+    print("same result:", results[1] == results[2] == results[4])
@@ -0,0 +1,45 @@
+"""Time SimpleEditTypes with the mwparserfromhell and scanner backends (see simple_differ.WikitextBag).
+
+Uses the sports-season-like article from section_workers.py with a single edited row, which is the common
+case: the scanner finds every top-level node without parsing and only the changed nodes and section are parsed.
+
+Usage: python benchmarks/simple_backends.py [number of sections] [rows per section]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from section_workers import season_article  # noqa: E402
+
+from mwedittypes import SimpleEditTypes  # noqa: E402
+from mwedittypes.scanner import AmbiguousWikitext, scan_sections  # noqa: E402
+
+
+def time_backend(backend, prev_wikitext, curr_wikitext):
+    et = SimpleEditTypes(prev_wikitext, curr_wikitext, lang="en", backend=backend)
+    start = time.perf_counter()
+    diff = et.get_diff()
+    return time.perf_counter() - start, et.num_parses, diff
+
+
+if __name__ == "__main__":
+    sections = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    prev_wikitext = season_article(sections, rows)
+    curr_wikitext = prev_wikitext.replace("34 points", "34 points [[Bonus]]", 1)
+    try:
+        scan_sections(prev_wikitext)
+        print(f"{len(prev_wikitext) / 1e6:.1f}M characters; scanned without parsing")
+    except AmbiguousWikitext as e:
+        print(f"{len(prev_wikitext) / 1e6:.1f}M characters; falls back to parsing: {e}")
+    diffs = []
+    for backend in ("mwparserfromhell", "scanner"):
+        elapsed, num_parses, diff = min(
+            time_backend(backend, prev_wikitext, curr_wikitext) for _ in range(3)
+        )
+        diffs.append(diff)
+        print(f"{backend:>16}: {elapsed:.2f}s ({num_parses} parses)")
+    print("same diff:", diffs[0] == diffs[1])
+    print(diffs[1])
@@ -0,0 +1,35 @@
+"""Time SimpleEditTypes on an article with many identical nodes -- e.g., formatting markers, templates, tags.
+
+Each line has italic text, a {{citation needed}} template, and a <br> tag so the article has
+[number of lines] identical copies of each; the edit adds one more line.
+
+Usage: python benchmarks/simple_repeated_nodes.py [number of lines]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from mwedittypes import SimpleEditTypes  # noqa: E402
+
+
+def repeated_article(lines, edited=False):
+    """One section with lines of italic text that each end in the same template and tag."""
+    text = ["==Claims=="]
+    text.extend(
+        f"Claim {i} is ''disputed''.{{{{citation needed}}}}<br>" for i in range(lines)
+    )
+    if edited:
+        text.insert(lines // 2, "Claim X is ''new''.{{citation needed}}<br>")
+    return "\n".join(text)
+
+
+if __name__ == "__main__":
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    prev_wikitext = repeated_article(lines)
+    curr_wikitext = repeated_article(lines, edited=True)
+    start = time.perf_counter()
+    diff = SimpleEditTypes(prev_wikitext, curr_wikitext, lang="en").get_diff()
+    print(f"{lines} lines: {time.perf_counter() - start:.2f}s")
+    print(diff)
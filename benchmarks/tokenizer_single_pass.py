@@ -0,0 +1,93 @@
+"""Time Tokenizer.tokenize_and_get_occurrence (one scan of the text) against the separate get_* methods.
+
+Each section is built from a handful of English, Japanese, or Arabic sentences in random order with a paragraph
+break every few sentences; the separate methods scan the text once per category and re-tokenize every sentence
+and paragraph into words to decide whether to count it.
+
+Usage: python benchmarks/tokenizer_single_pass.py [characters per section]
+"""
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from mwedittypes.constants import ENGLISH_UNICODE, NON_ENGLISH_UNICODE  # noqa: E402
+from mwedittypes.tokenizer import Tokenizer  # noqa: E402
+
+SENTENCES = {
+    "en": [
+        "The club finished the 1994–95 season in third place, two points behind the champions.",
+        "Its home ground, rebuilt in 2003, holds 12,500 spectators...",
+        "Why did the board sack the manager? Nobody's quite sure!",
+        "The well-known striker scored 27 goals (a club record) and was named player of the year.",
+        "Attendance fell by 3.5 per cent; ticket prices rose to £25.",
+    ],
+    "ja": [
+        "このクラブは1994年のシーズンを3位で終えた。",
+        "本拠地のスタジアムは2003年に改修され、12,500人を収容する。",
+        "なぜ監督は解任されたのか？誰にも分からない！",
+        "有名なストライカーは27得点を挙げ（クラブ記録）、年間最優秀選手に選ばれた。",
+        "観客数は3.5%減少し、入場料は2,500円に上がった。",
+    ],
+    "ar": [
+        "أنهى النادي موسم 1994–95 في المركز الثالث، بفارق نقطتين عن البطل.",
+        "يتسع ملعبه، الذي أعيد بناؤه عام 2003، لـ 12,500 متفرج...",
+        "لماذا أقال المجلس المدرب؟ لا أحد يعرف!",
+        "سجل المهاجم المعروف 27 هدفاً (رقم قياسي للنادي) واختير لاعب العام.",
+        "انخفض الحضور بنسبة 3.5 في المائة؛ وارتفعت أسعار التذاكر.",
+    ],
+}
+
+
+def section_text(lang, length, seed=0):
+    """Random sentences in the given language with a paragraph break every one to four sentences."""
+    rnd = random.Random(seed)
+    separator = "" if lang == "ja" else " "
+    paragraphs = []
+    size = 0
+    while size < length:
+        paragraph = separator.join(
+            rnd.choice(SENTENCES[lang]) for _ in range(rnd.randint(1, 4))
+        )
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+def separate_passes(tokenizer, text):
+    """The counts of tokenize_and_get_occurrence from one scan of the text per category."""
+    word_key = "Character" if tokenizer.lang == "ja" else "Word"
+    return {
+        "Whitespace": dict(Counter(tokenizer.get_whitespace(text))),
+        "Punctuation": dict(Counter(tokenizer.get_punctuations(text))),
+        word_key: dict(Counter(tokenizer.get_words(text))),
+        "Sentence": dict(Counter(tokenizer.get_sentences(text))),
+        "Paragraph": dict(Counter(tokenizer.get_paragraphs(text))),
+    }
+
+
+def best_time(func, text, repeats=5):
+    elapsed = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(text)
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed), result
+
+
+if __name__ == "__main__":
+    length = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    for lang in ("en", "ja", "ar"):
+        tokenizer = Tokenizer(ENGLISH_UNICODE, NON_ENGLISH_UNICODE, lang=lang)
+        text = section_text(lang, length)
+        separate, expected = best_time(lambda t: separate_passes(tokenizer, t), text)
+        single, result = best_time(tokenizer.tokenize_and_get_occurrence, text)
+        assert result == expected
+        print(
+            f"{lang}: {len(text) / 1e3:.0f}K characters; separate passes {separate * 1e3:.1f}ms "
+            f"({len(text) / separate / 1e6:.1f}M chars/s); single pass {single * 1e3:.1f}ms "
+            f"({len(text) / single / 1e6:.1f}M chars/s)"
+        )
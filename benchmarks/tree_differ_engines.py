@@ -0,0 +1,74 @@
+"""Compare tree-diff engines on a synthetic list article.
+
+Usage: python benchmarks/tree_differ_engines.py [number of list entries]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from mwedittypes.tree_differ import WikitextTree, get_differ  # noqa: E402
+
+
+def list_article(entries, edited=False):
+    """One big section of list entries, each with links, a template and a reference."""
+    lines = [
+        "{{Short description|List of things}}",
+        "'''Things''' are listed below.",
+        "",
+        "==List==",
+    ]
+    for i in range(entries):
+        year = 1900 + i % 100
+        lines.append(
+            f"* [[Thing {i}]] ({{{{flagicon|Country {i % 20}}}}} [[{year}]])"
+            f"<ref>{{{{cite web|title=Thing {i}|url=https://example.org/{i}|year={year}}}}}</ref>"
+        )
+    if edited:
+        lines[len(lines) // 2] += " [[New link]]"
+        lines.insert(len(lines) // 3, "* [[Inserted thing]]")
+    lines.extend(["", "==References==", "{{reflist}}", "[[Category:Lists]]"])
+    return "\n".join(lines)
+
+
+def footnote_article(entries, edited=False):
+    """One section of claims, each with a reference that ends in nested templates and links."""
+    lines = ["'''Claims''' are listed below.", "", "==Notes=="]
+    for i in range(entries):
+        lines.append(
+            f"Claim {i}.<ref>See [[Source {i}]], p. {i}: {{{{cite book|title=Book {i}|author=[[Author {i % 7}]]"
+            f"|quote={{{{lang|de|[[Zitat {i}]] {{{{nowrap|[[Teil {i}]]}}}}}}}}}}}}</ref>"
+        )
+    if edited:
+        lines[len(lines) // 2] += " [[New link]]"
+        lines.insert(
+            len(lines) // 3, "Inserted claim.<ref>{{cite web|title=[[X]]}}</ref>"
+        )
+    lines.extend(["", "==References==", "{{reflist}}"])
+    return "\n".join(lines)
+
+
+def time_engine(engine, prev_wikitext, curr_wikitext, repeats=1):
+    best = None
+    for _ in range(repeats):
+        prev_tree = WikitextTree(prev_wikitext)
+        curr_tree = WikitextTree(curr_wikitext)
+        start = time.perf_counter()
+        d = get_differ(engine)(prev_tree, curr_tree)
+        diff = d.get_corresponding_nodes()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(d.t1), len(d.t2), diff
+
+
+if __name__ == "__main__":
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    prev_wikitext = list_article(entries)
+    curr_wikitext = list_article(entries, edited=True)
+    results = {}
+    for engine in ("python", "numpy"):
+        elapsed, n1, n2, diff = time_engine(engine, prev_wikitext, curr_wikitext)
+        results[engine] = (diff.insert, diff.remove, diff.change, diff.move)
+        print(f"{engine:>8}: {n1} x {n2} nodes in {elapsed:.2f}s")
+    print("same result:", results["python"] == results["numpy"])
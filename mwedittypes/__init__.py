@@ -1,4 +1,5 @@
 from .mwedittypes import SimpleEditTypes, StructuredEditTypes
+from .tree_differ import DistanceMemo, MaxDistanceExceeded, estimate_complexity
 
 __title__ = "mwedittypes"
 __summary__ = "mwedittypes is a package that supports edit diffs and action detection for Wikipedia"
@@ -8,4 +9,10 @@ __version__ = "2.1.1"
 
 __license__ = "MIT License"
 
-__all__ = ["StructuredEditTypes", "SimpleEditTypes"]
+__all__ = [
+    "StructuredEditTypes",
+    "SimpleEditTypes",
+    "MaxDistanceExceeded",
+    "DistanceMemo",
+    "estimate_complexity",
+]
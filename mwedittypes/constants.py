@@ -30,6 +30,10 @@ TEXT_FORMATTING_TAGS = (
 TABLE_ELEMENTS_TAGS = ("th", "tr", "td")
 LIST_TAGS = ("li", "dt", "dd", "ul", "ol", "dl")
 
+# wikitext that starts a node of a structured diff: link, template/argument, table, tag/comment (but not
+# closing tags), external link, or text-formatting -- used to estimate the size of a diff without parsing
+NODE_MARKUP_PATTERN = re.compile(r"\[\[|\{\{|\{\||<(?!/)|://|'{2,5}")
+
 # CJK period/question/exclamation; Bengali full-stops; Armenian verǰaket (full-stop; resembles a colon)
 NON_ENGLISH_FULL_STOPS = "。？！।॥։"
 # This regex identifies end-of-sentence punctuation and new-lines as sentence breaks
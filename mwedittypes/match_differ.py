@@ -0,0 +1,276 @@
+import heapq
+from collections import deque
+
+from mwedittypes.tree_differ import Differ, longest_increasing_subsequence
+
+
+class MatchDiffer(Differ):
+    """
+    Approximate tree differ that matches nodes directly instead of computing a minimum tree distance.
+
+    Follows GumTree (Falleri et al. 2014):
+    * top-down: identical sub-trees are matched, tallest first (see match_top_down)
+    * bottom-up: remaining nodes are matched to the node of the same type that contains the most of their
+      matched descendants (see match_bottom_up) and their unmatched children are paired up by type
+    Removes, inserts, changes and moves are then derived from the matches (see get_transactions).
+    In the worst case, the bottom-up pass grows with the number of nodes times the square of the depth of the
+    trees -- roughly linear time for wikitext as nesting is shallow -- and the transactions aren't guaranteed
+    to be minimal.
+    """
+
+    def __init__(self, t1, t2, min_dice=0.5, **kwargs):
+        # minimum share of matched descendants for two nodes to be matched bottom-up
+        self.min_dice = min_dice
+        self.matches = {}  # tree1 idx -> tree2 idx
+        self.transactions = None
+        super(MatchDiffer, self).__init__(t1, t2, **kwargs)
+
+    def populate_distances(self):
+        """Match nodes across the two trees and derive the transactions from those matches."""
+        self.t2_matches = {}  # tree2 idx -> tree1 idx
+        # tree1 idx of the roots of sub-trees matched as a whole
+        self.t1_matched_subtrees = set()
+        self.match_top_down()
+        if self.budget is not None:
+            self.budget.check_time()
+        self.match_bottom_up()
+        self.transactions = self.get_match_transactions()
+
+    def get_distance(self):
+        """Cost of the (not necessarily minimal) transactions derived from the matches."""
+        distance = 0
+        for i, j in self.transactions:
+            if j is None:
+                distance += self.t1_weights[i]
+            elif i is None:
+                distance += self.t2_weights[j]
+            else:
+                distance += self.get_label_cost(i, j)
+        return distance
+
+    def get_num_cells(self):
+        """Number of nodes in both trees -- there is no table of distances to fill."""
+        return len(self.t1) + len(self.t2)
+
+    def get_transactions(self, i=None, j=None):
+        """Transactions derived from the matches for the full trees (i/j are only accepted for compatibility)."""
+        return list(self.transactions)
+
+    def add_match(self, i, j):
+        self.matches[i] = j
+        self.t2_matches[j] = i
+
+    @staticmethod
+    def get_heights(nodes):
+        """Height of each node in a post-order list (leaves have height 1)."""
+        heights = []
+        for n in nodes:
+            heights.append(1 + max((heights[c.idx] for c in n.children), default=0))
+        return heights
+
+    def match_top_down(self):
+        """Match identical sub-trees, starting with the tallest.
+
+        Nodes of the same height are compared via their Merkle hashes and a hash that occurs once in each tree
+        is matched right away. Nodes without an identical counterpart are opened up so that their children
+        are compared at their own height. Sub-trees that occur several times are left for recover, which
+        matches them once their parents are matched.
+        """
+        self.t1_heights = self.get_heights(self.t1)
+        self.t2_heights = self.get_heights(self.t2)
+        sides = (
+            (self.t1, self.t1_heights, self.t1_subtree_hashes),
+            (self.t2, self.t2_heights, self.t2_subtree_hashes),
+        )
+        # max-heaps of (-height, idx) of the nodes still to be compared
+        queues = (
+            [(-self.t1_heights[-1], len(self.t1) - 1)],
+            [(-self.t2_heights[-1], len(self.t2) - 1)],
+        )
+
+        def open_node(side, idx):
+            nodes, heights, _ = sides[side]
+            for c in nodes[idx].children:
+                heapq.heappush(queues[side], (-heights[c.idx], c.idx))
+
+        while queues[0] and queues[1]:
+            height = min(-queues[0][0][0], -queues[1][0][0])
+            by_hash = {}
+            for side, queue in enumerate(queues):
+                _, heights, hashes = sides[side]
+                while queue and -queue[0][0] >= height:
+                    _, idx = heapq.heappop(queue)
+                    if heights[idx] > height:
+                        # taller than anything left in the other tree so it can't be matched as a whole
+                        open_node(side, idx)
+                    else:
+                        by_hash.setdefault(hashes[idx], ([], []))[side].append(idx)
+            for t1_idx, t2_idx in by_hash.values():
+                if len(t1_idx) == 1 and len(t2_idx) == 1:
+                    self.match_subtrees(t1_idx[0], t2_idx[0])
+                elif not t1_idx or not t2_idx:
+                    for idx in t1_idx:
+                        open_node(0, idx)
+                    for idx in t2_idx:
+                        open_node(1, idx)
+
+    def match_subtrees(self, i, j):
+        """Match all nodes of two identical sub-trees (same shape so post-order positions line up)."""
+        self.t1_matched_subtrees.add(i)
+        for offset in range(i - self.t1_leftmost[i] + 1):
+            self.add_match(i - offset, j - offset)
+
+    def match_bottom_up(self):
+        """Match remaining nodes (post-order) to the same-type node that shares most of their matched descendants.
+
+        Each candidate is scored by the Dice coefficient of the two sets of descendants -- i.e. the share of
+        descendants that are matched to one another. After a match, unmatched children are recovered.
+
+        Like GumTree, the candidates are the ancestors of the matches of the descendants. To bound the work:
+        * a sub-tree matched as a whole (see match_subtrees) is counted at once -- its nodes share the same
+          unmatched ancestors in tree2
+        * the walk up from a match stops at ancestors too large to reach min_dice even if all of the
+          descendants of the node were shared
+        Neither changes which node is matched.
+        """
+        self.add_match(len(self.t1) - 1, len(self.t2) - 1)
+        # a candidate with more descendants than this many times those of the node has a Dice below min_dice
+        max_ratio = 2 / self.min_dice - 1 if self.min_dice > 0 else None
+        for n1 in self.t1:
+            i = n1.idx
+            if i in self.matches or not n1.children:
+                continue
+            num_descendants = i - self.t1_leftmost[i]
+            max_size = None if max_ratio is None else num_descendants * max_ratio
+            # (matched descendant, number of nodes it stands for) -- gathered right-to-left to skip sub-trees
+            descendants = []
+            d1 = i - 1
+            while d1 >= self.t1_leftmost[i]:
+                if d1 in self.t1_matched_subtrees:
+                    descendants.append((d1, d1 - self.t1_leftmost[d1] + 1))
+                    d1 = self.t1_leftmost[d1] - 1
+                else:
+                    if d1 in self.matches:
+                        descendants.append((d1, 1))
+                    d1 -= 1
+            common = {}
+            for d1, count in reversed(descendants):
+                ancestor = self.t2[self.matches[d1]].parent
+                while ancestor is not None and not ancestor.is_root:
+                    j = ancestor.idx
+                    if max_size is not None and j - self.t2_leftmost[j] > max_size:
+                        # ancestors only get larger from here
+                        break
+                    if j not in self.t2_matches and ancestor.ntype == n1.ntype:
+                        common[j] = common.get(j, 0) + count
+                    ancestor = ancestor.parent
+            best = None
+            best_dice = self.min_dice
+            for j, num_common in common.items():
+                dice = 2 * num_common / (num_descendants + j - self.t2_leftmost[j])
+                if dice > best_dice or (dice == best_dice and best is None):
+                    best = j
+                    best_dice = dice
+            if best is not None:
+                self.add_match(i, best)
+                self.recover(i, best)
+        self.recover(len(self.t1) - 1, len(self.t2) - 1)
+
+    def recover(self, i, j):
+        """Pair up unmatched children of matched nodes i and j and recurse into them.
+
+        Like SectionDiffer.align_sections: children that are already matched to one another and in order are
+        kept as anchors and unmatched children between the same two anchors are paired up in order --
+        identical children first (along with their sub-trees) and then children of the same type.
+        """
+        pairs = [(i, j)]
+        while pairs:
+            i, j = pairs.pop()
+            children1 = self.t1[i].children
+            children2 = self.t2[j].children
+            positions = {c2.idx: k for k, c2 in enumerate(children2)}
+            matched = [
+                (k, positions[self.matches[c1.idx]])
+                for k, c1 in enumerate(children1)
+                if self.matches.get(c1.idx) in positions
+            ]
+            anchors = [
+                matched[k]
+                for k in longest_increasing_subsequence([k2 for _, k2 in matched])
+            ]
+            prev_anchor = (-1, -1)
+            for anchor in anchors + [(len(children1), len(children2))]:
+                gap1 = children1[prev_anchor[0] + 1 : anchor[0]]
+                gap2 = children2[prev_anchor[1] + 1 : anchor[1]]
+                prev_anchor = anchor
+                for key1, key2, identical in (
+                    (self.t1_subtree_hashes, self.t2_subtree_hashes, True),
+                    (self.t1_ntypes, self.t2_ntypes, False),
+                ):
+                    t2_children = {}
+                    for c2 in gap2:
+                        if c2.idx not in self.t2_matches:
+                            t2_children.setdefault(key2[c2.idx], deque()).append(c2.idx)
+                    for c1 in gap1:
+                        if c1.idx not in self.matches and t2_children.get(key1[c1.idx]):
+                            c2_idx = t2_children[key1[c1.idx]].popleft()
+                            if identical:
+                                self.match_subtrees(c1.idx, c2_idx)
+                            else:
+                                self.add_match(c1.idx, c2_idx)
+                                pairs.append((c1.idx, c2_idx))
+
+    def get_moved(self):
+        """Matched nodes in tree1 whose parents aren't matched or that are out of order among their siblings.
+
+        Like in the exact differ, a moved node is removed and inserted along with its whole sub-tree
+        (detect_moves then pairs up the identical nodes as moves).
+        """
+        moved = set()
+        for n1 in self.t1[-1].preorder():
+            i = n1.idx
+            if n1.parent is not None and n1.parent.idx in moved:
+                moved.add(i)
+            if i in moved or i not in self.matches or not n1.children:
+                continue
+            p2 = self.t2[self.matches[i]]
+            positions = {c2.idx: k for k, c2 in enumerate(p2.children)}
+            in_place = []
+            for c1 in n1.children:
+                j = self.matches.get(c1.idx)
+                if j is None:
+                    continue
+                elif j in positions:
+                    in_place.append((c1.idx, positions[j]))
+                else:
+                    moved.add(c1.idx)
+            in_order = set(longest_increasing_subsequence([k for _, k in in_place]))
+            for k, (c1_idx, _) in enumerate(in_place):
+                if k not in in_order:
+                    moved.add(c1_idx)
+        return moved
+
+    def get_match_transactions(self):
+        """Transactions as (tree1 idx, tree2 idx) tuples like Differ.get_transactions.
+
+        Unmatched nodes are removed/inserted, matched nodes with different content are changed,
+        and both sides of a moved node (see get_moved) are removed and inserted.
+        """
+        t1_moved = self.get_moved()
+        t2_moved = set()
+        for i in t1_moved:
+            j = self.matches.get(i)
+            if j is not None:
+                t2_moved.update(range(self.t2_leftmost[j], j + 1))
+        transactions = []
+        for i in range(len(self.t1)):
+            j = self.matches.get(i)
+            if j is None or i in t1_moved or j in t2_moved:
+                transactions.append((i, None))
+            elif self.get_label_cost(i, j):
+                transactions.append((i, j))
+        for j in range(len(self.t2)):
+            i = self.t2_matches.get(j)
+            if i is None or i in t1_moved or j in t2_moved:
+                transactions.append((None, j))
+        return transactions
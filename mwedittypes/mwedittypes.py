@@ -1,36 +1,168 @@
 from mwedittypes.node_differ import get_diff_count
+from mwedittypes.scanner import localize_changes
 from mwedittypes.simple_differ import get_diff as simple_get_diff
-from mwedittypes.tree_differ import get_diff
+from mwedittypes.tree_differ import STAGES, Budget, BudgetExceeded, get_diff
+from mwedittypes.utils import get_num_parses, parse_wikitext
 
 
 class StructuredEditTypes:
     def __init__(
-        self, prev_wikitext="", curr_wikitext="", lang="en", timeout=False, debug=False
+        self,
+        prev_wikitext="",
+        curr_wikitext="",
+        lang="en",
+        timeout=False,
+        debug=False,
+        engine="python",
+        max_distance=None,
+        max_seconds=None,
+        max_cells=None,
+        by_section=False,
+        algorithm="exact",
+        memo=None,
+        workers=None,
+        max_depth=None,
+        localize=False,
     ):
         self.prev_wikitext = prev_wikitext
         self.curr_wikitext = curr_wikitext
         self.lang = lang
         self.timeout = timeout
+        self.engine = engine  # tree-diff kernel: "python" or "numpy"
+        # maximum number of node transactions to search for; raises MaxDistanceExceeded if more are needed
+        self.max_distance = max_distance
+        # budget for the diff; if exceeded, steps down to less detailed stages and finally SimpleEditTypes
+        self.max_seconds = max_seconds
+        self.max_cells = max_cells
+        # align sections first and diff each pair of changed sections separately
+        self.by_section = by_section
+        # "exact": minimum tree edit distance; "fast": approximate node matching (see MatchDiffer)
+        self.algorithm = algorithm
+        # DistanceMemo to share tree distances with other diffs (e.g., of the same article); None: per diff
+        self.memo = memo
+        # if more than 1, diff changed sections in parallel in a pool of this many processes (implies by_section)
+        self.workers = workers
+        # levels of nested nodes (e.g., templates within references) to expand; None: all of them
+        self.max_depth = max_depth
+        # only parse and diff the sections that aren't identical in both revisions (see localize_changes)
+        self.localize = localize
+        self.stage = None  # stage that was used: one of STAGES or "simple"
         self.tree_diff = None
         self.actions = None
+        # number of times wikitext was parsed by the last get_diff (in this thread -- see utils.parse_wikitext)
+        self.num_parses = None
 
     def get_diff(self):
-        self.tree_diff = get_diff(
-            self.prev_wikitext, self.curr_wikitext, lang=self.lang, timeout=self.timeout
-        )
-        self.actions = get_diff_count(self.tree_diff, lang=self.lang)
+        start_parses = get_num_parses()
+        # already-parsed nodes in the tree diff -- so get_diff_count doesn't parse them again
+        parsed = {}
+        if self.max_seconds is None and self.max_cells is None:
+            self.tree_diff = self._get_tree_diff(parsed=parsed)
+        else:
+            budget = Budget(max_seconds=self.max_seconds, max_cells=self.max_cells)
+            # each stage (and the fallback) builds its own trees but the revisions are only parsed once
+            prev_wikicode, curr_wikicode = self._parse_revisions()
+            for stage in STAGES:
+                # each stage gets the full max_seconds -- the stage before it is abandoned once it runs out
+                budget.restart()
+                try:
+                    self.tree_diff = self._get_tree_diff(
+                        stage=stage,
+                        budget=budget,
+                        parsed=parsed,
+                        prev_wikitext=prev_wikicode,
+                        curr_wikitext=curr_wikicode,
+                    )
+                    break
+                except BudgetExceeded:
+                    continue
+            else:
+                # out of budget for any structured diff -- fall back to simple counts
+                self.tree_diff = None
+                self.stage = "simple"
+                self.actions = simple_get_diff(
+                    prev_wikicode,
+                    curr_wikicode,
+                    lang=self.lang,
+                    max_depth=self.max_depth,
+                    localize=self.localize,
+                )
+                self.num_parses = get_num_parses() - start_parses
+                return self.actions
+        self.stage = self.tree_diff["stage"]
+        self.actions = get_diff_count(self.tree_diff, lang=self.lang, parsed=parsed)
+        self.num_parses = get_num_parses() - start_parses
         return self.actions
 
+    def _parse_revisions(self):
+        """Parsed revisions -- or, if localized, revisions whose changed sections are parsed once when needed."""
+        if self.localize:
+            localized = localize_changes(
+                self.prev_wikitext, self.curr_wikitext, lang=self.lang
+            )
+            if localized is not None:
+                return localized
+        return parse_wikitext(self.prev_wikitext), parse_wikitext(self.curr_wikitext)
+
+    def _get_tree_diff(
+        self,
+        stage=None,
+        budget=None,
+        parsed=None,
+        prev_wikitext=None,
+        curr_wikitext=None,
+    ):
+        return get_diff(
+            self.prev_wikitext if prev_wikitext is None else prev_wikitext,
+            self.curr_wikitext if curr_wikitext is None else curr_wikitext,
+            lang=self.lang,
+            timeout=self.timeout,
+            engine=self.engine,
+            max_distance=self.max_distance,
+            stage=stage,
+            budget=budget,
+            by_section=self.by_section,
+            algorithm=self.algorithm,
+            memo=self.memo,
+            workers=self.workers,
+            max_depth=self.max_depth,
+            parsed=parsed,
+            localize=self.localize,
+        )
+
 
 class SimpleEditTypes:
-    def __init__(self, prev_wikitext="", curr_wikitext="", lang="en"):
+    def __init__(
+        self,
+        prev_wikitext="",
+        curr_wikitext="",
+        lang="en",
+        max_depth=None,
+        backend="mwparserfromhell",
+        localize=False,
+    ):
         self.prev_wikitext = prev_wikitext
         self.curr_wikitext = curr_wikitext
         self.lang = lang
+        # levels of nested nodes (e.g., templates within references) to expand; None: all of them
+        self.max_depth = max_depth
+        # how top-level nodes are found: "mwparserfromhell" or "scanner" (see simple_differ.WikitextBag)
+        self.backend = backend
+        # only look at the sections that aren't identical in both revisions (see localize_changes)
+        self.localize = localize
         self.actions = None
+        # number of times wikitext was parsed by the last get_diff (see utils.parse_wikitext)
+        self.num_parses = None
 
     def get_diff(self):
+        start_parses = get_num_parses()
         self.actions = simple_get_diff(
-            self.prev_wikitext, self.curr_wikitext, lang=self.lang
+            self.prev_wikitext,
+            self.curr_wikitext,
+            lang=self.lang,
+            max_depth=self.max_depth,
+            backend=self.backend,
+            localize=self.localize,
         )
+        self.num_parses = get_num_parses() - start_parses
         return self.actions
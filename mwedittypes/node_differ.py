@@ -4,6 +4,7 @@ import mwparserfromhell as mw
 from mwconstants.media import parse_image_options
 
 from mwedittypes.tokenizer import parse_change_text
+from mwedittypes.utils import parse_wikitext
 
 NodeEdit = namedtuple("NodeEdit", ["type", "edittype", "section", "name", "changes"])
 TextEdit = namedtuple("TextEdit", ["type", "edittype", "text", "count"])
@@ -11,7 +12,12 @@ Context = namedtuple("Context", ["type", "edittype", "count"])
 
 
 def get_node_diff(  # noqa: C901
-    node_type, prev_wikitext="", curr_wikitext="", lang="en"
+    node_type,
+    prev_wikitext="",
+    curr_wikitext="",
+    lang="en",
+    prev_node=None,
+    curr_node=None,
 ):
     """Identify fine-grained changes between two wikitext nodes.
 
@@ -25,6 +31,10 @@ def get_node_diff(  # noqa: C901
         Current wikitext for node
     lang : str
         Language code for Wikipedia -- e.g., 'en' = English
+    prev_node : mwparserfromhell node
+        Previous node if already parsed (otherwise prev_wikitext is parsed)
+    curr_node : mwparserfromhell node
+        Current node if already parsed (otherwise curr_wikitext is parsed)
 
     Returns
     -------
@@ -34,16 +44,12 @@ def get_node_diff(  # noqa: C901
     name = None
     changes = []
     try:
-        prev_wc = (
-            mw.parse(prev_wikitext, skip_style_tags=True).nodes[0]
-            if prev_wikitext
-            else None
-        )
-        curr_wc = (
-            mw.parse(curr_wikitext, skip_style_tags=True).nodes[0]
-            if curr_wikitext
-            else None
-        )
+        prev_wc = prev_node
+        if prev_wc is None and prev_wikitext:
+            prev_wc = parse_wikitext(prev_wikitext).nodes[0]
+        curr_wc = curr_node
+        if curr_wc is None and curr_wikitext:
+            curr_wc = parse_wikitext(curr_wikitext).nodes[0]
 
         if node_type == "Template":
             # separate between name changes and parameter changes
@@ -193,7 +199,7 @@ def get_node_diff(  # noqa: C901
             pt_caption = None
             pt_cells = {}
             if prev_wc:
-                for te in mw.parse(prev_wikitext, skip_style_tags=True).filter_tags():
+                for te in mw.parse(prev_wc).filter_tags():  # wraps -- not parsed again
                     if te.tag == "td" or te.tag == "th":
                         if "+" in [
                             a.name for a in te.attributes
@@ -206,7 +212,7 @@ def get_node_diff(  # noqa: C901
             ct_caption = None
             ct_cells = {}
             if curr_wc:
-                for te in mw.parse(curr_wikitext, skip_style_tags=True).filter_tags():
+                for te in mw.parse(curr_wc).filter_tags():
                     if te.tag == "td" or te.tag == "th":
                         if "+" in [
                             a.name for a in te.attributes
@@ -321,7 +327,7 @@ def get_node_diff(  # noqa: C901
     return name, changes
 
 
-def get_diff_count(result, lang="en"):  # noqa: C901
+def get_diff_count(result, lang="en", parsed=None):  # noqa: C901
     """Prepares more complete edit type summary based on tree diff result.
 
     Parameters
@@ -330,11 +336,16 @@ def get_diff_count(result, lang="en"):  # noqa: C901
         The tree diff result containing inserts, removes, changes, and moves made in a Wikipedia revision.
     lang : string
         The language edition associated with the diff. Necessary for parsing text changes correctly.
+    parsed : dict
+        Already-parsed node for the wikitext of nodes in the result (see tree_differ.get_diff) so that
+        they don't have to be parsed again.
     Returns
     -------
     dict
         a dict containing each occurrence of a change
     """
+    if parsed is None:
+        parsed = {}
     node_edits = []
     text_edits = []
     section_edits = []
@@ -368,7 +379,11 @@ def get_diff_count(result, lang="en"):  # noqa: C901
             section_edits.append({"edittype": "remove", "section": r["section"]})
         else:
             name, changes = get_node_diff(
-                node_type=et, prev_wikitext=text, curr_wikitext="", lang=lang
+                node_type=et,
+                prev_wikitext=text,
+                curr_wikitext="",
+                lang=lang,
+                prev_node=parsed.get(text),
             )
             node_edits.append(NodeEdit(et, "remove", r["section"], name, changes))
     tf_inserts = set()
@@ -389,7 +404,11 @@ def get_diff_count(result, lang="en"):  # noqa: C901
             section_edits.append({"edittype": "insert", "section": i["section"]})
         else:
             name, changes = get_node_diff(
-                node_type=et, prev_wikitext="", curr_wikitext=text, lang=lang
+                node_type=et,
+                prev_wikitext="",
+                curr_wikitext=text,
+                lang=lang,
+                curr_node=parsed.get(text),
             )
             node_edits.append(NodeEdit(et, "insert", i["section"], name, changes))
     tf_changes = set()
@@ -414,7 +433,12 @@ def get_diff_count(result, lang="en"):  # noqa: C901
             )
         else:
             name, changes = get_node_diff(
-                node_type=et, prev_wikitext=ptext, curr_wikitext=ctext, lang=lang
+                node_type=et,
+                prev_wikitext=ptext,
+                curr_wikitext=ctext,
+                lang=lang,
+                prev_node=parsed.get(ptext),
+                curr_node=parsed.get(ctext),
             )
             node_edits.append(
                 NodeEdit(et, "change", c["prev"]["section"], name, changes)
@@ -436,7 +460,12 @@ def get_diff_count(result, lang="en"):  # noqa: C901
             section_edits.append({"edittype": "move", "section": m["prev"]["section"]})
         else:
             name, changes = get_node_diff(
-                node_type=et, prev_wikitext=ptext, curr_wikitext=ctext, lang=lang
+                node_type=et,
+                prev_wikitext=ptext,
+                curr_wikitext=ctext,
+                lang=lang,
+                prev_node=parsed.get(ptext),
+                curr_node=parsed.get(ctext),
             )
             node_edits.append(NodeEdit(et, "move", m["prev"]["section"], name, changes))
 
@@ -0,0 +1,194 @@
+try:
+    import numpy as np
+except ImportError:  # optional dependency -- only needed for engine="numpy"
+    np = None
+
+from mwedittypes.tree_differ import Differ
+
+
+class NumpyDiffer(Differ):
+    """
+    Tree differ that keeps the Zhang-Shasha forest and tree distance tables in NumPy arrays.
+
+    Gives the same result as Differ but each row of a forest-distance table is computed with
+    array operations. To keep the rows wide, all keyroots of the second tree with the same height
+    are laid out side-by-side and processed together (a keyroot only depends on keyroots nested
+    below it, which always have a smaller height).
+    """
+
+    def __init__(
+        self,
+        t1,
+        t2,
+        timeout=False,
+        expand_nodes=True,
+        max_distance=None,
+        stage=None,
+        budget=None,
+        memo=None,
+        max_depth=None,
+    ):
+        if np is None:
+            raise ImportError(
+                "NumPy is required for engine='numpy': pip install mwedittypes[numpy]"
+            )
+        if max_distance is not None:
+            raise ValueError("max_distance is only supported by engine='python'")
+        super(NumpyDiffer, self).__init__(
+            t1,
+            t2,
+            timeout=timeout,
+            expand_nodes=expand_nodes,
+            stage=stage,
+            budget=budget,
+            memo=memo,
+            max_depth=max_depth,
+        )
+
+    def get_label_costs(self):
+        """Cost of relabelling every node in the first tree to every node in the second tree."""
+        t1_types = np.array(self.t1_ntypes)
+        t2_types = np.array(self.t2_ntypes)
+        # content hashes can be wider than 64 bits (see utils.content_hash) so compare IDs of distinct hashes
+        hash_ids = {}
+        t1_hashes = np.array(
+            [hash_ids.setdefault(h, len(hash_ids)) for h in self.t1_hashes]
+        )
+        t2_hashes = np.array(
+            [hash_ids.setdefault(h, len(hash_ids)) for h in self.t2_hashes]
+        )
+        costs = np.where(
+            t1_types[:, None] != t2_types[None, :],
+            self.nodetype_chg_cost,
+            np.where(t1_hashes[:, None] == t2_hashes[None, :], 0, self.chg_cost),
+        )
+        # collapsed sub-trees can only be matched to identical ones (see Differ.get_label_cost)
+        t1_weights = self._t1_weights[:, None]
+        t2_weights = self._t2_weights[None, :]
+        collapsed = (t1_weights > self.rem_cost) | (t2_weights > self.ins_cost)
+        return np.where(
+            collapsed & (costs > 0), np.maximum(costs, t1_weights + t2_weights), costs
+        ).astype(np.int32)
+
+    def populate_distances(self):
+        """Populate self.distances with minimum cost between all possible sub-trees."""
+        self._t1_weights = np.array(self.t1_weights, dtype=np.int64)
+        self._t2_weights = np.array(self.t2_weights, dtype=np.int64)
+        self.label_costs = self.get_label_costs()
+        self.distances = np.zeros((len(self.t1), len(self.t2)), dtype=np.int32)
+        self._t2_leftmost = np.array(self.t2_leftmost, dtype=np.int64)
+        # upper bound on any forest distance -- used to keep prefix-minimums from leaking across keyroots
+        self._max_cost = (
+            int(self._t1_weights.sum())
+            + int(self._t2_weights.sum())
+            + self.nodetype_chg_cost
+        )
+
+        heights = [0] * len(self.t2)
+        for n in self.t2:
+            if n.children:
+                heights[n.idx] = 1 + max(heights[c.idx] for c in n.children)
+        by_height = {}
+        for kr2 in self.t2_keyroots:
+            by_height.setdefault(heights[kr2.idx], []).append(kr2.idx)
+        layouts = [self._layout(by_height[h]) for h in sorted(by_height)]
+
+        for kr1 in self.t1_keyroots:
+            if self.budget is not None:
+                self.budget.check_time()
+            for layout in layouts:
+                self._forest_distance(kr1.idx, layout)
+
+    def find_minimum_transactions(self, kr1, kr2, backpointers=False):
+        """Find the minimum cost to get from the first tree to the second tree."""
+        return self._forest_distance(
+            kr1.idx, self._layout([kr2.idx]), backpointers=backpointers
+        )
+
+    def _layout(self, roots):
+        """Place the forest-distance columns for each sub-tree in roots (tree2) side-by-side.
+
+        Each sub-tree gets one column for the empty forest followed by a column per node.
+        """
+        leftmost = self._t2_leftmost[roots]
+        lens = np.array(roots, dtype=np.int64) - leftmost + 2
+        starts = np.cumsum(lens) - lens
+        width = int(lens.sum())
+        seg_id = np.repeat(np.arange(len(roots), dtype=np.int64), lens)
+        pos = np.arange(width, dtype=np.int64) - starts[seg_id]
+        nonempty = np.flatnonzero(pos)
+        nodes = (leftmost[seg_id] + pos - 1)[nonempty]
+        node_leftmost = self._t2_leftmost[nodes]
+        seg_leftmost = leftmost[seg_id[nonempty]]
+        # cost of inserting the first pos nodes of each sub-tree
+        insert_costs = np.zeros(width, dtype=np.int64)
+        insert_costs[nonempty] = self._t2_weights[nodes]
+        insert_costs = np.cumsum(insert_costs)
+        insert_costs -= insert_costs[starts[seg_id]]
+        big = self._max_cost * 2 + 1
+        return {
+            "width": width,
+            "empty": np.flatnonzero(pos == 0),
+            "nonempty": nonempty,
+            "nodes": nodes,
+            # column of the forest preceding each node's own sub-tree
+            "gather": starts[seg_id[nonempty]] + node_leftmost - seg_leftmost,
+            "is_tree": node_leftmost == seg_leftmost,
+            "first_row": insert_costs,
+            "offset": insert_costs + seg_id * big,
+        }
+
+    def _forest_distance(self, k1, layout, backpointers=False):
+        """Fill forest distances for the sub-tree rooted at k1 (tree1) against every sub-tree in layout."""
+        distances = self.distances
+        label_costs = self.label_costs
+        empty = layout["empty"]
+        nonempty = layout["nonempty"]
+        before = nonempty - 1
+        nodes = layout["nodes"]
+        gather = layout["gather"]
+        is_tree = layout["is_tree"]
+        offset = layout["offset"]
+        tree_nodes = nodes[is_tree]
+        ins_costs = self._t2_weights[nodes]
+        l1 = self.t1_leftmost[k1]
+        w1 = k1 - l1 + 1
+
+        forest = np.empty((w1 + 1, layout["width"]), dtype=np.int64)
+        forest[0] = layout["first_row"]
+        bp = None
+        if backpointers:
+            bp = np.zeros((w1 + 1, layout["width"]), dtype=np.int8)
+            bp[0] = 1
+
+        row = np.empty(layout["width"], dtype=np.int64)
+        for ii in range(1, w1 + 1):
+            i = l1 + ii - 1
+            i_leftmost = self.t1_leftmost[i]
+            rem_cost = self.t1_weights[i]
+            prev_row = forest[ii - 1]
+            rem = prev_row[nonempty] + rem_cost
+            if i_leftmost == l1:
+                chg = np.where(
+                    is_tree,
+                    prev_row[before] + label_costs[i, nodes],
+                    forest[0, gather] + distances[i, nodes],
+                )
+            else:
+                chg = forest[i_leftmost - l1, gather] + distances[i, nodes]
+            row[empty] = prev_row[empty] + rem_cost
+            row[nonempty] = np.minimum(rem, chg)
+            # inserts chain along the row: row[j] = min(row[j], row[j-1] + ins) as a prefix minimum
+            row -= offset
+            np.minimum.accumulate(row, out=row)
+            row += offset
+            forest[ii] = row
+            if i_leftmost == l1:
+                distances[i, tree_nodes] = row[nonempty][is_tree]
+            if backpointers:
+                # ties are broken in favor of remove, then insert (see Differ.find_minimum_transactions)
+                cost = row[nonempty]
+                bp[ii, nonempty] = np.where(
+                    cost == rem, 0, np.where(cost == row[before] + ins_costs, 1, 2)
+                )
+        return bp
@@ -0,0 +1,436 @@
+"""Parser-free scanner for the top-level structure of wikitext.
+
+Used to find the sections that changed between two revisions before parsing anything (see localize_changes)
+and by SimpleEditTypes with backend="scanner".
+
+The simple differ only needs the sections of an article and the type/extent of the nodes that sit directly
+within them -- anything nested is only looked at for nodes that changed. This scanner finds those with one
+pass over the raw wikitext, matching brackets and tags, instead of building the full mwparserfromhell tree.
+It only accepts constructs whose parse is unambiguous and raises AmbiguousWikitext for anything else
+(e.g., unclosed templates, stray closing tags, bare URLs) so the caller can fall back to mwparserfromhell.
+"""
+import re
+from collections import deque
+from html.entities import name2codepoint
+
+from mwparserfromhell.definitions import PARSER_BLACKLIST, SINGLE_ONLY, URI_SCHEMES
+
+from mwedittypes.utils import (
+    parse_wikitext,
+    section_name,
+    tag_node_class,
+    wikilink_node_class,
+)
+
+# deepest nesting of templates/links/tags that is scanned before giving up
+MAX_DEPTH = 100
+
+# characters that can start or end a node (and new-lines for constructs that depend on the start of a line)
+SPECIAL_CHARS = re.compile(r"[\[\]{}<\n&]")
+# URI scheme (that has to be followed by // if URI_SCHEMES says so) that would start an external link
+URL_START = re.compile(
+    r"(?:"
+    + "|".join(
+        f"{scheme}:{'//' if slashes else ''}"
+        for scheme, slashes in sorted(URI_SCHEMES.items())
+    )
+    + r"|//)",
+    flags=re.IGNORECASE,
+)
+# URI scheme within text -- mwparserfromhell turns these into external links even without brackets
+FREE_URL = re.compile(
+    r"(?:" + "|".join(sorted(URI_SCHEMES)) + r"):",
+    flags=re.IGNORECASE,
+)
+# <name attr="value" ...> or <name ... /> -- attribute values can't contain markup
+OPEN_TAG = re.compile(
+    r"<([a-z][a-z0-9]*)"
+    r"((?:\s+[a-z][a-z0-9_:.\-]*(?:\s*=\s*(?:\"[^\"<>{}\[\]|]*\"|'[^'<>{}\[\]|]*'|[^\s\"'<>{}\[\]|/=]+))?)*)"
+    r"\s*(/?)>",
+    flags=re.IGNORECASE,
+)
+ENTITY = re.compile(
+    r"&(?:([a-z][a-z0-9]*)|#([0-9]+)|#x([0-9a-f]+));", flags=re.IGNORECASE
+)
+# heading line (without trailing whitespace) whose title doesn't contain any markup
+HEADING = re.compile(
+    r"(=+)([^=\[\]{}<>&\n]*[^=\[\]{}<>&\s][^=\[\]{}<>&\n]*)(=+)[ \t]*$",
+    flags=re.MULTILINE,
+)
+
+
+class AmbiguousWikitext(Exception):
+    """Raised when the scanner can't be sure how mwparserfromhell would parse some wikitext."""
+
+
+def scan_sections(wikitext, lang="en"):
+    """Split wikitext into sections and the nodes that sit directly within each.
+
+    Returns a list with (start idx, end idx, nodes) for each section -- the lede (which might be empty) and
+    then one per heading, like mwparserfromhell's get_sections(flat=True) -- where nodes is a list of
+    (node type, start idx, end idx) for every node other than text (see utils.simple_node_class).
+    Raises AmbiguousWikitext if any of the wikitext can't be scanned with certainty.
+    """
+    nodes = _Scanner(wikitext, lang).scan()
+    sections = [[0, None, []]]
+    for node in nodes:
+        if node[0] == "Heading":
+            sections[-1][1] = node[1]
+            sections.append([node[1], None, []])
+        sections[-1][2].append(node)
+    sections[-1][1] = len(wikitext)
+    return [tuple(s) for s in sections]
+
+
+def localize_changes(prev_wikitext, curr_wikitext, lang="en", from_end=False):
+    """Split both revisions into sections (see scan_sections) and find the sections that changed.
+
+    Sections with identical wikitext are paired up in order -- each to the first unpaired identical section
+    in the other revision -- which is how the tree differ prunes identical sections (see Differ.prune_sections)
+    so only the other sections have to be parsed and diffed. If from_end is True, sections are paired starting
+    from the end instead so that extra copies of a section are the first ones, which are the ones that the
+    simple differ keeps (see simple_differ.NodeMultiset.keep).
+
+    Either revision can also be a ScannedRevision, which isn't scanned again (and keeps its parsed sections).
+    Returns a ScannedRevision for each revision or None if either can't be scanned with certainty
+    (or is empty) and so has to be parsed in full.
+    """
+    revisions = []
+    for wikitext in (prev_wikitext, curr_wikitext):
+        if not isinstance(wikitext, ScannedRevision):
+            if not wikitext:
+                return None
+            try:
+                wikitext = ScannedRevision(wikitext, scan_sections(wikitext, lang))
+            except AmbiguousWikitext:
+                return None
+        revisions.append(wikitext)
+    prev, curr = revisions
+    prev_changed = [True] * len(prev.sections)
+    curr_changed = [True] * len(curr.sections)
+    order = reversed if from_end else list
+    curr_unpaired = {}
+    for j in order(range(len(curr.sections))):
+        curr_unpaired.setdefault(curr.get_text(j), deque()).append(j)
+    for i in order(range(len(prev.sections))):
+        unpaired = curr_unpaired.get(prev.get_text(i))
+        if unpaired:
+            prev_changed[i] = False
+            curr_changed[unpaired.popleft()] = False
+    return prev.with_changed(prev_changed), curr.with_changed(curr_changed)
+
+
+class ScannedRevision:
+    """
+    Revision that was split into sections by scan_sections -- the differs accept it in place of the wikitext
+    and then only parse the sections that they need: the ones flagged as changed (see localize_changes).
+    Each section is parsed at most once and the parsed sections are shared by all diffs of the revision.
+    """
+
+    def __init__(self, wikitext, sections, changed=None, wikicode=None):
+        self.wikitext = wikitext
+        # (start idx, end idx, nodes) per section (see scan_sections)
+        self.sections = sections
+        # whether each section has to be diffed -- all of them if not set
+        self.changed = [True] * len(sections) if changed is None else changed
+        self.names = []  # name of each section (see utils.section_name)
+        for sidx, (_, _, nodes) in enumerate(sections):
+            heading = None
+            if sidx > 0:
+                heading = wikitext[nodes[0][1] : nodes[0][2]]
+            self.names.append(section_name(sidx, heading))
+        # name -> parsed section
+        self.wikicode = _ParsedSections(self) if wikicode is None else wikicode
+
+    def with_changed(self, changed):
+        """Same revision (sharing its parsed sections) with other sections flagged as changed."""
+        return ScannedRevision(self.wikitext, self.sections, changed, self.wikicode)
+
+    def get_text(self, sidx):
+        start, end, _ = self.sections[sidx]
+        return self.wikitext[start:end]
+
+
+class _ParsedSections(dict):
+    """Parsed sections of a ScannedRevision by name -- a section is parsed the first time it's looked up."""
+
+    def __init__(self, revision):
+        super(_ParsedSections, self).__init__()
+        self.revision = revision
+        self.index = {name: sidx for sidx, name in enumerate(revision.names)}
+
+    def __missing__(self, name):
+        wikicode = parse_wikitext(self.revision.get_text(self.index[name]))
+        self[name] = wikicode
+        return wikicode
+
+
+class _Scanner:
+    """
+    Recursive-descent scanner over wikitext that keeps track of the construct that is currently open.
+    Only the outermost nodes are recorded; anything within them is just matched to find where they end.
+    """
+
+    def __init__(self, text, lang="en"):
+        self.text = text
+        self.lang = lang
+        self.nodes = []  # (node type, start idx, end idx) of top-level nodes
+        # the first : in the text of a line that starts with ; is a list item too (; term : definition)
+        self.dd_pending = False
+
+    def scan(self):
+        end = self.scan_contents(0, None, 0)
+        if end != len(self.text):
+            raise AmbiguousWikitext(f"Unexpected closing markup at {end}")
+        # nodes are added once they've been scanned -- i.e. after any nodes nested within them
+        return sorted(self.nodes, key=lambda n: n[1])
+
+    def add(self, depth, ntype, start, end):
+        if depth == 0:
+            if self.dd_pending and "\n" in self.text[start:end]:
+                raise AmbiguousWikitext(
+                    f"Multi-line node in definition list at {start}"
+                )
+            self.nodes.append((ntype, start, end))
+
+    def check_text(self, start, end):
+        """Top-level text can't contain bare URLs -- they'd be nodes too."""
+        if FREE_URL.search(self.text, start, end):
+            raise AmbiguousWikitext(f"Bare URL in {start}-{end}")
+        if self.dd_pending:
+            dd_start = self.text.find(":", start, end)
+            if dd_start != -1:
+                self.dd_pending = False
+                self.nodes.append(("List", dd_start, dd_start + 1))
+
+    def scan_contents(self, pos, closer, depth):
+        """Scan from pos until closer (None for the end of the text) and return where closer starts.
+
+        closer is one of "]]" (wikilink), "]" (external link), "}}" (template), "}}}" (argument),
+        "|}" (table), or a closing tag -- e.g., "</ref>". Closers of any other construct are ambiguous.
+        """
+        if depth > MAX_DEPTH:
+            raise AmbiguousWikitext("Nested too deeply")
+        text = self.text
+        text_start = pos
+        line_start = pos == 0 or text[pos - 1] == "\n"
+        while True:
+            if line_start:
+                if depth == 0:
+                    self.check_text(text_start, pos)
+                pos = self.scan_line_start(pos, closer, depth)
+                if depth == 0:
+                    text_start = pos
+                if pos is None or (closer == "|}" and text.startswith("|}", pos)):
+                    return self.scan_end(text_start, pos, closer, depth)
+            m = SPECIAL_CHARS.search(text, pos)
+            if m is None:
+                if closer is not None:
+                    raise AmbiguousWikitext(f"Unclosed {closer}")
+                if depth == 0:
+                    self.check_text(text_start, len(text))
+                return len(text)
+            pos = m.start()
+            char = text[pos]
+            line_start = False
+            if char == "\n":
+                if closer in ("]]", "]"):
+                    raise AmbiguousWikitext(f"New line within link at {pos}")
+                pos += 1
+                line_start = True
+                continue
+            node_end = None
+            if char in "]}":
+                run = self.run_length(pos, char)
+                if closer is not None and closer[0] == char and run >= len(closer):
+                    if closer == "]]" and run == 3:
+                        raise AmbiguousWikitext(f"Ambiguous ]]] at {pos}")
+                    return self.scan_end(text_start, pos, closer, depth)
+                elif depth > 0 and run >= 2:
+                    raise AmbiguousWikitext(f"Stray {char * run} at {pos}")
+                pos += run
+                continue
+            elif char == "[":
+                node_end = self.scan_bracket(pos, depth)
+            elif char == "{":
+                node_end = self.scan_brace(pos, depth)
+            elif char == "<":
+                if closer is not None and closer.startswith("</"):
+                    if text[pos : pos + len(closer)].lower() == closer:
+                        return self.scan_end(text_start, pos, closer, depth)
+                node_end = self.scan_tag(pos, depth)
+            elif char == "&" and depth == 0:
+                node_end = self.scan_entity(pos, depth)
+            if node_end is None:
+                pos += 1
+            else:
+                if depth == 0:
+                    self.check_text(text_start, pos)
+                    text_start = node_end
+                pos = node_end
+
+    def scan_end(self, text_start, pos, closer, depth):
+        if closer is None:
+            pos = len(self.text) if pos is None else pos
+        elif pos is None:
+            raise AmbiguousWikitext(f"Unclosed {closer}")
+        if depth == 0 and text_start is not None:
+            self.check_text(text_start, pos)
+        return pos
+
+    def run_length(self, pos, char):
+        end = pos
+        while end < len(self.text) and self.text[end] == char:
+            end += 1
+        return end - pos
+
+    def scan_line_start(self, pos, closer, depth):
+        """Headings, lists, horizontal rules, and tables start at the beginning of a line.
+
+        Returns where scanning continues (None at the end of the text).
+        """
+        text = self.text
+        if pos >= len(text):
+            return None
+        table_start = pos
+        while table_start < len(text) and text[table_start] in " \t":
+            table_start += 1
+        if text.startswith("{|", table_start):
+            if depth > 0 and closer != "|}":
+                raise AmbiguousWikitext(f"Table within another construct at {pos}")
+            end = self.scan_contents(table_start + 2, "|}", depth + 1) + 2
+            self.add(depth, "Table", table_start, end)
+            return end
+        elif closer == "|}" and text.startswith("|}", table_start):
+            return table_start
+        if depth > 0:
+            # mwparserfromhell ends e.g. a template whose name runs into a heading or horizontal rule there
+            if text[pos] == "=" or text.startswith("----", pos):
+                raise AmbiguousWikitext(
+                    f"Heading or horizontal rule within another construct at {pos}"
+                )
+            return pos
+        self.dd_pending = False
+        char = text[pos]
+        if char == "=":
+            m = HEADING.match(text, pos)
+            if m is None or len(m.group(1)) != len(m.group(3)) or len(m.group(1)) > 6:
+                raise AmbiguousWikitext(f"Ambiguous heading at {pos}")
+            end = m.start(3) + len(m.group(3))
+            self.add(depth, "Heading", pos, end)
+            return end
+        elif char in "*#:;":
+            while pos < len(text) and text[pos] in "*#:;":
+                self.dd_pending = self.dd_pending or text[pos] == ";"
+                self.add(depth, "List", pos, pos + 1)
+                pos += 1
+            if text.startswith("{|", pos):
+                raise AmbiguousWikitext(f"Ambiguous list at {pos}")
+        elif text.startswith("----", pos):
+            end = pos + self.run_length(pos, "-")
+            self.add(depth, tag_node_class("hr"), pos, end)
+            return end
+        return pos
+
+    def scan_bracket(self, pos, depth):
+        """Wikilinks ([[title|text]]) and external links ([url text]); returns their end or None if neither."""
+        text = self.text
+        run = self.run_length(pos, "[")
+        if run == 1:
+            if not URL_START.match(text, pos + 1):
+                return None
+            url_end = pos + 1
+            while url_end < len(text) and text[url_end] not in " \t\n]":
+                url_end += 1
+            if URL_START.match(text, pos + 1).end() == url_end or re.search(
+                r"[\[{}<>\"]", text[pos + 1 : url_end]
+            ):
+                raise AmbiguousWikitext(f"Ambiguous external link at {pos}")
+            end = self.scan_contents(url_end, "]", depth + 1) + 1
+            self.add(depth, "ExternalLink", pos, end)
+            return end
+        elif run > 2:
+            raise AmbiguousWikitext(f"Ambiguous {'[' * run} at {pos}")
+        title_end = pos + 2
+        while title_end < len(text) and text[title_end] not in "|]\n[{}<>":
+            title_end += 1
+        title = text[pos + 2 : title_end]
+        if not title.strip() or not text.startswith(("|", "]]"), title_end):
+            raise AmbiguousWikitext(f"Ambiguous link title at {pos}")
+        end = self.scan_contents(title_end, "]]", depth + 1) + 2
+        self.add(depth, wikilink_node_class(title, self.lang), pos, end)
+        return end
+
+    def scan_brace(self, pos, depth):
+        """Templates ({{name|params}}) and arguments ({{{name|default}}}); returns their end or None if neither."""
+        text = self.text
+        run = self.run_length(pos, "{")
+        if run == 1:
+            return None
+        elif run > 3:
+            raise AmbiguousWikitext(f"Ambiguous {'{' * run} at {pos}")
+        name_end = pos + run
+        while name_end < len(text) and text[name_end] not in "|{}[]<>":
+            name_end += 1
+        closer = "}" * run
+        name = text[pos + run : name_end].strip()
+        # new-lines around the name are fine (e.g., {{Infobox\n|...}}) but not within it
+        if not name or "\n" in name or not text.startswith(("|", closer), name_end):
+            raise AmbiguousWikitext(f"Ambiguous template name at {pos}")
+        end = self.scan_contents(name_end, closer, depth + 1) + run
+        self.add(depth, "Template" if run == 2 else "Argument", pos, end)
+        return end
+
+    def scan_tag(self, pos, depth):
+        """Comments and tags; returns their end or None if it's just a < in text."""
+        text = self.text
+        if text.startswith("<!--", pos):
+            end = text.find("-->", pos + 4)
+            if end == -1:
+                raise AmbiguousWikitext(f"Unclosed comment at {pos}")
+            self.add(depth, "Comment", pos, end + 3)
+            return end + 3
+        elif text.startswith("</", pos):
+            raise AmbiguousWikitext(f"Stray closing tag at {pos}")
+        elif (
+            not text[pos + 1 : pos + 2].isascii()
+            or not text[pos + 1 : pos + 2].isalpha()
+        ):
+            return None
+        m = OPEN_TAG.match(text, pos)
+        if m is None:
+            raise AmbiguousWikitext(f"Ambiguous tag at {pos}")
+        tag = m.group(1).lower()
+        end = m.end()
+        if not m.group(3) and tag not in SINGLE_ONLY:
+            closer = f"</{tag}>"
+            if tag in PARSER_BLACKLIST:
+                # contents aren't parsed
+                m_close = re.compile(re.escape(closer), flags=re.IGNORECASE).search(
+                    text, end
+                )
+                if m_close is None:
+                    raise AmbiguousWikitext(f"Unclosed <{tag}> at {pos}")
+                end = m_close.end()
+            else:
+                end = self.scan_contents(end, closer, depth + 1) + len(closer)
+        self.add(depth, tag_node_class(tag), pos, end)
+        return end
+
+    def scan_entity(self, pos, depth):
+        """HTML entities (&amp;, &#123;, &#x7b;); returns their end or None if it's just a & in text."""
+        m = ENTITY.match(self.text, pos)
+        if m is None:
+            return None
+        name, dec, hexa = m.groups()
+        if name is not None:
+            if name not in name2codepoint:
+                raise AmbiguousWikitext(f"Ambiguous entity at {pos}")
+        elif (
+            not 0
+            < int(dec if dec is not None else hexa, 10 if dec is not None else 16)
+            <= 0x10FFFF
+        ):
+            raise AmbiguousWikitext(f"Ambiguous entity at {pos}")
+        self.add(depth, "HTMLEntity", pos, m.end())
+        return m.end()
@@ -2,22 +2,53 @@ import re
 
 import mwparserfromhell as mw
 
+from mwedittypes.scanner import (
+    AmbiguousWikitext,
+    ScannedRevision,
+    localize_changes,
+    scan_sections,
+)
 from mwedittypes.tokenizer import parse_change_text
 from mwedittypes.utils import (
+    content_hash,
     find_nested_media,
     node_to_name,
+    parse_wikitext,
     sec_to_name,
     simple_node_class,
+    text_to_name,
     wikitext_to_plaintext,
 )
 
+BACKENDS = ("mwparserfromhell", "scanner")
+
 
 # equivalent of main function
-def get_diff(prev_wikitext, curr_wikitext, lang="en"):
-    """Run through full process of getting diff between two wikitext revisions."""
-    prev_tree = WikitextBag(wikitext=prev_wikitext, lang=lang)
-    curr_tree = WikitextBag(wikitext=curr_wikitext, lang=lang)
-    d = Differ(prev_tree, curr_tree)
+def get_diff(
+    prev_wikitext,
+    curr_wikitext,
+    lang="en",
+    max_depth=None,
+    backend="mwparserfromhell",
+    localize=False,
+):
+    """Run through full process of getting diff between two wikitext revisions.
+
+    max_depth limits how many levels of nested nodes are expanded (see Node.unnest). None expands everything.
+    backend is how the top-level nodes of each revision are found (see WikitextBag).
+    If localize is True, sections that are identical in both revisions are skipped before anything is parsed
+    (see scanner.localize_changes) -- nodes in them would cancel out anyway so the counts are the same.
+    Passing a pair of scanner.ScannedRevision instead of wikitext diffs only their changed sections.
+    """
+    if localize and all(
+        isinstance(wt, (str, ScannedRevision)) for wt in (prev_wikitext, curr_wikitext)
+    ):
+        localized = localize_changes(prev_wikitext, curr_wikitext, lang, from_end=True)
+        if localized is not None:
+            prev_wikitext, curr_wikitext = localized
+    prev_tree = WikitextBag(wikitext=prev_wikitext, lang=lang, backend=backend)
+    curr_tree = WikitextBag(wikitext=curr_wikitext, lang=lang, backend=backend)
+    d = Differ(prev_tree, curr_tree, max_depth=max_depth)
     result = d.count_actions()
     return result
 
@@ -27,46 +58,56 @@ class Node:
     Basic object for wrapping mwparserfromhell wikitext nodes
     """
 
-    def __init__(self, name, ntype="Text", mwnode=None, section=None):
+    def __init__(self, name, ntype="Text", mwnode=None, section=None, text=None):
         self.name = name  # For debugging purposes
         self.ntype = ntype  # Type of node for result
         self.mwnode = mwnode
-        self.text = str(mwnode)  # Text that is needed if unnesting the node
+        # Text that is needed if unnesting the node -- passed in if the caller already has it (e.g., from the scanner)
+        self.text = str(mwnode) if text is None else text
         # Content hash is used for quickly computing equality for most nodes.
         # Generally this just a simple hash of self.text (wikitext associated with a node) but
         # the text hash for sections is based on all the content within the section
         # so it can be used for pruning while self.text is just the text that creates the section
         # e.g., "==Section==\nThis is a section." would have as text "==Section==" but hash the full.
         # so the Differ doesn't identify a section as changing when content within it is changed
-        self.content_hash = hash(self.text)
+        self.content_hash = content_hash(self.text)
         self.section = section  # section that the node is a part of -- useful for formatting final diff
 
-    def unnest(self, lang="en"):
+    def unnest(self, lang="en", max_depth=None):
         """Expand a node to also include all of its subnodes.
         This approach starts with a single wikitext node -- e.g., a single Tag node with nested link nodes etc.:
         <ref>{{cite web|title=[[Gallery]]|url=http://digital.belvedere.at|publisher=Digitales Belvedere}}</ref>
         and splits it into its component parts (ref, template, wikilink, externallink) to find fine-grained changes.
+        If max_depth is set, only subnodes nested at most that many levels deep are included -- e.g., with
+        max_depth=1 the example would only include the template (same nesting as the WikitextTree).
         """
         nodes = []
+        if max_depth is not None and max_depth < 1:
+            return nodes
+        if isinstance(self.mwnode, str):
+            return nodes  # e.g., text-formatting markup -- nothing nested within it
         # Using string mixin methods such as wt.find(x) for subnodes in the for
         # loop below means doing str(wt) everytime, which is expensive because
         # it recursively converts each node to str. Better to create a string using
         # the node's text and use built-in string methods instead.
+        text = self.text
+        # nodes are visited in pre-order so a node is nested in the most recent node that hasn't ended before it
+        # starts: stack of (end idx of node, depth below self) for the nodes that are still open
+        open_nodes = [(len(text), 0)]
+        # start of the latest node -- nodes are searched for from there
+        search_start = 0
         if self.ntype == "Gallery":
             # strip leading / trailing gallery tags so parser correctly parses everything in between
             # otherwise links, formatting, etc. is treated as text
-            gallery_start = self.text.find(">")
-            gallery_end = self.text.rfind("<")
+            gallery_start = text.find(">")
+            gallery_end = text.rfind("<")
             try:
                 # the <br> is a hack; it'll be skipped in the ifilter loop; otherwise first image skipped
-                wt = mw.parse(
-                    "<br>" + self.text[gallery_start + 1 : gallery_end],
-                    skip_style_tags=True,
-                )
+                wt = parse_wikitext("<br>" + text[gallery_start + 1 : gallery_end])
             except Exception:  # fallback
-                wt = mw.parse(self.mwnode)
+                wt = self.parse()
         else:
-            wt = mw.parse(self.mwnode)
+            wt = self.parse()
         for idx, nn in enumerate(wt.ifilter(recursive=True)):
             if idx == 0:
                 continue  # skip root node -- already set
@@ -92,110 +133,236 @@ class Node:
             elif ntype == "Table Element":
                 pass
             else:
+                # start looking from the start of the latest node (serializing the node only once)
+                nn_text = str(nn)
+                search_start = text.find(nn_text, search_start)
+                while len(open_nodes) > 1 and open_nodes[-1][0] <= search_start:
+                    open_nodes.pop()
+                depth = open_nodes[-1][1] + 1
+                open_nodes.append((search_start + len(nn_text), depth))
+                if max_depth is not None and depth > max_depth:
+                    continue
                 nn_node = Node(
                     node_to_name(nn, lang=lang),
                     ntype=ntype,
                     mwnode=nn,
                     section=self.section,
+                    text=nn_text,
                 )
                 nodes.append(nn_node)
         return nodes
 
+    def parse(self):
+        """Wikicode of the node -- only parsed if the node was found without mwparserfromhell (see scanner)."""
+        if self.mwnode is None:
+            return parse_wikitext(self.text)
+        return mw.parse(self.mwnode)
+
+
+class NodeMultiset:
+    """
+    Multiset of the nodes in a WikitextBag that share a content hash -- e.g., every '' in an article.
+
+    Nodes are kept as runs of (representative node, count): a node of the same type and section as the node
+    added just before it only increases the count of that run, so repeated nodes take constant time and memory.
+    Runs are in the order in which nodes were added so keeping the first k nodes (see keep) keeps the same
+    types and sections as a list of all of the nodes would.
+    """
+
+    __slots__ = ("runs", "count")
+
+    def __init__(self):
+        self.runs = []  # [representative node, count] in the order added
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """Yields (representative node, count) for each run."""
+        for node, count in self.runs:
+            yield node, count
+
+    def add(self, node, count=1):
+        if self.runs:
+            last = self.runs[-1]
+            if last[0].ntype == node.ntype and last[0].section == node.section:
+                last[1] += count
+                self.count += count
+                return
+        self.runs.append([node, count])
+        self.count += count
+
+    def keep(self, k):
+        """Drop all but the first k nodes."""
+        runs = []
+        remaining = k
+        for node, count in self.runs:
+            if remaining <= 0:
+                break
+            runs.append([node, min(count, remaining)])
+            remaining -= count
+        self.runs = runs
+        self.count = min(self.count, k)
+
 
 class WikitextBag:
     """
     Structure for extracting and holding an unordered collection of wikitext nodes based on mwparserfromhell
+
+    backend="scanner" finds the sections and top-level nodes with mwedittypes.scanner instead of parsing the
+    revision. Only nodes and sections that end up being expanded or compared as text are parsed then.
+    Revisions that the scanner can't handle with certainty are parsed with mwparserfromhell as usual.
+
+    wikitext can also be a scanner.ScannedRevision, in which case only the sections flagged as changed are
+    added -- e.g., to diff just the sections that differ between two revisions (see scanner.localize_changes).
     """
 
-    def __init__(self, wikitext, lang="en"):
+    def __init__(self, wikitext, lang="en", backend="mwparserfromhell"):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}")
         self.lang = lang
+        self.backend = backend
         self.secname_to_text = {}
-        self.nodes = {}
+        self.secname_to_wikicode = (
+            {}
+        )  # parsed sections -- so they don't need to be parsed again
+        self.nodes = {}  # content hash -> NodeMultiset
         self.wikitext_to_bagofnodes(wikitext)
 
+    def add_node(self, node, count=1):
+        """Add count copies of node to the bag."""
+        n_hash = node.content_hash
+        if n_hash not in self.nodes:
+            self.nodes[n_hash] = NodeMultiset()
+        self.nodes[n_hash].add(node, count)
+
     def wikitext_to_bagofnodes(self, wikitext):
         """Build bag of document nodes from Wikipedia article.
         Includes special Section nodes that will cover any changes made to that section.
         Excludes text, which will be processed later (and is captured by the Section nodes).
+        wikitext can also be an already-parsed article (Wikicode), which isn't modified.
         """
-        wt = mw.parse(wikitext, skip_style_tags=True)
+        wt = wikitext
+        if self.backend == "scanner" and isinstance(wt, str):
+            try:
+                wt = ScannedRevision(wikitext, scan_sections(wikitext, self.lang))
+            except AmbiguousWikitext:
+                pass  # fall back to parsing the whole revision
+        if isinstance(wt, ScannedRevision):
+            self.scanned_to_bagofnodes(wt)
+            return
+        if not isinstance(wt, mw.wikicode.Wikicode):
+            wt = parse_wikitext(wikitext)
         for sidx, s in enumerate(wt.get_sections(flat=True)):
             if s:
-                sec_id = sec_to_name(s, sidx)
-                s_node = Node(sec_id, ntype="Section", mwnode=s, section=sec_id)
-                self.secname_to_text[sec_id] = s_node.text
-                self.nodes[s_node.content_hash] = self.nodes.get(
-                    s_node.content_hash, []
-                ) + [s_node]
-                for (
-                    n
-                ) in (
-                    s.nodes
-                ):  # this is just top-level of nodes so e.g., table but not all the table rows etc.
-                    ntype = simple_node_class(n, self.lang)
-                    if ntype != "Text":
-                        n_node = Node(
-                            node_to_name(n, self.lang),
-                            ntype=ntype,
-                            mwnode=n,
+                self.add_parsed_section(sec_to_name(s, sidx), s)
+
+    def add_parsed_section(self, sec_id, s):
+        """Add a section (parsed by mwparserfromhell) and the nodes directly within it."""
+        s_node = Node(sec_id, ntype="Section", mwnode=s, section=sec_id)
+        self.secname_to_text[sec_id] = s_node.text
+        self.secname_to_wikicode[sec_id] = s
+        self.add_node(s_node)
+        # this is just top-level of nodes so e.g., table but not all the table rows etc.
+        for n in s.nodes:
+            ntype = simple_node_class(n, self.lang)
+            if ntype != "Text":
+                n_node = Node(
+                    node_to_name(n, self.lang),
+                    ntype=ntype,
+                    mwnode=n,
+                    section=s_node.name,
+                )
+                self.add_node(n_node)
+        self.add_text_formatting(s_node)
+
+    def scanned_to_bagofnodes(self, revision):
+        """Build bag of document nodes from the sections of a ScannedRevision that are flagged as changed.
+
+        With backend="scanner", the nodes found by the scanner are used and sections are only parsed if
+        their text is needed (see Differ.count_actions).
+        """
+        wikitext = revision.wikitext
+        # sections are parsed when first looked up
+        self.secname_to_wikicode = revision.wikicode
+        for sidx, (sec_start, sec_end, sec_nodes) in enumerate(revision.sections):
+            if sec_start == sec_end or not revision.changed[sidx]:
+                continue
+            sec_id = revision.names[sidx]
+            if self.backend != "scanner":
+                self.add_parsed_section(sec_id, revision.wikicode[sec_id])
+                continue
+            s_node = Node(
+                sec_id,
+                ntype="Section",
+                section=sec_id,
+                text=wikitext[sec_start:sec_end],
+            )
+            self.secname_to_text[sec_id] = s_node.text
+            self.add_node(s_node)
+            for ntype, n_start, n_end in sec_nodes:
+                n_text = wikitext[n_start:n_end]
+                n_node = Node(
+                    text_to_name(n_text, ntype),
+                    ntype=ntype,
+                    section=sec_id,
+                    text=n_text,
+                )
+                self.add_node(n_node)
+            self.add_text_formatting(s_node)
+
+    def add_text_formatting(self, s_node):
+        """Add the text-formatting markup (e.g., '' for italics) within a section -- it's text to the parser."""
+        if "''" in s_node.text:
+            for line in s_node.text.split("\n"):
+                if "''" in line:
+                    line, bt_found = re.subn("'{5}", "", line)
+                    if bt_found // 2:
+                        tfn = Node(
+                            "Bold-Italic",
+                            ntype="Text Formatting",
+                            mwnode="'''''",
+                            section=s_node.name,
+                        )
+                        self.add_node(tfn, count=bt_found // 2)
+                    line, b_found = re.subn("'{3}", "", line)
+                    if b_found // 2:
+                        tfn = Node(
+                            "Bold",
+                            ntype="Text Formatting",
+                            mwnode="'''",
+                            section=s_node.name,
+                        )
+                        self.add_node(tfn, count=b_found // 2)
+                    line, t_found = re.subn("'{2}", "", line)
+                    if t_found // 2:
+                        tfn = Node(
+                            "Italic",
+                            ntype="Text Formatting",
+                            mwnode="''",
                             section=s_node.name,
                         )
-                        self.nodes[n_node.content_hash] = self.nodes.get(
-                            n_node.content_hash, []
-                        ) + [n_node]
-                if "''" in s_node.text:
-                    for line in s_node.text.split("\n"):
-                        if "''" in line:
-                            line, bt_found = re.subn("'{5}", "", line)
-                            for _ in range(bt_found // 2):
-                                tfn = Node(
-                                    "Bold-Italic",
-                                    ntype="Text Formatting",
-                                    mwnode="'''''",
-                                    section=s_node.name,
-                                )
-                                self.nodes[tfn.content_hash] = self.nodes.get(
-                                    tfn.content_hash, []
-                                ) + [tfn]
-                            line, b_found = re.subn("'{3}", "", line)
-                            for _ in range(b_found // 2):
-                                tfn = Node(
-                                    "Bold",
-                                    ntype="Text Formatting",
-                                    mwnode="'''",
-                                    section=s_node.name,
-                                )
-                                self.nodes[tfn.content_hash] = self.nodes.get(
-                                    tfn.content_hash, []
-                                ) + [tfn]
-                            line, t_found = re.subn("'{2}", "", line)
-                            for _ in range(t_found // 2):
-                                tfn = Node(
-                                    "Italic",
-                                    ntype="Text Formatting",
-                                    mwnode="''",
-                                    section=s_node.name,
-                                )
-                                self.nodes[tfn.content_hash] = self.nodes.get(
-                                    tfn.content_hash, []
-                                ) + [tfn]
-
-    def expand_nested(self):
-        """Expand nested nodes in tree -- e.g., Ref tags with templates/links contained in them."""
-        to_add = {}
-        for n_hash in self.nodes:
-            for n in self.nodes[n_hash]:
+                        self.add_node(tfn, count=t_found // 2)
+
+    def expand_nested(self, max_depth=None):
+        """Expand nested nodes in tree -- e.g., Ref tags with templates/links contained in them.
+        If max_depth is set, stop at that many levels of nesting below the top-level nodes.
+        """
+        to_add = []
+        for multiset in self.nodes.values():
+            for n, count in multiset:
                 if n.ntype not in (
                     "Section",
                     "Heading",
                     "Text",
                 ):  # leaves tag, link, etc.
-                    for nn in n.unnest(self.lang):
-                        to_add[nn.content_hash] = to_add.get(nn.content_hash, []) + [nn]
+                    # identical nodes have identical nested nodes so each run is only unnested once
+                    for nn in n.unnest(self.lang, max_depth=max_depth):
+                        to_add.append((nn, count))
 
-        for n_hash in to_add:
-            for n in to_add[n_hash]:
-                self.nodes[n_hash] = self.nodes.get(n_hash, []) + [n]
+        for nn, count in to_add:
+            self.add_node(nn, count)
 
 
 class Differ:
@@ -203,9 +370,12 @@ class Differ:
     Find structural differences between two WikitextBags
     """
 
-    def __init__(self, t1, t2, expand_nodes=True):
+    def __init__(self, t1, t2, expand_nodes=True, max_depth=None):
         self.t1 = t1
         self.t2 = t2
+        self.max_depth = (
+            max_depth  # levels of nested nodes to expand; None: all of them
+        )
         self.diff(expand_nodes=expand_nodes)
 
     def diff(self, expand_nodes=True):
@@ -213,8 +383,8 @@ class Differ:
         self.sym_diff()
         if expand_nodes:
             # expand out changed nodes and re-diff
-            self.t1.expand_nested()
-            self.t2.expand_nested()
+            self.t1.expand_nested(max_depth=self.max_depth)
+            self.t2.expand_nested(max_depth=self.max_depth)
             self.sym_diff()
 
     def sym_diff(self):
@@ -233,11 +403,11 @@ class Differ:
                 # extras in t1: remove from t2 and keep just extras in t1
                 elif diff > 0:
                     t2n.pop(n_hash)
-                    t1n[n_hash] = t1n[n_hash][:diff]
+                    t1n[n_hash].keep(diff)
                 # extras in t2: remove from t1 and keep just extras in t2
                 elif diff < 0:
                     t1n.pop(n_hash)
-                    t2n[n_hash] = t2n[n_hash][: abs(diff)]
+                    t2n[n_hash].keep(abs(diff))
         # no need to loop through t2n because what's left in it doesn't have any matches
 
     def count_actions(self):
@@ -248,15 +418,15 @@ class Differ:
 
         # aggregate by node type to identify non-matching nodes
         prev_ntypes = {}
-        for n_hash in self.t1.nodes:
-            for n in self.t1.nodes[n_hash]:
-                prev_ntypes[n.ntype] = prev_ntypes.get(n.ntype, 0) + 1
+        for multiset in self.t1.nodes.values():
+            for n, count in multiset:
+                prev_ntypes[n.ntype] = prev_ntypes.get(n.ntype, 0) + count
                 if n.ntype == "Section":
                     prev_text_sections.add(n.section)
         curr_ntypes = {}
-        for n_hash in self.t2.nodes:
-            for n in self.t2.nodes[n_hash]:
-                curr_ntypes[n.ntype] = curr_ntypes.get(n.ntype, 0) + 1
+        for multiset in self.t2.nodes.values():
+            for n, count in multiset:
+                curr_ntypes[n.ntype] = curr_ntypes.get(n.ntype, 0) + count
                 if n.ntype == "Section":
                     curr_text_sections.add(n.section)
 
@@ -275,12 +445,19 @@ class Differ:
                 edit_types[n_type]["insert"] = ins
 
         lang = self.t1.lang
+        # sections in the order they appear in the article (secname_to_text is filled in that order)
         prev_text = ""
-        for s in prev_text_sections:
-            prev_text += wikitext_to_plaintext(self.t1.secname_to_text[s], lang=lang)
+        for s in self.t1.secname_to_text:
+            if s in prev_text_sections:
+                prev_text += wikitext_to_plaintext(
+                    self.t1.secname_to_wikicode[s], lang=lang
+                )
         curr_text = ""
-        for s in curr_text_sections:
-            curr_text += wikitext_to_plaintext(self.t2.secname_to_text[s], lang=lang)
+        for s in self.t2.secname_to_text:
+            if s in curr_text_sections:
+                curr_text += wikitext_to_plaintext(
+                    self.t2.secname_to_wikicode[s], lang=lang
+                )
 
         text_changes = parse_change_text(prev_text, curr_text, lang=lang)
         edit_types.update(text_changes)
@@ -1,78 +1,95 @@
+import os
 import re
 import string
+import threading
 from collections import Counter
 
 from mwconstants import NON_WHITESPACE_LANGUAGES
 
 from mwedittypes.constants import (
     ENGLISH_UNICODE,
+    NON_ENGLISH_FULL_STOPS,
     NON_ENGLISH_UNICODE,
     SENTENCE_BREAKS_REGEX,
 )
 
+# Get words with optionally hyphens and apostrophe:
+# \b - word breaks at start and end of word
+# [\w...]+ - matches 1 or more alphanumeric characters
+# \w captures most characters with some exceptions, especially for languages with spacing characters
+# \u0980-\u09FF represents Bengali
+# \u0901-\u0963 represents Devanagari (Hindi, Marathi, etc.)
+# [-']? allows for hyphen/apostrophes within word
+# (?:(?:...)+) group made up of 1+ non-capturing sequences of alphanumeric + hyphen/apostrophe. this allows for
+# many-time-hyphenated words and the group is non-capturing so the entire word is matched (a capturing group would
+# only capture the last instance)
+WORD_CHARS = r"\w\u0980-\u09FF\u0901-\u0963"
+WORD_REGEX = rf"\b(?:[{WORD_CHARS}]+[-']?)+\b"
+WORD_PATTERN = re.compile(WORD_REGEX, re.UNICODE)
+WHITESPACE_REGEX = re.compile(r"[\s]")
+WORD_CHARACTER_REGEX = re.compile(r"[\w]")
+ENGLISH_PUNCTUATION_REGEX = r"[{0}]".format(re.escape(string.punctuation))
+ELLIPSIS_PATTERN = re.compile(r"\.{3,}")
+SENTENCE_BREAKS_PATTERN = re.compile(SENTENCE_BREAKS_REGEX)
+PARAGRAPH_BREAK_PATTERN = re.compile(r"\n{2}")
+# minimum sentence size is two words, otherwise contributes to words etc. but not sentences
+MIN_SENTENCE_SIZE = 2
+
 
 class Tokenizer:
+    """Counts the text tokens of one language -- all regexes are compiled up front so that one instance can be
+    shared by every diff (see get_tokenizer). Besides filling in a cache of which punctuation classes each
+    character is in, instances are not modified after they are built so they can be used from several threads.
+    """
+
     def __init__(self, english_unicode, non_english_unicode, lang="en"):
-        self.english_punc_regex = r"[{0}]".format(re.escape(string.punctuation))
+        self.english_punc_regex = ENGLISH_PUNCTUATION_REGEX
         self.english_unicode = english_unicode
         self.non_english_unicode = non_english_unicode
         self.lang = lang
+        self.non_whitespace_language = lang in NON_WHITESPACE_LANGUAGES
+
+        if self.non_whitespace_language:
+            self.word_regex = WORD_CHARACTER_REGEX
+        else:
+            self.word_regex = WORD_PATTERN
+        # single-pass scanner for tokenize_and_get_occurrence -- see token_pattern()
+        self.token_regex = re.compile(token_pattern(lang), re.UNICODE)
+        self.punctuation_patterns = [
+            re.compile(p, re.UNICODE)
+            for p in (self.english_punc_regex, english_unicode, non_english_unicode)
+        ]
+        # character -> indices of the punctuation patterns that it matches (usually none)
+        self.punctuation_classes = {}
 
     def get_punctuations(self, text):
         # get ellipses
-        ellipses = re.findall(r"\.{3,}", text)
-        text = re.sub(r"\.{3,}", "", text)
-
-        # get other punctuation
-        english_punc_regex = re.findall(self.english_punc_regex, text)
-
-        english_unicode_pattern = re.compile(self.english_unicode, re.UNICODE)
-        english_unicode_regex = re.findall(english_unicode_pattern, text)
-
-        non_english_unicode_pattern = re.compile(self.non_english_unicode, re.UNICODE)
-        non_english_punc_regex = re.findall(non_english_unicode_pattern, text)
+        ellipses = ELLIPSIS_PATTERN.findall(text)
+        text = ELLIPSIS_PATTERN.sub("", text)
 
-        return (
-            ellipses
-            + english_punc_regex
-            + english_unicode_regex
-            + non_english_punc_regex
-        )
+        # get other punctuation: English, English unicode, and non-English unicode
+        punctuation = ellipses
+        for pattern in self.punctuation_patterns:
+            punctuation += pattern.findall(text)
+        return punctuation
 
     def get_whitespace(self, text):
         # Get whitespaces. Detects newlines, return characters as well as spaces as whitespaces.
-        whitespace = re.findall(r"[\s]", text)
+        whitespace = WHITESPACE_REGEX.findall(text)
         return whitespace
 
     def get_words(self, text):
         # This extracts words inclusive of those with hyphens and apostrophes
-        if self.lang in NON_WHITESPACE_LANGUAGES:
-            word_list = re.findall(r"[\w]", text)
-
-        else:
-            # Get words with optionally hyphens and apostrophe:
-            # \b - word breaks at start and end of word
-            # [\w...]+ - matches 1 or more alphanumeric characters
-            # \w captures most characters with some exceptions, especially for languages with spacing characters
-            # \u0980-\u09FF represents Bengali
-            # \u0901-\u0963 represents Devanagari (Hindi, Marathi, etc.)
-            # [-']? allows for hyphen/apostrophes within word
-            # ((?:...)+) capturing group (extract words) made up of 1+ non-capturing sequences of alphanumeric +
-            # hyphen/apostrophe. this allows for many-time-hyphenated words and the non-capturing wrapped in capturing
-            # is to only gather the entire word (otherwise capturing groups only capture the last instance)
-            word_list = re.findall(
-                r"\b((?:[\w\u0980-\u09FF\u0901-\u0963]+[-']?)+)\b", text
-            )
+        # (or single characters for languages without whitespace between words)
+        word_list = self.word_regex.findall(text)
         return word_list
 
     def get_sentences(self, text):
-        # minimum sentence size is two words, otherwise contributes to words etc. but not sentences
         # we ignored leading/trailing whitespace differences on sentences when comparing as those aren't really changes
         # the whitespace differences are still captured by the whitespace counts
-        min_sentence_size = 2
-        sentences = re.split(SENTENCE_BREAKS_REGEX, text)
+        sentences = SENTENCE_BREAKS_PATTERN.split(text)
         sentences = [
-            s.strip() for s in sentences if len(self.get_words(s)) >= min_sentence_size
+            s.strip() for s in sentences if len(self.get_words(s)) >= MIN_SENTENCE_SIZE
         ]
         return sentences
 
@@ -80,41 +97,179 @@ class Tokenizer:
         if text != "":
             paragraphs = [
                 p.strip()
-                for p in re.split(r"\n{2}", text)
+                for p in PARAGRAPH_BREAK_PATTERN.split(text)
                 if len(self.get_words(p)) > 0
             ]
             return paragraphs
         return []
 
     def tokenize_and_get_occurrence(self, text):
-        whitespaces = self.get_whitespace(text)
-        punctuation = self.get_punctuations(text)
-        words = self.get_words(text)
-        sentences = self.get_sentences(text)
-        paragraphs = self.get_paragraphs(text)
-
-        whitespace_occurrence = Counter(whitespaces)
-        punctuation_occurrence = Counter(punctuation)
-        words_occurrence = Counter(words)
-        sentences_occurrence = Counter(sentences)
-        paragraphs_occurrence = Counter(paragraphs)
-
-        if self.lang in NON_WHITESPACE_LANGUAGES:
+        """Count the whitespace, punctuation, words, sentences, and paragraphs of text in a single scan.
+
+        Gives the same counts as the separate get_* methods: every word lies between two sentence breaks
+        and two paragraph breaks (neither of which contains word characters), so counting the words as
+        they are scanned says whether each sentence/paragraph is long enough without tokenizing it again.
+        """
+        non_whitespace_language = self.non_whitespace_language
+        ellipses = []
+        ellipsis_spans = []
+        words = []
+        sentences = []
+        paragraphs = []
+        sentence_start = paragraph_start = 0
+        sentence_words = paragraph_words = 0
+        for m in self.token_regex.finditer(text):
+            kind = m.lastgroup
+            if kind == "separator":  # a word and any whitespace/punctuation after it
+                if non_whitespace_language:
+                    num_words = m.end("word") - m.start()
+                else:
+                    words.append(m.group("word"))
+                    num_words = 1
+                sentence_words += num_words
+                paragraph_words += num_words
+            elif kind == "ellipsis":
+                ellipses.append(m.group())
+                ellipsis_spans.append(m.span())
+            elif kind == "sentence_break":
+                token = m.group()
+                if sentence_words >= MIN_SENTENCE_SIZE:
+                    sentences.append(text[sentence_start : m.start()].strip())
+                sentence_start = m.end()
+                sentence_words = 0
+                # newlines are always part of a sentence break so it holds any paragraph breaks too
+                idx = token.find("\n\n")
+                while idx != -1:
+                    if paragraph_words > 0:
+                        paragraphs.append(
+                            text[paragraph_start : m.start() + idx].strip()
+                        )
+                    paragraph_start = m.start() + idx + 2
+                    paragraph_words = 0
+                    idx = token.find("\n\n", idx + 2)
+        if sentence_words >= MIN_SENTENCE_SIZE:
+            sentences.append(text[sentence_start:].strip())
+        if paragraph_words > 0:
+            paragraphs.append(text[paragraph_start:].strip())
+
+        # whitespace, punctuation (besides ellipses), and characters are counted from a histogram of the text,
+        # which is in order of first appearance like the findall results of the get_* methods
+        if ellipses:
+            ends = [0] + [end for _, end in ellipsis_spans]
+            starts = [start for start, _ in ellipsis_spans] + [len(text)]
+            text = "".join(text[end:start] for end, start in zip(ends, starts))
+        char_occurrence = Counter(text)
+        whitespace_occurrence = {
+            char: count for char, count in char_occurrence.items() if char.isspace()
+        }
+        punctuation = []
+        for char, count in char_occurrence.items():
+            classes = self.punctuation_classes.get(char)
+            if classes is None:
+                classes = self.get_punctuation_classes(char)
+            if classes:
+                punctuation.append((classes, char, count))
+        # ordered by class and then by first appearance (sort is stable); a character that is in more than one
+        # class counts once per class
+        punctuation.sort(key=lambda p: p[0][0])
+        punctuation_occurrence = Counter(ellipses)
+        for classes, char, count in punctuation:
+            punctuation_occurrence[char] += count * len(classes)
+
+        if non_whitespace_language:
+            # every word character is part of a run so this is the same as counting the runs' characters
+            words_occurrence = {
+                char: count
+                for char, count in char_occurrence.items()
+                if WORD_CHARACTER_REGEX.match(char)
+            }
             word_key = "Character"
         else:
+            words_occurrence = Counter(words)
             word_key = "Word"
         return {
-            "Whitespace": dict(whitespace_occurrence),
+            "Whitespace": whitespace_occurrence,
             "Punctuation": dict(punctuation_occurrence),
             word_key: dict(words_occurrence),
-            "Sentence": dict(sentences_occurrence),
-            "Paragraph": dict(paragraphs_occurrence),
+            "Sentence": dict(Counter(sentences)),
+            "Paragraph": dict(Counter(paragraphs)),
         }
 
+    def get_punctuation_classes(self, char):
+        # setting a dict item is atomic so threads that look up the same new character just store the same value
+        classes = tuple(
+            i for i, p in enumerate(self.punctuation_patterns) if p.match(char)
+        )
+        self.punctuation_classes[char] = classes
+        return classes
+
+
+def token_pattern(lang="en"):
+    """Regex that splits text into the tokens counted by Tokenizer.tokenize_and_get_occurrence.
+
+    Alternatives (in order):
+    * word + separator: a word (or run of characters for languages without whitespace between words) as in
+      Tokenizer.get_words followed by any characters that can start neither a word nor a sentence break
+    * ellipsis: as in Tokenizer.get_punctuations
+    * sentence_break: as in Tokenizer.get_sentences
+    * other: a run of characters that can start neither a word nor a sentence break or else a single character
+      (e.g., a full stop that does not end a sentence or a word character that does not start a word)
+    """
+    if lang in NON_WHITESPACE_LANGUAGES:
+        word = r"\w+"
+        word_chars = r"\w"
+    else:
+        word = WORD_REGEX
+        word_chars = WORD_CHARS
+    separator = rf"[^{word_chars}.!?\n{NON_ENGLISH_FULL_STOPS}]"
+    return (
+        rf"(?P<word>{word})(?P<separator>{separator}*)"
+        r"|(?P<ellipsis>\.{3,})"
+        rf"|(?P<sentence_break>{SENTENCE_BREAKS_REGEX})"
+        rf"|(?P<other>{separator}+|(?s:.))"
+    )
+
+
+# lang -> Tokenizer shared by every diff in this process -- see get_tokenizer
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+
+
+def _reset_tokenizers_lock():
+    # a child forked while another thread was building a tokenizer would otherwise inherit a lock that is never
+    # released -- the tokenizers themselves are complete (or missing) so they can be kept
+    global _tokenizers_lock
+    _tokenizers_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_tokenizers_lock)
+
+
+def get_tokenizer(lang="en"):
+    """Tokenizer for a language -- built the first time it is needed in this process and then reused.
+
+    Safe to call from several threads: each language's tokenizer is only built once.
+    """
+    tokenizer = _tokenizers.get(lang)
+    if tokenizer is None:
+        with _tokenizers_lock:
+            tokenizer = _tokenizers.get(lang)
+            if tokenizer is None:
+                tokenizer = Tokenizer(ENGLISH_UNICODE, NON_ENGLISH_UNICODE, lang=lang)
+                _tokenizers[lang] = tokenizer
+    return tokenizer
+
+
+def preload_tokenizers(langs=("en",)):
+    """Build the tokenizers for these languages now -- e.g., before forking worker processes so that each
+    worker inherits them instead of compiling its own."""
+    for lang in langs:
+        get_tokenizer(lang)
+
 
 def parse_change_text(prev_wikitext="", curr_wikitext="", lang="en", summarize=True):
-    # Initialize tokenizer class
-    tokenizer = Tokenizer(ENGLISH_UNICODE, NON_ENGLISH_UNICODE, lang=lang)
+    tokenizer = get_tokenizer(lang)
 
     prev_tokenizer = tokenizer.tokenize_and_get_occurrence(prev_wikitext)
     curr_tokenizer = tokenizer.tokenize_and_get_occurrence(curr_wikitext)
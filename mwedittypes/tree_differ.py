@@ -1,11 +1,20 @@
+import functools
+import time
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import mwparserfromhell as mw
-from anytree import NodeMixin, PostOrderIter
-from anytree.util import leftsibling
 
+from mwedittypes.constants import NODE_MARKUP_PATTERN
+from mwedittypes.scanner import ScannedRevision, localize_changes
 from mwedittypes.utils import (
+    blake2b_fingerprint,
+    content_hash,
     find_nested_media,
     find_nested_textformatting,
     node_to_name,
+    parse_wikitext,
     sec_to_name,
     simple_node_class,
     wikitext_to_plaintext,
@@ -13,24 +22,395 @@ from mwedittypes.utils import (
 
 
 # equivalent of main function
-def get_diff(prev_wikitext, curr_wikitext, lang="en", timeout=False):
-    """Run through full process of getting tree diff between two wikitext revisions."""
+def get_diff(
+    prev_wikitext,
+    curr_wikitext,
+    lang="en",
+    timeout=False,
+    engine="python",
+    max_distance=None,
+    stage=None,
+    budget=None,
+    by_section=False,
+    algorithm="exact",
+    memo=None,
+    workers=None,
+    max_depth=None,
+    parsed=None,
+    localize=False,
+):
+    """Run through full process of getting tree diff between two wikitext revisions.
+
+    engine selects the implementation of the tree-edit-distance kernel:
+    * python: pure-Python Zhang-Shasha (default)
+    * numpy: same algorithm with the distance tables held in NumPy arrays (requires numpy)
+
+    If max_distance is set, raises MaxDistanceExceeded as soon as it is clear that more than max_distance
+    node transactions are needed -- e.g., so the caller can fall back to the simple differ.
+
+    stage fixes how much detail is diffed (see STAGES) instead of relying on the timeout heuristic.
+    If a Budget is passed, raises BudgetExceeded as soon as the diff would go over it.
+    The stage that was used is recorded in the result.
+
+    algorithm="fast" replaces the tree edit distance by matching nodes directly (see MatchDiffer), which is
+    roughly linear for shallow trees such as wikitext but may report more node edits than needed.
+    engine is ignored in that case.
+
+    A DistanceMemo can be passed as memo to reuse tree distances between identical pairs of sub-trees
+    across several diffs (e.g., a batch of revisions of the same article). Only used by engine="python".
+
+    If by_section is True, sections are aligned first and each pair of changed sections is diffed separately
+    (see SectionDiffer), which is much cheaper for large articles with edits spread over several sections.
+    If workers is more than 1, the pairs of sections are diffed in parallel by a pool of that many processes
+    (implies by_section).
+
+    max_depth limits how many levels of nested nodes (e.g., links in a template in a reference) are expanded
+    when diffing at stage "full" (see OrderedNode.unnest). None expands everything.
+
+    Each revision is parsed once (or not at all if passed as Wikicode) and the parsed sections/nodes are
+    reused for everything else. If a dict is passed as parsed, it is filled with the parsed node for the
+    wikitext of each node in the result so that node_differ.get_diff_count doesn't have to parse them again.
+
+    If localize is True, the sections of both revisions are found without parsing (see scanner.localize_changes)
+    and only the sections that aren't identical in both revisions are parsed. The differs reduce identical
+    sections to a single node anyway (see Differ.prune_sections) so the result is the same as diffing the full
+    revisions but the cost of parsing and building the trees depends on the size of the edit instead.
+    Revisions can also be passed as scanner.ScannedRevision -- e.g., to share the parsed sections across diffs.
+    """
+    if localize and all(
+        isinstance(wt, (str, ScannedRevision)) for wt in (prev_wikitext, curr_wikitext)
+    ):
+        localized = localize_changes(prev_wikitext, curr_wikitext, lang)
+        if localized is not None:
+            prev_wikitext, curr_wikitext = localized
     # To provide proper structure, need all content to be nested under a section
     prev_tree = WikitextTree(wikitext=prev_wikitext, lang=lang)
     curr_tree = WikitextTree(wikitext=curr_wikitext, lang=lang)
-    d = Differ(prev_tree, curr_tree, timeout=timeout)
+    if by_section or (workers is not None and workers > 1):
+        d = SectionDiffer(
+            prev_tree,
+            curr_tree,
+            differ=get_differ(engine, algorithm),
+            timeout=timeout,
+            max_distance=max_distance,
+            stage=stage,
+            budget=budget,
+            memo=memo,
+            workers=workers,
+            max_depth=max_depth,
+        )
+    else:
+        d = get_differ(engine, algorithm)(
+            prev_tree,
+            curr_tree,
+            timeout=timeout,
+            max_distance=max_distance,
+            stage=stage,
+            budget=budget,
+            memo=memo,
+            max_depth=max_depth,
+        )
     diff = d.get_corresponding_nodes()
     result = diff.post_process(
-        prev_tree.secname_to_text, curr_tree.secname_to_text, lang=lang
+        prev_tree.secname_to_text,
+        curr_tree.secname_to_text,
+        lang=lang,
+        wikicode_prev=prev_tree.secname_to_wikicode,
+        wikicode_curr=curr_tree.secname_to_wikicode,
     )
+    if parsed is not None:
+        parsed.update(diff.parsed)
     return result
 
 
-class OrderedNode(NodeMixin):
+def get_differ(engine="python", algorithm="exact"):
+    """Get the Differ class that implements a given tree-diff engine / algorithm ("exact" or "fast")."""
+    if algorithm == "fast":
+        from mwedittypes.match_differ import MatchDiffer
+
+        return MatchDiffer
+    elif algorithm != "exact":
+        raise ValueError(f"Unknown tree-diff algorithm: {algorithm}")
+    if engine == "python":
+        return Differ
+    elif engine == "numpy":
+        from mwedittypes.numpy_differ import NumpyDiffer
+
+        return NumpyDiffer
+    raise ValueError(f"Unknown tree-diff engine: {engine}")
+
+
+# Levels of detail for a structured diff, from most to least detailed:
+# * full: all nodes including nested ones -- e.g., templates within references
+# * top-level: only nodes that sit directly within a section
+# * sections: only the sections themselves
+STAGES = ("full", "top-level", "sections")
+
+
+def longest_increasing_subsequence(seq):
+    """Indices of a longest strictly increasing subsequence of seq -- O(n log n) via patience sorting."""
+    tails = []  # values of smallest tail for each subsequence length
+    tail_idx = []  # index into seq of each of those tails
+    predecessor = [None] * len(seq)
+    for k, value in enumerate(seq):
+        length = bisect_left(tails, value)
+        predecessor[k] = tail_idx[length - 1] if length else None
+        if length == len(tails):
+            tails.append(value)
+            tail_idx.append(k)
+        else:
+            tails[length] = value
+            tail_idx[length] = k
+    lis = []
+    k = tail_idx[-1] if tail_idx else None
+    while k is not None:
+        lis.append(k)
+        k = predecessor[k]
+    return lis[::-1]
+
+
+def heaviest_increasing_subsequence(seq, weights):
+    """Indices of a strictly increasing subsequence of seq with the largest total weight -- O(n log n).
+
+    seq is made up of distinct non-negative ints (e.g., positions in another list). A Fenwick tree over the
+    values holds the heaviest subsequence that ends at or below each value. Ties go to the subsequence whose
+    last item is earliest in seq, which is the one the tree differ picks when it unwinds the transactions
+    from the end (see get_transactions: removes win ties).
+    """
+    size = max(seq, default=-1) + 1
+    # Fenwick tree of (total weight, -index into seq of the last item) -- so max() breaks ties as above
+    heaviest = [(0, 1)] * (size + 1)
+    predecessor = [None] * len(seq)
+    best = (0, 1)
+    for k, (value, weight) in enumerate(zip(seq, weights)):
+        prev = (0, 1)
+        v = value  # heaviest subsequence that ends below value
+        while v > 0:
+            prev = max(prev, heaviest[v])
+            v -= v & -v
+        if prev[1] <= 0:
+            predecessor[k] = -prev[1]
+        entry = (prev[0] + weight, -k)
+        best = max(best, entry)
+        v = value + 1
+        while v <= size:
+            heaviest[v] = max(heaviest[v], entry)
+            v += v & -v
+    subsequence = []
+    k = -best[1] if best[1] <= 0 else None
+    while k is not None:
+        subsequence.append(k)
+        k = predecessor[k]
+    return subsequence[::-1]
+
+
+def innermost_ranges(ranges, spans):
+    """For each (start, end) span, index of the most recent range in ranges that contains it (None if none).
+
+    ranges are (start, end) tuples in order of non-decreasing start -- e.g., nodes in pre-order -- and spans
+    are sorted by start. Ranges are added as the spans move forward and a range is dropped as soon as a more
+    recent range ends no earlier (that one contains everything it contains), so the ranges that are left
+    end in decreasing order and each span is a binary search: O((n + m) log n) overall.
+    """
+    parents = []
+    candidates = []  # indices into ranges; their ends are decreasing
+    neg_ends = []  # -end of each candidate so that it can be bisected
+    k = 0
+    for span_start, span_end in spans:
+        while k < len(ranges) and ranges[k][0] <= span_start:
+            while neg_ends and -neg_ends[-1] <= ranges[k][1]:
+                candidates.pop()
+                neg_ends.pop()
+            candidates.append(k)
+            neg_ends.append(-ranges[k][1])
+            k += 1
+        # last candidate that ends at or after the span
+        pos = bisect_right(neg_ends, -span_end) - 1
+        parents.append(candidates[pos] if pos >= 0 else None)
+    return parents
+
+
+def estimate_complexity(tree):
+    """Cheap estimate of how large a WikitextTree and its tree diff are once nested nodes are expanded.
+
+    Nested nodes aren't parsed (see OrderedNode.unnest) -- instead, the markup that would start a nested node
+    is counted in the text of each node that hasn't been expanded yet (see NODE_MARKUP_PATTERN). Returns:
+    * nodes: number of nodes currently in the tree
+    * nested: estimated number of nested nodes that expand_nested would add
+    * cells: estimated share of this tree in the number of DP cells (see Differ.get_num_cells) for the
+      expanded tree -- the DP for diffing two trees fills roughly the product of their cells.
+      Every node is counted once per keyroot above it, which is about its depth in the tree.
+    """
+    estimate = {"nodes": 0, "nested": 0, "cells": 0}
+    depths = {"Article": 1, "Section": 2}
+    for n in tree.root.preorder():
+        estimate["nodes"] += 1
+        depth = depths.get(n.ntype, 3)
+        estimate["cells"] += depth
+        if depth == 3 and not n.children:
+            nested = estimate_nested(n)
+            estimate["nested"] += nested
+            estimate["cells"] += nested * (depth + 1)
+    return estimate
+
+
+def estimate_nested(node):
+    """Estimated number of nested nodes that expanding a node (which hasn't been expanded yet) would add."""
+    nested = len(NODE_MARKUP_PATTERN.findall(node.text))
+    if node.ntype != "Text":
+        nested -= 1  # markup that starts the node itself
+    return max(nested, 0)
+
+
+def estimate_size(node):
+    """Estimated number of nodes in the sub-tree rooted at a node once nested nodes are expanded."""
+    size = 0
+    for n in node.preorder():
+        size += 1
+        if n.ntype not in ("Article", "Section") and not n.children:
+            size += estimate_nested(n)
+    return size
+
+
+@functools.lru_cache(maxsize=None)
+def _ntype_hash(ntype):
+    """Stable stand-in for a node type in Merkle hashes -- hash() of a str differs between processes."""
+    return blake2b_fingerprint(ntype)
+
+
+class Budget:
+    """
+    Limits on how much work a structured diff may do -- wall-clock seconds and/or DP cells.
+    The clock starts when the budget is created and can be restarted so that each attempt at a stage gets
+    max_seconds of its own -- otherwise a stage that runs out of time leaves none for the cheaper stages.
+    """
+
+    def __init__(self, max_seconds=None, max_cells=None):
+        self.max_seconds = max_seconds
+        self.max_cells = max_cells
+        self.start = time.perf_counter()
+
+    def restart(self):
+        self.start = time.perf_counter()
+
+    def check_time(self):
+        if (
+            self.max_seconds is not None
+            and time.perf_counter() - self.start > self.max_seconds
+        ):
+            raise BudgetExceeded(f"Diff took longer than {self.max_seconds} seconds")
+
+    def check_cells(self, num_cells):
+        if self.max_cells is not None and num_cells > self.max_cells:
+            raise BudgetExceeded(
+                f"Diff needs {num_cells} cells which is more than {self.max_cells}"
+            )
+
+
+class DistanceMemo:
+    """
+    Tree distances between pairs of sub-trees, keyed by their Merkle hashes (see Differ.get_subtree_hashes).
+
+    Identical pairs of sub-trees -- e.g., the same citation template shape, a repeated named reference,
+    or a navbox -- have identical tree distances, so the distances computed for one pair of keyroots can be
+    copied for any other identical pair. A Differ uses its own memo by default; pass the same DistanceMemo to
+    several diffs (e.g., consecutive revisions of an article) to also share distances across them.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = (
+            max_entries  # if set, stop adding entries once the memo holds this many
+        )
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def add(self, key, entry):
+        if self.max_entries is None or len(self.entries) < self.max_entries:
+            self.entries[key] = entry
+
+    def clear(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+
+class BudgetExceeded(Exception):
+    """Raised by a Differ when it cannot finish within its Budget."""
+
+
+class MaxDistanceExceeded(Exception):
+    """Raised by a bounded Differ when the tree distance between revisions is greater than max_distance."""
+
+    def __init__(self, max_distance, distance):
+        super(MaxDistanceExceeded, self).__init__(
+            f"Tree distance of at least {distance} exceeds max_distance={max_distance}"
+        )
+        self.max_distance = max_distance
+        self.distance = distance  # lower bound on the actual tree distance
+
+    def __reduce__(self):
+        # so it can be raised in a worker process (see SectionDiffer)
+        return (MaxDistanceExceeded, (self.max_distance, self.distance))
+
+
+class _Band(dict):
+    """Sparse row of a distance table where missing cells default to a cost that is out of bounds."""
+
+    def __init__(self, out_of_bounds):
+        super(_Band, self).__init__()
+        self.out_of_bounds = out_of_bounds
+
+    def __missing__(self, key):
+        return self.out_of_bounds
+
+
+class _BandedForest(dict):
+    """Sparse forest-distance table for a bounded Differ. Rows are created on first access and rows that
+    were skipped entirely only hold their first column (the cost of removing the whole forest).
+
+    removal_costs[i] is the cost of removing the first i nodes (post-order) of the first tree and
+    the forest starts at node start.
+    """
+
+    def __init__(self, out_of_bounds, removal_costs, start):
+        super(_BandedForest, self).__init__()
+        self.out_of_bounds = out_of_bounds
+        self.removal_costs = removal_costs
+        self.start = start
+
+    def __missing__(self, ii):
+        row = _Band(self.out_of_bounds)
+        row[0] = self.removal_costs[self.start + ii] - self.removal_costs[self.start]
+        self[ii] = row
+        return row
+
+
+class OrderedNode:
     """
-    Extension of anytree library node to support tree differ.
+    Node in a WikitextTree -- an ordered tree with just the bookkeeping needed by the tree differ.
     """
 
+    __slots__ = (
+        "name",
+        "ntype",
+        "mwnode",
+        "text",
+        "content_hash",
+        "idx",
+        "section",
+        "_parent",
+        "_children",
+    )
+
     def __init__(
         self,
         name,
@@ -40,34 +420,89 @@ class OrderedNode(NodeMixin):
         section=None,
         parent=None,
         children=None,
+        text=None,
     ):
-        super(OrderedNode, self).__init__()
         self.name = name  # For debugging purposes
         self.ntype = ntype  # Different node types can be treated differently when computing equality
         self.mwnode = mwnode
-        self.text = (
-            str(mwnode) if mwnode is not None else ""
-        )  # Text that can then be passed to a diffing library
+        # Text that can then be passed to a diffing library -- callers that already have the node's wikitext
+        # (e.g., a section's text) pass it so that it isn't serialized again
+        if text is None:
+            text = str(mwnode) if mwnode is not None else ""
+        self.text = text
         # Used for quickly computing equality for most nodes.
         # Generally this just a simple hash of self.mwnode (wikitext associated with a node) but
         # the text hash for sections is based on all the content within the section
         # so it can be used for pruning while self.text is just the text that creates the section
         # e.g., "==Section==\nThis is a section." would have as text "==Section==" but hash the full.
         # so the Differ doesn't identify a section as changing when content within it is changed
-        self.content_hash = hash(self.text)
+        self.content_hash = content_hash(self.text)
         self.idx = idx  # Used by Differ -- Post order on tree from 0...# nodes - 1
         self.section = section  # section that the node is a part of -- useful for formatting final diff
+        self._parent = None
+        self._children = []
         self.parent = parent
         if children:
             self.children = children
-        self.leftmostidx = None
 
-    def leftmost(self):
-        if self.leftmostidx is None:
-            self.leftmostidx = self.idx if self.is_leaf else self.children[0].leftmost()
-        return self.leftmostidx
+    @property
+    def parent(self):
+        return self._parent
+
+    @parent.setter
+    def parent(self, parent):
+        """Detach from current parent (if any) and append as last child of new parent."""
+        if self._parent is not None:
+            self._parent._children.remove(self)
+        self._parent = parent
+        if parent is not None:
+            parent._children.append(self)
+
+    @property
+    def children(self):
+        """Child nodes in order. The list itself should not be modified -- set node.children/parent instead."""
+        return self._children
+
+    @children.setter
+    def children(self, children):
+        for c in self._children:
+            c._parent = None
+        self._children = []
+        for c in children:
+            c.parent = self
+
+    @property
+    def is_leaf(self):
+        return not self._children
+
+    @property
+    def is_root(self):
+        return self._parent is None
 
-    def unnest(self, lang="en"):
+    def preorder(self):
+        """Iterate over the sub-tree rooted at this node in pre-order (w/o recursion)."""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node._children))
+
+    def postorder(self):
+        """Iterate over the sub-tree rooted at this node in post-order (w/o recursion).
+
+        Children are gathered when a node is first reached so a node can be modified (e.g., unnested)
+        once it has been returned without affecting the iteration.
+        """
+        stack = [(self, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if children_done or not node._children:
+                yield node
+            else:
+                stack.append((node, True))
+                stack.extend((c, False) for c in reversed(node._children))
+
+    def unnest(self, lang="en", max_depth=None):
         """Build tree of document nodes by recursing within a single wikitext node.
 
         This approach starts with a single wikitext node -- e.g., a single Tag node with nested link nodes etc.:
@@ -77,25 +512,35 @@ class OrderedNode(NodeMixin):
         Example above would take a Reference node as input and build the following tree (in-place):
         <--rest-of-tree-- Reference <--child-of-- Template (cite web) <--child-of-- WikiLink (Gallery)
                                                                 ^--------child-of-- External Link (http://digital...)
+
+        If max_depth is set, only nodes nested at most that many levels below this node are added -- e.g., with
+        max_depth=1 the example would stop at the Template node. The nodes that are added are the same either way.
         """
+        if max_depth is not None and max_depth < 1:
+            return
+        text = self.text
         if self.ntype == "Gallery":
             # strip leading / trailing gallery tags so parser correctly parses everything in between
             # otherwise links, templates, etc. is treated as text
-            gallery_start = self.text.find(">")
-            gallery_end = self.text.rfind("<")
+            gallery_start = text.find(">")
+            gallery_end = text.rfind("<")
             try:
                 # the break is a hack; it'll be skipped in the ifilter loop; otherwise first image skipped
-                wt = mw.parse(
-                    "<br>" + self.text[gallery_start + 1 : gallery_end],
-                    skip_style_tags=True,
-                )
+                wt = parse_wikitext("<br>" + text[gallery_start + 1 : gallery_end])
             except Exception:  # fallback
                 wt = mw.parse(self.mwnode)  # automatically carries over skip_style_tags
         else:
             wt = mw.parse(self.mwnode)  # automatically carries over skip_style_tags
-        parent_ranges = [
-            (0, len(self.text), self)
-        ]  # (start idx of node, end idx of node, node object)
+        # nodes are visited in pre-order so a node's parent is the most recent node that hasn't ended before it
+        # starts: stack of (end idx of node, node object, depth below self) for the nodes that are still open
+        # node object is None for nodes that are too deep to be added -- so their descendants are skipped too
+        open_nodes = [(len(text), self, 0)]
+        # (start idx, end idx) of every node -- for text formatting
+        ranges = [(0, len(text))]
+        # (node object, depth below self) of every node in ranges
+        range_nodes = [(self, 0)]
+        # start of the latest node -- nodes are searched for from there
+        search_start = 0
         for idx, nn in enumerate(wt.ifilter(recursive=True)):
             if idx == 0:
                 continue  # skip root node -- already set or placeholder <br> node for galleries
@@ -108,6 +553,7 @@ class OrderedNode(NodeMixin):
                     for m in find_nested_media(
                         str(nn), is_gallery=(self.ntype == "Gallery")
                     ):
+                        search_start = text.find(m, search_start)
                         nn_node = OrderedNode(
                             f"Media: {m[:10]}...",
                             ntype="Media",
@@ -115,8 +561,9 @@ class OrderedNode(NodeMixin):
                             section=self.section,
                             parent=self,
                         )
-                        offset = self.text.find(str(m), parent_ranges[0][0])
-                        parent_ranges.insert(0, (offset, offset + len(m), nn_node))
+                        open_nodes.append((search_start + len(m), nn_node, 1))
+                        ranges.append((search_start, search_start + len(m)))
+                        range_nodes.append((nn_node, 1))
             # tables are very highly-structured and produce a ton of nodes (each cell and more)
             # so we just extract links, formatting, etc. that appears in the table and skip the cells
             # because changes to those will generally be caught in the overall table changes and text changes
@@ -124,36 +571,42 @@ class OrderedNode(NodeMixin):
             elif ntype == "Table Element":
                 pass
             else:
-                # start looking from the start of the latest node
-                node_start = self.text.find(str(nn), parent_ranges[0][0])
-                # identify direct parent of node
-                for parent_start, parent_end, parent_node in parent_ranges:
-                    if (
-                        node_start < parent_end
-                    ):  # starts before end of a previous node; already know it begins after it
-                        nn_node = OrderedNode(
-                            node_to_name(nn, lang=lang),
-                            ntype=ntype,
-                            mwnode=nn,
-                            section=self.section,
-                            parent=parent_node,
-                        )
-                        parent_ranges.insert(
-                            0, (node_start, node_start + len(nn), nn_node)
-                        )
-                        break
-        if "''" in self.text:
-            for tfnode, tfspan in find_nested_textformatting(self.text):
-                for parent_start, parent_end, parent_node in parent_ranges:
-                    if tfspan[0] >= parent_start and tfspan[1] <= parent_end:
-                        nn_node = OrderedNode(
-                            f"Text-Formatting: {tfnode}",
-                            ntype="Text Formatting",
-                            mwnode=tfnode,
-                            section=self.section,
-                            parent=parent_node,
-                        )
-                        break
+                # start looking from the start of the latest node (serializing the node only once)
+                nn_text = str(nn)
+                search_start = text.find(nn_text, search_start)
+                node_end = search_start + len(nn_text)
+                # identify direct parent of node: nodes that ended before this one starts are done
+                while len(open_nodes) > 1 and open_nodes[-1][0] <= search_start:
+                    open_nodes.pop()
+                _, parent_node, depth = open_nodes[-1]
+                nn_node = None
+                if parent_node is not None and (max_depth is None or depth < max_depth):
+                    nn_node = OrderedNode(
+                        node_to_name(nn, lang=lang),
+                        ntype=ntype,
+                        mwnode=nn,
+                        section=self.section,
+                        parent=parent_node,
+                        text=nn_text,
+                    )
+                open_nodes.append((node_end, nn_node, depth + 1))
+                ranges.append((search_start, node_end))
+                range_nodes.append((nn_node, depth + 1))
+        if "''" in text:
+            tfnodes = list(find_nested_textformatting(text))
+            parents = innermost_ranges(ranges, [tfspan for _, tfspan in tfnodes])
+            for (tfnode, _), parent_idx in zip(tfnodes, parents):
+                if parent_idx is None:
+                    continue
+                parent_node, depth = range_nodes[parent_idx]
+                if parent_node is not None and (max_depth is None or depth < max_depth):
+                    OrderedNode(
+                        f"Text-Formatting: {tfnode}",
+                        ntype="Text Formatting",
+                        mwnode=tfnode,
+                        section=self.section,
+                        parent=parent_node,
+                    )
 
     def dump(self):
         return {"type": self.ntype, "text": self.text, "section": self.section}
@@ -168,6 +621,9 @@ class WikitextTree:
         self.lang = lang
         self.root = OrderedNode("root", ntype="Article")
         self.secname_to_text = {}
+        self.secname_to_wikicode = (
+            {}
+        )  # parsed sections -- so they don't need to be parsed again
         if wikitext:
             self.wikitext_to_tree(wikitext)
         self.key_roots = None
@@ -178,29 +634,72 @@ class WikitextTree:
         This approach builds a tree with an artificial 'root' node on the 1st level,
         all of the article sections nested flatly underneath (including the Lede section),
         and all of the text, link, template, etc. nodes nested under their respective sections.
+        wikitext can also be an already-parsed article (Wikicode), which isn't modified, or a ScannedRevision.
         """
-        wt = mw.parse(wikitext, skip_style_tags=True)
+        wt = wikitext
+        if isinstance(wt, ScannedRevision):
+            self.scanned_to_tree(wt)
+            return
+        if not isinstance(wt, mw.wikicode.Wikicode):
+            wt = parse_wikitext(wikitext)
         for sidx, s in enumerate(wt.get_sections(flat=True)):
             sec_id = sec_to_name(s, sidx)
             sec_text = "".join([str(n) for n in s.nodes])
             self.secname_to_text[sec_id] = sec_text
+            self.secname_to_wikicode[sec_id] = s
             s_node = OrderedNode(
-                sec_id, ntype="Section", mwnode=s, section=sec_id, parent=self.root
+                sec_id,
+                ntype="Section",
+                mwnode=s,
+                section=sec_id,
+                parent=self.root,
+                text=sec_text,
+            )
+            self.add_section_nodes(s_node, s)
+
+    def scanned_to_tree(self, revision):
+        """Build tree of document nodes from a ScannedRevision (see wikitext_to_tree).
+
+        Only sections flagged as changed are parsed and get nodes. The others are just a section node -- what
+        Differ.prune_sections leaves of a section that is identical in both revisions.
+        """
+        # any other section is parsed if it's looked up
+        self.secname_to_wikicode = revision.wikicode
+        for sidx in range(len(revision.sections)):
+            sec_id = revision.names[sidx]
+            sec_text = revision.get_text(sidx)
+            self.secname_to_text[sec_id] = sec_text
+            s = revision.wikicode[sec_id] if revision.changed[sidx] else None
+            s_node = OrderedNode(
+                sec_id,
+                ntype="Section",
+                mwnode=s,
+                section=sec_id,
+                parent=self.root,
+                text=sec_text,
+            )
+            if s is not None:
+                self.add_section_nodes(s_node, s)
+
+    def add_section_nodes(self, s_node, s):
+        """Add the nodes of a parsed section to its section node."""
+        for n in s.nodes:
+            _ = OrderedNode(
+                node_to_name(n, self.lang),
+                ntype=simple_node_class(n, self.lang),
+                mwnode=n,
+                section=s_node.name,
+                parent=s_node,
             )
-            for n in s.nodes:
-                _ = OrderedNode(
-                    node_to_name(n, self.lang),
-                    ntype=simple_node_class(n, self.lang),
-                    mwnode=n,
-                    section=s_node.name,
-                    parent=s_node,
-                )
 
-    def expand_nested(self):
-        """Expand nested nodes in tree -- e.g., Ref tags with templates/links contained in them."""
-        for n in PostOrderIter(self.root):
+    def expand_nested(self, max_depth=None):
+        """Expand nested nodes in tree -- e.g., Ref tags with templates/links contained in them.
+
+        If max_depth is set, stop at that many levels of nesting below the nodes that sit directly in a section.
+        """
+        for n in self.root.postorder():
             if n.ntype not in ("Article", "Section"):
-                n.unnest(self.lang)
+                n.unnest(self.lang, max_depth=max_depth)
 
 
 class Differ:
@@ -208,144 +707,380 @@ class Differ:
     Find structural differences between two WikitextTrees
     """
 
-    def __init__(self, t1, t2, timeout=False, expand_nodes=True):
+    def __init__(
+        self,
+        t1,
+        t2,
+        timeout=False,
+        expand_nodes=True,
+        max_distance=None,
+        stage=None,
+        budget=None,
+        prune_unique=False,
+        prune_identical=True,
+        memo=None,
+        max_depth=None,
+    ):
         self.timeout = timeout  # if True, limit size of trees compared
+        # if True, collapse unique unchanged nodes in both trees before diffing (see prune_anchors) -- opt-in as
+        # it is a heuristic that can change which edits are reported
+        self.prune_unique = prune_unique
+        # if True, collapse sub-trees that occur equally often in both trees (see prune_identical_subtrees)
+        self.prune_identical = prune_identical
+        self.collapsed = {}  # collapsed node -> its descendants (post-order)
+        # if set, only evaluate the parts of the problem that can lead to a tree distance <= max_distance
+        # and raise MaxDistanceExceeded otherwise
+        self.max_distance = max_distance
+        self.budget = budget  # if set, raise BudgetExceeded as soon as it runs out
+        # distances between identical pairs of sub-trees are only computed once (see DistanceMemo)
+        self.memo = DistanceMemo() if memo is None else memo
+        # levels of nested nodes to expand at stage "full" (see OrderedNode.unnest); None: all of them
+        self.max_depth = max_depth
+        self.stage = (
+            stage  # level of detail (see STAGES) -- set by prune_trees if not provided
+        )
         self.prune_trees(t1, t2, expand_nodes)
-        self.t1 = []
-        self.t1_keyroots = []
-        self.t2 = []
-        self.t2_keyroots = []
-        for i, n in enumerate(PostOrderIter(t1.root)):
-            n.idx = i
-            self.t1.append(n)
-            if n.is_root or leftsibling(n) is not None:
-                self.t1_keyroots.append(n)
-        for i, n in enumerate(PostOrderIter(t2.root)):
-            n.idx = i
-            self.t2.append(n)
-            if n.is_root or leftsibling(n) is not None:
-                self.t2_keyroots.append(n)
+        # flat post-order representation of each tree: node objects are only needed to report the final diff;
+        # the dynamic program itself only looks at these parallel arrays (indexed by post-order position)
+        ntype_ids = {}
+        (
+            self.t1,
+            self.t1_leftmost,
+            self.t1_keyroots,
+            self.t1_ntypes,
+            self.t1_hashes,
+        ) = self.flatten(t1, ntype_ids)
+        (
+            self.t2,
+            self.t2_leftmost,
+            self.t2_keyroots,
+            self.t2_ntypes,
+            self.t2_hashes,
+        ) = self.flatten(t2, ntype_ids)
+        self.t2_keyroot_idx = [kr2.idx for kr2 in self.t2_keyroots]
         self.ins_cost = 1
         self.rem_cost = 1
         self.chg_cost = 1
         self.nodetype_chg_cost = (
             10  # arbitrarily high to encourage remove+insert when node types change
         )
+        # collapsed nodes stand in for their whole sub-tree so removing/inserting them costs accordingly
+        self.t1_weights = [
+            self.rem_cost * (1 + len(self.collapsed.get(n, ()))) for n in self.t1
+        ]
+        self.t2_weights = [
+            self.ins_cost * (1 + len(self.collapsed.get(n, ()))) for n in self.t2
+        ]
+        self.t1_removal_costs = [0]  # cost of removing the first i nodes of tree1
+        for w in self.t1_weights:
+            self.t1_removal_costs.append(self.t1_removal_costs[-1] + w)
+        self.t1_subtree_hashes = self.get_subtree_hashes(self.t1, self.t1_weights)
+        self.t2_subtree_hashes = self.get_subtree_hashes(self.t2, self.t2_weights)
+
+        # Permanent store of tree distances such that distances[x][y] is the minimum cost
+        # to get from the sub-tree rooted at node x (in tree1) to the sub-tree rooted at node y (in tree2).
+        # Only the integer costs are kept -- the transactions themselves are rebuilt once at the end
+        # by walking backpointers (see get_transactions).
+        self.distances = None
+        if self.budget is not None:
+            self.budget.check_time()
+            self.budget.check_cells(self.get_num_cells())
+        if self.max_distance is not None:
+            lower_bound = self.get_distance_lower_bound()
+            if lower_bound > self.max_distance:
+                raise MaxDistanceExceeded(self.max_distance, lower_bound)
+        self.populate_distances()
+        if self.max_distance is not None and self.get_distance() > self.max_distance:
+            raise MaxDistanceExceeded(self.max_distance, self.max_distance + 1)
+
+    @staticmethod
+    def get_subtree_hashes(nodes, weights):
+        """Merkle hash of the sub-tree rooted at each node in a post-order list.
+
+        Combines the node's type, content, and weight (see collapse) with the hashes of its children
+        so two sub-trees have the same hash if they are identical. Only ints are hashed so, with a stable
+        content hasher (see utils.set_content_hasher), the hashes are the same in every process.
+        """
+        hashes = []
+        for n, w in zip(nodes, weights):
+            hashes.append(
+                hash(
+                    (
+                        _ntype_hash(n.ntype),
+                        n.content_hash,
+                        w,
+                        tuple(hashes[c.idx] for c in n.children),
+                    )
+                )
+            )
+        return hashes
 
-        # Permanent store of transactions such that transactions[x][y] is the minimum
-        # transactions to get from the sub-tree rooted at node x (in tree1) to the sub-tree
-        # rooted at node y (in tree2).
-        self.transactions = {None: {}}
-        # Indices for each transaction, to avoid high performance cost of creating the
-        # transactions multiple times
-        self.transaction_to_idx = {None: {None: 0}}
-        # All possible transactions
-        self.idx_to_transaction = [(None, None)]
-
-        idx_transaction = 1  # starts with nulls inserted
-
-        transactions = {None: {None: []}}
-
-        # Populate transaction stores
-        for i in range(0, len(self.t1)):
-            transactions[i] = {None: []}
-            self.transaction_to_idx[i] = {None: idx_transaction}
-            idx_transaction += 1
-            self.idx_to_transaction.append((i, None))
-            for j in range(0, len(self.t2)):
-                transactions[None][j] = []
-                transactions[i][j] = []
-                self.transaction_to_idx[None][j] = idx_transaction
-                idx_transaction += 1
-                self.idx_to_transaction.append((None, j))
-                self.transaction_to_idx[i][j] = idx_transaction
-                idx_transaction += 1
-                self.idx_to_transaction.append((i, j))
-            self.transactions[i] = {}
-        self.populate_transactions(transactions)
+    @staticmethod
+    def flatten(tree, ntype_ids):
+        """Number the nodes of tree in post-order and gather the arrays used by the tree differ.
+
+        Returns the nodes, the leftmost leaf descendant of each node, the keyroots (the root and any node
+        with a left sibling), and the type ID (from ntype_ids, which is added to) and content hash of each node.
+        """
+        nodes = []
+        leftmost = []
+        keyroots = []
+        ntypes = []
+        hashes = []
+        for i, n in enumerate(tree.root.postorder()):
+            n.idx = i
+            nodes.append(n)
+            leftmost.append(leftmost[n.children[0].idx] if n.children else i)
+            if n.is_root or n.parent.children[0] is not n:
+                keyroots.append(n)
+            ntypes.append(ntype_ids.setdefault(n.ntype, len(ntype_ids)))
+            hashes.append(n.content_hash)
+        return nodes, leftmost, keyroots, ntypes, hashes
 
     def prune_trees(self, t1, t2, expand_nodes=False):
         """Quick heuristic preprocessing to reduce tree differ time by removing matching sections."""
         self.prune_sections(t1, t2)
-        # arbitrary: more than 500 nodes altogether even after pruning and before unnesting -- just diff sections
-        if (
-            self.timeout
-            and (
-                sum(1 for n in PostOrderIter(t1.root))
-                + sum(1 for n in PostOrderIter(t2.root))
-            )
-            > 500
-        ):
+        if self.stage is None:
+            if self.timeout:
+                # nested nodes aren't parsed to estimate the sizes (see estimate_complexity)
+                estimates = [estimate_complexity(t1), estimate_complexity(t2)]
+                num_nodes = sum(e["nodes"] for e in estimates)
+                num_nested = sum(e["nested"] for e in estimates)
+            # arbitrary: more than 500 nodes altogether even after pruning and before unnesting -- just diff sections
+            if self.timeout and num_nodes > 500:
+                self.stage = "sections"
+            # arbitrary: seems like manageable number of total nodes -- unnest fully before diffing
+            elif expand_nodes and (not self.timeout or num_nodes + num_nested < 500):
+                self.stage = "full"
+            else:
+                self.stage = "top-level"
+
+        if self.stage == "sections":
             self.prune_to_sections(t1, t2)
-        # arbitrary: seems like manageable number of total nodes -- unnest fully before diffing
-        elif expand_nodes and (
-            not self.timeout
-            or (
-                sum([len(mw.parse(n.mwnode).filter()) for n in PostOrderIter(t1.root)])
-                + sum(
-                    [len(mw.parse(n.mwnode).filter()) for n in PostOrderIter(t2.root)]
-                )
+        elif self.stage == "full":
+            t1.expand_nested(max_depth=self.max_depth)
+            t2.expand_nested(max_depth=self.max_depth)
+        if self.prune_unique and self.stage != "sections":
+            self.prune_anchors(t1, t2)
+        if self.prune_identical and self.stage != "sections":
+            self.prune_identical_subtrees(t1, t2)
+
+    def prune_anchors(self, t1, t2):
+        """Collapse unique nodes that are unchanged and in place across revisions (like patience diff).
+
+        Nodes whose type+content appear exactly once in each tree are matched as anchors. If the anchors
+        immediately before and after an anchor are also the same in both revisions -- i.e. it sits in an
+        unchanged stretch of the article -- its sub-tree and any identical nodes directly following it are
+        dropped from both trees before computing the tree distance. The anchor itself is kept as a leaf so the
+        unchanged content still ties sections together. Anchors next to reordered content are left alone so
+        the tree differ can still explain them -- e.g., as moves. Sections are handled by prune_sections.
+
+        Unlike prune_identical_subtrees, this does not always give the same diff as the full trees: a node
+        that is unique and in place among the anchors may still be better matched elsewhere -- e.g., when
+        content is moved into or out of it -- so it is only done if prune_unique is set.
+        """
+        counts = {}
+        t1_nodes = []
+        t2_nodes = []
+        for tree, nodes, side in ((t1, t1_nodes, 0), (t2, t2_nodes, 1)):
+            for n in tree.root.preorder():
+                if n.ntype not in ("Article", "Section"):
+                    nodes.append(n)
+                    counts.setdefault((n.ntype, n.content_hash), [0, 0])[side] += 1
+        unique = {k for k, c in counts.items() if c == [1, 1]}
+        # only outermost anchors -- anything nested in an anchor is identical too and goes along with it
+        t1_anchors = self._outermost(t1_nodes, unique)
+        t2_anchors = {
+            (n.ntype, n.content_hash): (j, n)
+            for j, n in enumerate(self._outermost(t2_nodes, unique))
+        }
+        # position of each t1 anchor's match among the t2 anchors
+        t2_order = [
+            t2_anchors.get((n.ntype, n.content_hash), (None, None))[0]
+            for n in t1_anchors
+        ]
+        matched = [k for k, j in enumerate(t2_order) if j is not None]
+        in_order = {
+            matched[k]
+            for k in longest_increasing_subsequence([t2_order[k] for k in matched])
+        }
+        to_prune = []
+        for k, n1 in enumerate(t1_anchors):
+            if k not in in_order:
+                continue
+            j = t2_order[k]
+            prev_in_place = j == 0 if k == 0 else t2_order[k - 1] == j - 1
+            next_in_place = (
+                j == len(t2_anchors) - 1
+                if k == len(t1_anchors) - 1
+                else t2_order[k + 1] == j + 1
             )
-            < 1000
-        ):
-            t1.expand_nested()
-            t2.expand_nested()
+            if prev_in_place and next_in_place:
+                to_prune.append((n1, t2_anchors[(n1.ntype, n1.content_hash)][1]))
+        # like patience diff, identical (non-unique) nodes that directly follow an anchor are unchanged too
+        to_drop = set()
+        position = {}  # index of each node among its siblings -- filled in as needed
+        for n1, n2 in to_prune:
+            siblings1 = n1.parent.children
+            siblings2 = n2.parent.children
+            for siblings in (siblings1, siblings2):
+                if siblings[0] not in position:
+                    position.update((c, i) for i, c in enumerate(siblings))
+            i1 = position[n1]
+            i2 = position[n2]
+            self.collapse(n1)
+            self.collapse(n2)
+            for s1, s2 in zip(siblings1[i1 + 1 :], siblings2[i2 + 1 :]):
+                if (
+                    s1.ntype != s2.ntype
+                    or s1.content_hash != s2.content_hash
+                    or (s1.ntype, s1.content_hash) in unique
+                ):
+                    break
+                to_drop.update((s1, s2))
+        for parent in {n.parent for n in to_drop}:
+            parent.children = [c for c in parent.children if c not in to_drop]
+
+    def prune_identical_subtrees(self, t1, t2):
+        """Collapse nested sub-trees that appear the same number of times in both revisions.
+
+        Sub-trees are compared via Merkle hashes -- a node's hash combines its type and content with the
+        hashes of its children -- computed in one post-order pass over each tree. When a sub-tree occurs
+        equally often in both trees, each copy can be matched at no cost, so only its root needs to go into
+        the tree distance computation. Sections are handled by prune_sections.
+        """
+        counts = {}
+        subtree_hashes = []
+        for side, tree in enumerate((t1, t2)):
+            subtree_hash = {}
+            for n in tree.root.postorder():
+                subtree_hash[n] = hash(
+                    (
+                        _ntype_hash(n.ntype),
+                        n.content_hash,
+                        tuple(subtree_hash[c] for c in n.children),
+                    )
+                )
+                if n.children and n.ntype not in ("Article", "Section"):
+                    counts.setdefault(subtree_hash[n], [0, 0])[side] += 1
+            subtree_hashes.append(subtree_hash)
+        for tree, subtree_hash in zip((t1, t2), subtree_hashes):
+            for n in tree.root.preorder():
+                c = counts.get(subtree_hash[n])
+                if c is not None and c[0] == c[1]:
+                    self.collapse(n)  # pre-order so nested sub-trees go along with it
+
+    def collapse(self, node):
+        """Drop the descendants of node from its tree before computing the tree distance.
+
+        They are kept so that they can be reported along with node if it ends up removed/inserted/changed.
+        """
+        self.collapsed[node] = list(node.postorder())[:-1]
+        node.children = []
+
+    @staticmethod
+    def _outermost(nodes, unique):
+        """Nodes (pre-order) whose type+content is in unique and that aren't nested in another such node."""
+        outermost = []
+        nested = set()
+        for n in nodes:
+            if n.parent in nested:
+                nested.add(n)
+            elif (n.ntype, n.content_hash) in unique:
+                outermost.append(n)
+                nested.add(n)
+        return outermost
 
     def prune_to_sections(self, t1, t2):
         """Remove all non-section nodes."""
-        for n in PostOrderIter(t1.root):
+        for n in t1.root.postorder():
             if n.ntype == "Section":
                 n.children = []
-        for n in PostOrderIter(t2.root):
+        for n in t2.root.postorder():
             if n.ntype == "Section":
                 n.children = []
 
     def prune_sections(self, t1, t2):
         """Prune nodes from any sections that align across revisions"""
-        t1_sections = [n for n in PostOrderIter(t1.root) if n.ntype == "Section"]
-        t2_sections = [n for n in PostOrderIter(t2.root) if n.ntype == "Section"]
-        for secnode1 in t1_sections:
-            for sn2_idx in range(len(t2_sections)):
-                secnode2 = t2_sections[sn2_idx]
-                if secnode1.content_hash == secnode2.content_hash:
-                    # assumes sections aren't hierarchical in tree
-                    # or if they are, the content_hash must also include nested sections
-                    secnode1.children = []
-                    secnode2.children = []
-                    t2_sections.pop(sn2_idx)  # only match once
-                    break
+        # each section is matched once, to the first unmatched section with the same content
+        t2_sections = {}
+        for secnode2 in t2.root.postorder():
+            if secnode2.ntype == "Section":
+                t2_sections.setdefault(secnode2.content_hash, deque()).append(secnode2)
+        for secnode1 in t1.root.postorder():
+            if secnode1.ntype == "Section" and t2_sections.get(secnode1.content_hash):
+                # assumes sections aren't hierarchical in tree
+                # or if they are, the content_hash must also include nested sections
+                secnode2 = t2_sections[secnode1.content_hash].popleft()
+                secnode1.children = []
+                secnode2.children = []
 
-    def populate_transactions(self, transactions):
-        """Populate self.transactions with minimum transactions between all possible trees"""
-        for kr1 in self.t1_keyroots:
-            # Make transactions for tree -> null
-            i_nulls = []
-            for ii in range(kr1.leftmost(), kr1.idx + 1):
-                i_nulls.append(self.transaction_to_idx[ii][None])
-                transactions[ii][None] = i_nulls.copy()
-            for kr2 in self.t2_keyroots:
-                # Make transactions of null -> tree
-                j_nulls = []
-                for jj in range(kr2.leftmost(), kr2.idx + 1):
-                    j_nulls.append(self.transaction_to_idx[None][jj])
-                    transactions[None][jj] = j_nulls.copy()
-
-                # get the diff
-                self.find_minimum_transactions(kr1, kr2, transactions)
-
-        if self.transactions:
-            for i in range(0, len(self.t1)):
-                for j in range(0, len(self.t2)):
-                    if (
-                        self.transactions.get(i, {}).get(j)
-                        and len(self.transactions[i][j]) > 0
-                    ):
-                        self.transactions[i][j] = tuple(
-                            [
-                                self.idx_to_transaction[idx]
-                                for idx in self.transactions[i][j]
-                            ]
-                        )
+    def populate_distances(self):
+        """Populate self.distances with minimum cost between all possible sub-trees."""
+        if self.max_distance is None:
+            self.distances = [[0] * len(self.t2) for _ in range(len(self.t1))]
+            for kr1 in self.t1_keyroots:
+                if self.budget is not None:
+                    self.budget.check_time()
+                for kr2 in self.t2_keyroots:
+                    self.find_minimum_transactions(kr1, kr2)
+        else:
+            self.distances = [_Band(self.max_distance + 1) for _ in self.t1]
+            for kr1 in self.t1_keyroots:
+                if self.budget is not None:
+                    self.budget.check_time()
+                for kr2 in self.get_banded_keyroots(kr1):
+                    self.find_minimum_transactions(kr1, kr2)
+
+    def get_distance(self):
+        """Minimum cost to get from the first tree to the second tree (once populate_distances has run)."""
+        return self.distances[len(self.t1) - 1][len(self.t2) - 1]
+
+    def get_num_cells(self):
+        """Number of forest-distance cells the (unbounded) DP will fill in -- a proxy for its cost."""
+        t1_cells = sum(
+            kr1.idx - self.t1_leftmost[kr1.idx] + 1 for kr1 in self.t1_keyroots
+        )
+        t2_cells = sum(
+            kr2.idx - self.t2_leftmost[kr2.idx] + 1 for kr2 in self.t2_keyroots
+        )
+        return t1_cells * t2_cells
+
+    def get_distance_lower_bound(self):
+        """Cheap lower bound on the tree distance: every transaction fixes at most one size
+        difference and at most two unmatched nodes (by type and hash)."""
+        unmatched = {}
+        for n in self.t1:
+            key = (n.ntype, n.content_hash)
+            unmatched[key] = unmatched.get(key, 0) + 1
+        for n in self.t2:
+            key = (n.ntype, n.content_hash)
+            unmatched[key] = unmatched.get(key, 0) - 1
+        num_unmatched = sum(abs(c) for c in unmatched.values())
+        return max(abs(len(self.t1) - len(self.t2)), (num_unmatched + 1) // 2)
+
+    def get_banded_keyroots(self, kr1):
+        """Keyroots of the second tree whose sub-tree has a node within max_distance of kr1's sub-tree.
+
+        A transaction script of cost k can only match nodes whose post-order positions differ by at most k,
+        so keyroot pairs whose sub-trees are further apart than that can be skipped entirely. These are the
+        keyroots with a post-order index in that window plus the keyroot ancestors spanning its end.
+        """
+        k = self.max_distance
+        window_start = self.t1_leftmost[kr1.idx] - k
+        window_end = kr1.idx + k
+        keyroots = self.t2_keyroots[
+            bisect_left(self.t2_keyroot_idx, window_start) : bisect_right(
+                self.t2_keyroot_idx, window_end
+            )
+        ]
+        if window_end < len(self.t2) - 1:
+            ancestor = self.t2[window_end].parent
+            while ancestor is not None:
+                if ancestor.is_root or ancestor.parent.children[0] is not ancestor:
+                    keyroots.append(ancestor)
+                ancestor = ancestor.parent
+        return keyroots
 
     def get_node_distance(self, n1, n2):
         """
@@ -370,127 +1105,223 @@ class Differ:
         else:
             return self.chg_cost
 
-    def get_lowest_cost(self, rc, ic, cc):
-        min_cost = rc
-        index = 0
-        if ic < min_cost:
-            index = 1
-            min_cost = ic
-        if cc < min_cost:
-            index = 2
-        return index
-
-    def find_minimum_transactions(self, kr1, kr2, transactions):
-        """Find the minimum transactions to get from the first tree to the second tree."""
-        for i in range(kr1.leftmost(), kr1.idx + 1):
-            if i == kr1.leftmost():
-                i_minus_1 = None
+    def get_label_cost(self, i, j):
+        """Same as get_node_distance for node i (tree1) and node j (tree2) by post-order index.
+
+        Collapsed sub-trees (see collapse) can only be matched to an identical sub-tree -- otherwise it
+        costs at least as much as removing the one and inserting the other.
+        """
+        if self.t1_ntypes[i] != self.t2_ntypes[j]:
+            cost = self.nodetype_chg_cost
+        elif self.t1_hashes[i] == self.t2_hashes[j]:
+            return 0
+        else:
+            cost = self.chg_cost
+        w1 = self.t1_weights[i]
+        w2 = self.t2_weights[j]
+        if w1 > self.rem_cost or w2 > self.ins_cost:
+            return max(cost, w1 + w2)
+        return cost
+
+    def find_minimum_transactions(self, kr1, kr2, backpointers=False):
+        """Find the minimum cost to get from the first tree to the second tree.
+
+        Fills in the forest distances for the sub-trees rooted at kr1 and kr2 and records the tree distance
+        for every pair of nodes that share their leftmost leaf with kr1 and kr2 respectively.
+        If backpointers is True, also returns which transaction (0: remove; 1: insert; 2: change)
+        led to each forest-distance cell so that the transactions can be rebuilt.
+        """
+        t1_leftmost, t2_leftmost = self.t1_leftmost, self.t2_leftmost
+        distances = self.distances
+        t1_weights, t2_weights = self.t1_weights, self.t2_weights
+        l1 = t1_leftmost[kr1.idx]
+        l2 = t2_leftmost[kr2.idx]
+        w1 = kr1.idx - l1 + 1
+        w2 = kr2.idx - l2 + 1
+
+        band = self.max_distance
+        # tree distances (relative to kr1 and kr2) between the sub-trees that share their leftmost leaves
+        # with kr1 and kr2 -- i.e. everything this sub-problem adds to self.distances
+        # (pairs of leaves are quicker to compute than to look up)
+        memo_key = None
+        tree_distances = None
+        if band is None and not backpointers and w1 * w2 > 1:
+            memo_key = (
+                self.t1_subtree_hashes[kr1.idx],
+                self.t2_subtree_hashes[kr2.idx],
+            )
+            tree_distances = self.memo.get(memo_key)
+            if tree_distances is not None:
+                for i_offset, j_offset, cost in tree_distances:
+                    distances[kr1.idx - i_offset][kr2.idx - j_offset] = cost
+                return None
+            tree_distances = []
+        # forest distances are offset by one so that row/column 0 is the empty forest
+        # if bounded, only cells within the band are stored and everything else is treated as too costly
+        if band is None:
+            forest = [[0] * (w2 + 1) for _ in range(w1 + 1)]
+            rows = range(1, w1 + 1)
+        else:
+            forest = _BandedForest(band + 1, self.t1_removal_costs, l1)
+            # skip rows whose nodes are all too far from the second sub-tree
+            rows = range(
+                max(1, l2 - band - l1 + 1), min(w1, kr2.idx + band - l1 + 1) + 1
+            )
+        for jj in range(1, (w2 if band is None else min(w2, band + 1)) + 1):
+            forest[0][jj] = forest[0][jj - 1] + t2_weights[l2 + jj - 1]
+        bp = None
+        if backpointers:
+            # first row / column (all inserts / removes) are implicit
+            bp = [bytearray(w2 + 1) for _ in range(w1 + 1)] if band is None else {}
+
+        for ii in rows:
+            i = l1 + ii - 1
+            i_leftmost = t1_leftmost[i]
+            rem_cost = t1_weights[i]
+            row = forest[ii]
+            prev_row = forest[ii - 1]
+            row[0] = prev_row[0] + rem_cost
+            bp_row = None
+            if band is None:
+                columns = range(1, w2 + 1)
+                if backpointers:
+                    bp_row = bp[ii]
             else:
-                i_minus_1 = i - 1
-            n1 = self.t1[i]
-            for j in range(kr2.leftmost(), kr2.idx + 1):
-                if j == kr2.leftmost():
-                    j_minus_1 = None
+                columns = range(
+                    max(1, i - band - l2 + 1), min(w2, i + band - l2 + 1) + 1
+                )
+                if backpointers:
+                    bp_row = bp[ii] = {}
+            for jj in columns:
+                j = l2 + jj - 1
+                j_leftmost = t2_leftmost[j]
+                # cost of each transaction -- ties are broken in favor of remove, then insert
+                cost = prev_row[jj] + rem_cost
+                transaction = 0
+                if row[jj - 1] + t2_weights[j] < cost:
+                    cost = row[jj - 1] + t2_weights[j]
+                    transaction = 1
+                if i_leftmost == l1 and j_leftmost == l2:
+                    # both forests are whole trees: change (or match) nodes i and j
+                    chg = prev_row[jj - 1] + self.get_label_cost(i, j)
+                    if chg < cost:
+                        cost = chg
+                        transaction = 2
+                    distances[i][j] = cost
+                    if memo_key is not None:
+                        tree_distances.append((kr1.idx - i, kr2.idx - j, cost))
                 else:
-                    j_minus_1 = j - 1
-                n2 = self.t2[j]
-
-                if n1.leftmost() == kr1.leftmost() and n2.leftmost() == kr2.leftmost():
-                    rem = transactions[i_minus_1][j]
-                    ins = transactions[i][j_minus_1]
-                    chg = transactions[i_minus_1][j_minus_1]
-                    node_distance = self.get_node_distance(n1, n2)
-                    # cost of each transaction
-                    transaction = self.get_lowest_cost(
-                        len(rem) + self.rem_cost,
-                        len(ins) + self.ins_cost,
-                        len(chg) + node_distance,
-                    )
-                    if transaction == 0:
-                        # record a remove
-                        rc = rem.copy()
-                        rc.append(self.transaction_to_idx[i][None])
-                        transactions[i][j] = rc
-                    elif transaction == 1:
-                        # record an insert
-                        ic = ins.copy()
-                        ic.append(self.transaction_to_idx[None][j])
-                        transactions[i][j] = ic
-                    else:
-                        # If nodes i and j are different, record a change, otherwise there is no transaction
-                        transactions[i][j] = chg.copy()
-                        if node_distance == 1:
-                            transactions[i][j].append(self.transaction_to_idx[i][j])
-
-                    self.transactions[i][j] = transactions[i][j].copy()
+                    # otherwise, previously-computed tree distance between nodes i and j
+                    chg = forest[i_leftmost - l1][j_leftmost - l2] + distances[i][j]
+                    if chg < cost:
+                        cost = chg
+                        transaction = 2
+                row[jj] = cost
+                if backpointers:
+                    bp_row[jj] = transaction
+        if memo_key is not None:
+            self.memo.add(memo_key, tree_distances)
+        return bp
+
+    def get_transactions(self, i=None, j=None):
+        """Rebuild the minimum transactions to get from sub-tree i (tree1) to sub-tree j (tree2).
+
+        Defaults to the full trees. Each transaction is a tuple of (tree1 idx, tree2 idx) with None in
+        place of the index for inserts/removes. Forest distances are only kept for the sub-problem being
+        unwound: any cell that relied on a stored tree distance is expanded by re-running that (smaller)
+        sub-problem with backpointers. Transactions are collected in reverse and flipped at the end.
+        """
+        if i is None:
+            i = len(self.t1) - 1
+        if j is None:
+            j = len(self.t2) - 1
+        reversed_transactions = []
+        # each frame: [backpointers, leftmost of tree1 sub-tree, leftmost of tree2 sub-tree, row, col]
+        frames = [self._transaction_frame(i, j)]
+        while frames:
+            frame = frames[-1]
+            bp, l1, l2, ii, jj = frame
+            if ii == 0 and jj == 0:
+                frames.pop()
+                continue
+            elif ii == 0:
+                transaction = 1
+            elif jj == 0:
+                transaction = 0
+            else:
+                transaction = bp[ii][jj]
+            if transaction == 0:
+                reversed_transactions.append((l1 + ii - 1, None))
+                frame[3] = ii - 1
+            elif transaction == 1:
+                reversed_transactions.append((None, l2 + jj - 1))
+                frame[4] = jj - 1
+            else:
+                n1 = l1 + ii - 1
+                n2 = l2 + jj - 1
+                n1_leftmost = self.t1_leftmost[n1]
+                n2_leftmost = self.t2_leftmost[n2]
+                if n1_leftmost == l1 and n2_leftmost == l2:
+                    # If nodes are different, record a change, otherwise there is no transaction
+                    if self.get_label_cost(n1, n2) == self.chg_cost:
+                        reversed_transactions.append((n1, n2))
+                    frame[3] = ii - 1
+                    frame[4] = jj - 1
                 else:
-                    # Previous transactions, leading up to a remove, insert or change
-                    rem = transactions[i_minus_1][j]
-                    ins = transactions[i][j_minus_1]
-
-                    if n1.leftmost() - 1 < kr1.leftmost():
-                        k1 = None
-                    else:
-                        k1 = n1.leftmost() - 1
-                    if n2.leftmost() - 1 < kr2.leftmost():
-                        k2 = None
-                    else:
-                        k2 = n2.leftmost() - 1
-                    chg = transactions[k1][k2]
-
-                    transaction = self.get_lowest_cost(
-                        len(rem) + self.rem_cost,
-                        len(ins) + self.ins_cost,
-                        len(chg) + len(self.transactions[i][j]),
-                    )
-                    if transaction == 0:
-                        # record a remove
-                        rc = rem.copy()
-                        rc.append(self.transaction_to_idx[i][None])
-                        transactions[i][j] = rc
-                    elif transaction == 1:
-                        # record an insert
-                        ic = ins.copy()
-                        ic.append(self.transaction_to_idx[None][j])
-                        transactions[i][j] = ic
-                    else:
-                        # record a change
-                        cc = chg.copy()
-                        cc.extend(self.transactions[i][j])
-                        transactions[i][j] = cc
+                    # forest up to the sub-trees followed by the sub-tree transactions themselves
+                    frame[3] = n1_leftmost - l1
+                    frame[4] = n2_leftmost - l2
+                    frames.append(self._transaction_frame(n1, n2))
+        reversed_transactions.reverse()
+        return reversed_transactions
+
+    def _transaction_frame(self, i, j):
+        """Compute backpointers for sub-trees i and j and start unwinding them from the bottom-right cell."""
+        n1 = self.t1[i]
+        n2 = self.t2[j]
+        bp = self.find_minimum_transactions(n1, n2, backpointers=True)
+        return [
+            bp,
+            self.t1_leftmost[i],
+            self.t2_leftmost[j],
+            i - self.t1_leftmost[i] + 1,
+            j - self.t2_leftmost[j] + 1,
+        ]
+
+    def get_transaction_nodes(self):
+        """Nodes that are removed, inserted, or changed by the minimum transactions."""
+        remove = []
+        insert = []
+        change = []
+        if self.t1 and self.t2:
+            for i, j in self.get_transactions():
+                # descendants of collapsed nodes weren't part of the tree distance but go along with them
+                if i is not None:
+                    remove.extend(self.collapsed.get(self.t1[i], ()))
+                if j is not None:
+                    insert.extend(self.collapsed.get(self.t2[j], ()))
+                if i is None:
+                    insert.append(self.t2[j])
+                elif j is None:
+                    remove.append(self.t1[i])
+                else:
+                    change.append((self.t1[i], self.t2[j]))
+        return {"remove": remove, "insert": insert, "change": change}
 
     def get_corresponding_nodes(self):
         """Explain transactions."""
-        if self.transactions:
-            transactions = self.transactions[len(self.t1) - 1][len(self.t2) - 1]
-            remove = []
-            insert = []
-            change = []
-            for i in range(0, len(transactions)):
-                if transactions[i][0] is None:
-                    ins_node = self.t2[transactions[i][1]]
-                    insert.append(ins_node)
-                elif transactions[i][1] is None:
-                    rem_node = self.t1[transactions[i][0]]
-                    remove.append(rem_node)
-                else:
-                    prev_node = self.t1[transactions[i][0]]
-                    curr_node = self.t2[transactions[i][1]]
-                    change.append((prev_node, curr_node))
-            diff = {"remove": remove, "insert": insert, "change": change}
-            self.detect_moves(diff)
-            return Diff(
-                nodes_removed=diff["remove"],
-                nodes_inserted=diff["insert"],
-                nodes_changed=diff["change"],
-                nodes_moved=diff["move"],
-            )
-        else:
-            return Diff(
-                nodes_removed=[], nodes_inserted=[], nodes_changed=[], nodes_moved=[]
-            )
+        diff = self.get_transaction_nodes()
+        self.detect_moves(diff)
+        return Diff(
+            nodes_removed=diff["remove"],
+            nodes_inserted=diff["insert"],
+            nodes_changed=diff["change"],
+            nodes_moved=diff["move"],
+            stage=self.stage,
+        )
 
-    def detect_moves(self, diff):
+    @staticmethod
+    def detect_moves(diff):
         """Detect when nodes were moved (as opposed to removed/inserted/changed) and update diff.
 
         Easy case:
@@ -528,30 +1359,29 @@ class Differ:
         # loop through prev/curr nodes and look for matches. constraints:
         # * nodes can only match with one other node
         # * if a node is part of a change, make sure it's corresponding node is moved to insert/remove accordingly
+        # current nodes are indexed by type/text so each previous node finds its first available match directly
+        curr_index = {}
+        for cet, cidx, cn in curr_nodes:
+            curr_index.setdefault((cn.ntype, cn.content_hash), deque()).append(
+                (cet, cidx)
+            )
         prev_moved = []
         curr_moved = []
-        curr_found = set()
         change_to_insert = {}
         change_to_remove = {}
         for pet, pidx, pn in prev_nodes:
-            for cet, cidx, cn in curr_nodes:
-                cid = f"{cet}-{cidx}"
-                # same type/text and not already part of a move
-                if (
-                    pn.ntype == cn.ntype
-                    and pn.content_hash == cn.content_hash
-                    and cid not in curr_found
-                ):
-                    prev_moved.append((pet, pidx))
-                    curr_moved.append((cet, cidx))
-                    curr_found.add(cid)
-                    if pet == "change":
-                        corresponding_changed_node = diff["change"][pidx][1]
-                        change_to_insert[pidx] = corresponding_changed_node
-                    if cet == "change":
-                        corresponding_changed_node = diff["change"][cidx][0]
-                        change_to_remove[cidx] = corresponding_changed_node
-                    break
+            # same type/text and not already part of a move
+            matches = curr_index.get((pn.ntype, pn.content_hash))
+            if matches:
+                cet, cidx = matches.popleft()
+                prev_moved.append((pet, pidx))
+                curr_moved.append((cet, cidx))
+                if pet == "change":
+                    corresponding_changed_node = diff["change"][pidx][1]
+                    change_to_insert[pidx] = corresponding_changed_node
+                if cet == "change":
+                    corresponding_changed_node = diff["change"][cidx][0]
+                    change_to_remove[cidx] = corresponding_changed_node
 
         # populate move list
         # if from a change, make sure it also isn't set to be moved to insert/remove
@@ -577,34 +1407,332 @@ class Differ:
                             cidx
                         )  # don't add to insert -- was involved in its own move
                 diff["move"].append((pn, cn))
-            moved = sorted(set(prev_moved + curr_moved), reverse=True)
-            for et, idx in moved:
-                diff[et].pop(idx)
+            moved = set(prev_moved + curr_moved)
+            for et in ("remove", "insert", "change"):
+                diff[et][:] = [
+                    n for idx, n in enumerate(diff[et]) if (et, idx) not in moved
+                ]
 
             diff["insert"].extend(list(change_to_insert.values()))
             diff["remove"].extend(list(change_to_remove.values()))
 
 
+class SectionDiffer:
+    """
+    Find structural differences between two WikitextTrees one section at a time.
+
+    Sections are first aligned across revisions (see align_sections) and then each changed pair of sections
+    is diffed as its own small tree. Removed/inserted sections are diffed against an empty tree so their
+    nested nodes are expanded the same way. Moves are detected once at the end across all sections.
+    """
+
+    def __init__(
+        self, t1, t2, differ=Differ, max_distance=None, workers=None, **kwargs
+    ):
+        self.lang = t1.lang
+        self.differ = differ  # Differ class used for each pair of sections
+        self.max_distance = max_distance  # shared across all pairs of sections
+        self.workers = workers  # if more than 1, diff pairs of sections in a pool of this many processes
+        if kwargs.get("memo") is None:
+            kwargs["memo"] = DistanceMemo()  # shared across all pairs of sections
+        self.differ_kwargs = kwargs
+        self.t1_sections = list(t1.root.children)
+        self.t2_sections = list(t2.root.children)
+        self.stage = None
+        self.distance = 0
+        (
+            self.sections_changed,
+            self.sections_removed,
+            self.sections_inserted,
+            self.sections_moved,
+        ) = self.align_sections()
+
+    @staticmethod
+    def get_heading(section):
+        """Heading of a section node -- e.g., "==Life==" (or "Lede")."""
+        return section.name.split(": ", maxsplit=1)[-1]
+
+    def get_weight(self, i, j):
+        """How much keeping a pair of matched sections in place saves over moving them (see align_sections).
+
+        Like Differ, which drops the nodes of identical sections (see prune_sections) so moving one costs a
+        remove and an insert, and otherwise has to remove and insert every node of a section that is moved
+        instead of diffing it in place. The latter is an upper bound -- the pair hasn't been diffed yet.
+        """
+        s1 = self.t1_sections[i]
+        s2 = self.t2_sections[j]
+        if s1.content_hash == s2.content_hash:
+            return 2
+        return 2 * min(estimate_size(s1), estimate_size(s2))
+
+    def align_sections(self):
+        """Align sections across revisions.
+
+        * Sections with identical content are matched first and then sections with the same heading.
+        * The set of matches that preserves section order and saves the most (see get_weight) is kept --
+          like the full tree differ, this keeps changed sections in place and moves identical ones around them.
+          Out-of-order sections are moves if identical or otherwise diffed against the section with the same
+          heading like any other changed pair.
+        * Unmatched sections that fall between the same two kept matches are paired up in order as changes.
+          Any that are left over are removed/inserted.
+
+        Returns lists of (prev idx, curr idx) changed pairs, prev idx removed, curr idx inserted,
+        and (prev idx, curr idx) moved pairs.
+        """
+        matches = {}
+        for key in (lambda n: n.content_hash, self.get_heading):
+            t2_positions = {}
+            t2_matched = set(matches.values())
+            for j, s2 in enumerate(self.t2_sections):
+                if j not in t2_matched:
+                    t2_positions.setdefault(key(s2), deque()).append(j)
+            for i, s1 in enumerate(self.t1_sections):
+                if i not in matches and t2_positions.get(key(s1)):
+                    matches[i] = t2_positions[key(s1)].popleft()
+
+        matched = sorted(matches.items())
+        in_order = set(
+            heaviest_increasing_subsequence(
+                [j for _, j in matched], [self.get_weight(i, j) for i, j in matched]
+            )
+        )
+        anchors = []
+        moved = []
+        moved_changed = []
+        for k, (i, j) in enumerate(matched):
+            if k in in_order:
+                anchors.append((i, j))
+            elif self.t1_sections[i].content_hash == self.t2_sections[j].content_hash:
+                moved.append((i, j))
+            else:
+                moved_changed.append((i, j))
+
+        changed = []
+        removed = []
+        inserted = []
+        matched_prev = {i for i, _ in anchors + moved + moved_changed}
+        matched_curr = {j for _, j in anchors + moved + moved_changed}
+        prev_anchor = (-1, -1)
+        for anchor in anchors + [(len(self.t1_sections), len(self.t2_sections))]:
+            gap_prev = [
+                i for i in range(prev_anchor[0] + 1, anchor[0]) if i not in matched_prev
+            ]
+            gap_curr = [
+                j for j in range(prev_anchor[1] + 1, anchor[1]) if j not in matched_curr
+            ]
+            changed.extend(zip(gap_prev, gap_curr))
+            removed.extend(gap_prev[len(gap_curr) :])
+            inserted.extend(gap_curr[len(gap_prev) :])
+            if anchor[0] < len(self.t1_sections):
+                i, j = anchor
+                if self.t1_sections[i].content_hash != self.t2_sections[j].content_hash:
+                    changed.append(anchor)
+            prev_anchor = anchor
+        changed.extend(moved_changed)
+        return changed, removed, inserted, moved
+
+    def diff_sections(self, prev_section=None, curr_section=None):
+        """Run the tree differ on a single pair of sections (either may be None)."""
+        t1 = WikitextTree(wikitext="", lang=self.lang)
+        t2 = WikitextTree(wikitext="", lang=self.lang)
+        if prev_section is not None:
+            prev_section.parent = t1.root
+        if curr_section is not None:
+            curr_section.parent = t2.root
+        max_distance = None
+        if self.max_distance is not None:
+            max_distance = self.max_distance - self.distance
+            if max_distance < 0:
+                raise MaxDistanceExceeded(self.max_distance, self.distance)
+        d = self.differ(t1, t2, max_distance=max_distance, **self.differ_kwargs)
+        self.add_distance(d.get_distance(), d.stage)
+        return d.get_transaction_nodes()
+
+    def add_distance(self, distance, stage):
+        self.distance += distance
+        # record least-detailed stage that was used by any pair of sections
+        if self.stage is None or STAGES.index(stage) > STAGES.index(self.stage):
+            self.stage = stage
+
+    def diff_sections_parallel(self, pairs):
+        """Diff each (prev section, curr section) pair in a pool of worker processes.
+
+        Sections are sent as plain text (see encode_section) and the nodes in each sub-diff come back as
+        (name, type, text, section) tuples -- that is all that is needed to report them and detect moves.
+        Each pair gets the full max_distance; the total is checked once all pairs are done.
+        """
+        kwargs = dict(self.differ_kwargs, max_distance=self.max_distance, memo=None)
+        jobs = [
+            (self.differ, self.lang, kwargs, encode_section(p), encode_section(c))
+            for p, c in pairs
+        ]
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(_diff_encoded_sections, jobs))
+        sub_diffs = []
+        for distance, stage, encoded_diff in results:
+            self.add_distance(distance, stage)
+            sub_diffs.append(
+                {
+                    "remove": [decode_node(r) for r in encoded_diff["remove"]],
+                    "insert": [decode_node(r) for r in encoded_diff["insert"]],
+                    "change": [
+                        (decode_node(r1), decode_node(r2))
+                        for r1, r2 in encoded_diff["change"]
+                    ],
+                }
+            )
+        if self.max_distance is not None and self.distance > self.max_distance:
+            raise MaxDistanceExceeded(self.max_distance, self.distance)
+        return sub_diffs
+
+    def get_corresponding_nodes(self):
+        """Explain transactions."""
+        diff = {"remove": [], "insert": [], "change": []}
+        pairs = (
+            [
+                (self.t1_sections[i], self.t2_sections[j])
+                for i, j in self.sections_changed
+            ]
+            + [(self.t1_sections[i], None) for i in self.sections_removed]
+            + [(None, self.t2_sections[j]) for j in self.sections_inserted]
+        )
+        if self.workers is not None and self.workers > 1 and len(pairs) > 1:
+            sub_diffs = self.diff_sections_parallel(pairs)
+        else:
+            sub_diffs = [self.diff_sections(p, c) for p, c in pairs]
+        for sub_diff in sub_diffs:
+            for et in diff:
+                diff[et].extend(sub_diff[et])
+        # identical sections that moved -- picked up as a move by detect_moves
+        for i, j in self.sections_moved:
+            diff["remove"].append(self.t1_sections[i])
+            diff["insert"].append(self.t2_sections[j])
+        Differ.detect_moves(diff)
+        return Diff(
+            nodes_removed=diff["remove"],
+            nodes_inserted=diff["insert"],
+            nodes_changed=diff["change"],
+            nodes_moved=diff["move"],
+            stage=self.stage or "full",
+        )
+
+
+def encode_section(section):
+    """Compact, picklable form of a (not yet expanded) section node: its name, wikitext, and top-level nodes."""
+    if section is None:
+        return None
+    return (
+        section.name,
+        section.text,
+        [(n.name, n.ntype, n.text) for n in section.children],
+    )
+
+
+def decode_section(encoded, tree):
+    """Rebuild a section from encode_section under the root of tree.
+
+    The section's wikitext is parsed once and its nodes stand in for the mwparserfromhell nodes of the
+    children, which are only needed if a node is expanded. In the rare case that the nodes don't line up
+    with the children, each child's wikitext is parsed on its own instead.
+    """
+    if encoded is not None:
+        name, text, children = encoded
+        wt = parse_wikitext(text)
+        s_node = OrderedNode(
+            name,
+            ntype="Section",
+            mwnode=wt,
+            section=name,
+            parent=tree.root,
+            text=text,
+        )
+        tree.secname_to_text[name] = text
+        tree.secname_to_wikicode[name] = wt
+        nodes = wt.nodes
+        if len(nodes) != len(children) or any(
+            str(n) != child_text for n, (_, _, child_text) in zip(nodes, children)
+        ):
+            nodes = []
+            for _, _, child_text in children:
+                child_wt = parse_wikitext(child_text)
+                nodes.append(
+                    child_wt.nodes[0] if len(child_wt.nodes) == 1 else child_wt
+                )
+        for (child_name, ntype, child_text), mwnode in zip(children, nodes):
+            OrderedNode(
+                child_name,
+                ntype=ntype,
+                mwnode=mwnode,
+                section=name,
+                parent=s_node,
+                text=child_text,
+            )
+
+
+def encode_node(node):
+    """Compact, picklable form of a node in a diff."""
+    return (node.name, node.ntype, node.text, node.section)
+
+
+def decode_node(encoded):
+    name, ntype, text, section = encoded
+    return OrderedNode(name, ntype=ntype, mwnode=text, section=section)
+
+
+def _diff_encoded_sections(job):
+    """Diff a pair of encoded sections (either may be None) -- runs in a worker process of SectionDiffer."""
+    differ, lang, kwargs, prev_section, curr_section = job
+    t1 = WikitextTree(wikitext="", lang=lang)
+    t2 = WikitextTree(wikitext="", lang=lang)
+    decode_section(prev_section, t1)
+    decode_section(curr_section, t2)
+    d = differ(t1, t2, **kwargs)
+    diff = d.get_transaction_nodes()
+    encoded_diff = {
+        "remove": [encode_node(n) for n in diff["remove"]],
+        "insert": [encode_node(n) for n in diff["insert"]],
+        "change": [(encode_node(n1), encode_node(n2)) for n1, n2 in diff["change"]],
+    }
+    return d.get_distance(), d.stage, encoded_diff
+
+
 class Diff:
     """
     Diff result with helper functions for post-processing / cleaning up the result
     """
 
-    def __init__(self, nodes_removed, nodes_inserted, nodes_changed, nodes_moved):
+    def __init__(
+        self, nodes_removed, nodes_inserted, nodes_changed, nodes_moved, stage="full"
+    ):
         self.remove = [n.dump() for n in nodes_removed]
         self.insert = [n.dump() for n in nodes_inserted]
         self.change = [
             {"prev": pn.dump(), "curr": cn.dump()} for pn, cn in nodes_changed
         ]
         self.move = [{"prev": pn.dump(), "curr": cn.dump()} for pn, cn in nodes_moved]
+        self.stage = stage  # level of detail of the diff (see STAGES)
+        # wikitext of each node in the diff -> its already-parsed mwparserfromhell node
+        self.parsed = {}
+        for n in (
+            nodes_removed
+            + nodes_inserted
+            + [n for pair in nodes_changed + nodes_moved for n in pair]
+        ):
+            if isinstance(n.mwnode, mw.nodes.Node):
+                self.parsed[n.text] = n.mwnode
         self.sections_p_to_c = {}
         self.sections_c_to_p = {}
         self.processed = False
 
-    def post_process(self, sections_prev, sections_curr, lang):
+    def post_process(
+        self, sections_prev, sections_curr, lang, wikicode_prev=None, wikicode_curr=None
+    ):
+        """Build the result from section name -> wikitext (and optionally -> already-parsed section)."""
         if not self.processed:
             self._section_mapping(sections_prev, sections_curr)
-            self._merge_text_changes(sections_prev, sections_curr, lang)
+            self._merge_text_changes(
+                sections_prev, sections_curr, lang, wikicode_prev, wikicode_curr
+            )
             self._build_result(sections_prev, sections_curr)
             self.processed = True
         return self.result
@@ -637,6 +1765,7 @@ class Diff:
             "insert": self.insert,
             "change": self.change,
             "move": self.move,
+            "stage": self.stage,
         }
 
     def _section_mapping(self, sections_prev, sections_curr):
@@ -645,48 +1774,40 @@ class Diff:
         curr = list(sections_curr.keys())
         p_to_c = {}
         c_to_p = {}
-        removed = []
+        # section names are unique (they include the section index) so can be used to look up positions
         # removed sections map to null in current; inserted sections map to null in previous
-        for n in self.remove:
-            if n["type"] == "Section":
-                for i, s in enumerate(prev):
-                    if s == n["section"]:
-                        removed.append(i)
-                        break
-        for idx in sorted(removed, reverse=True):
-            p_to_c[prev[idx]] = None
-            prev.pop(idx)
-
-        inserted = []
-        for n in self.insert:
-            if n["type"] == "Section":
-                for i, s in enumerate(curr):
-                    if s == n["section"]:
-                        inserted.append(i)
-                        break
-        for idx in sorted(inserted, reverse=True):
-            c_to_p[curr[idx]] = None
-            curr.pop(idx)
+        removed = {n["section"] for n in self.remove if n["type"] == "Section"}
+        for s in reversed(prev):
+            if s in removed:
+                p_to_c[s] = None
+        prev = [s for s in prev if s not in removed]
+        inserted = {n["section"] for n in self.insert if n["type"] == "Section"}
+        for s in reversed(curr):
+            if s in inserted:
+                c_to_p[s] = None
+        curr = [s for s in curr if s not in inserted]
 
         # changes happen in place so don't effect structure of doc and can be ignored
-        # for moved sections, reorder mapping so they are aligned again for dumping
+        # for moved sections, reorder mapping so they are aligned again for dumping: each moved section takes
+        # the position of its previous version and the other sections fill the remaining positions in order
+        prev_idx = {s: i for i, s in enumerate(prev)}
+        curr_set = set(curr)
+        placed = {}
         for c in self.move:
             pn = c["prev"]
             cn = c["curr"]
-            if pn["type"] == "Section":
-                prev_idx = None
-                curr_idx = None
-                for i, s in enumerate(prev):
-                    if s == pn["section"]:
-                        prev_idx = i
-                        break
-                for i, s in enumerate(curr):
-                    if s == cn["section"]:
-                        curr_idx = i
-                        break
-                if prev_idx is not None and curr_idx is not None:
-                    s = curr.pop(curr_idx)
-                    curr.insert(prev_idx, s)
+            if (
+                pn["type"] == "Section"
+                and pn["section"] in prev_idx
+                and cn["section"] in curr_set
+            ):
+                placed[prev_idx[pn["section"]]] = cn["section"]
+        if placed:
+            moved = set(placed.values())
+            unmoved = iter([s for s in curr if s not in moved])
+            curr = [
+                placed[i] if i in placed else next(unmoved) for i in range(len(curr))
+            ]
 
         for i in range(len(prev)):
             p_to_c[prev[i]] = curr[i]
@@ -695,14 +1816,28 @@ class Diff:
         self.sections_p_to_c = p_to_c
         self.sections_c_to_p = c_to_p
 
-    def _merge_text_changes(self, sections_prev, sections_curr, lang="en"):
-        """Replace isolated text changes with section-level text changes."""
+    def _merge_text_changes(
+        self,
+        sections_prev,
+        sections_curr,
+        lang="en",
+        wikicode_prev=None,
+        wikicode_curr=None,
+    ):
+        """Replace isolated text changes with section-level text changes.
+
+        Plain text is extracted from wikicode_prev/wikicode_curr (parsed sections) if provided.
+        """
+        if wikicode_prev is None:
+            wikicode_prev = sections_prev
+        if wikicode_curr is None:
+            wikicode_curr = sections_curr
         changes = []
         # check each previous section and add if not a match with its corresponding current section
         for psec in self.sections_p_to_c:
             csec = self.sections_p_to_c[psec]
             if csec is None:
-                prev_text = wikitext_to_plaintext(sections_prev[psec], lang=lang)
+                prev_text = wikitext_to_plaintext(wikicode_prev[psec], lang=lang)
                 changes.append(
                     {
                         "prev": {
@@ -715,8 +1850,8 @@ class Diff:
                     }
                 )
             elif sections_prev[psec] != sections_curr[csec]:
-                prev_text = wikitext_to_plaintext(sections_prev[psec], lang=lang)
-                curr_text = wikitext_to_plaintext(sections_curr[csec], lang=lang)
+                prev_text = wikitext_to_plaintext(wikicode_prev[psec], lang=lang)
+                curr_text = wikitext_to_plaintext(wikicode_curr[csec], lang=lang)
                 if prev_text != curr_text:
                     changes.append(
                         {
@@ -740,7 +1875,7 @@ class Diff:
         for csec in self.sections_c_to_p:
             psec = self.sections_c_to_p[csec]
             if psec is None:
-                curr_text = wikitext_to_plaintext(sections_curr[csec], lang=lang)
+                curr_text = wikitext_to_plaintext(wikicode_curr[csec], lang=lang)
                 changes.append(
                     {
                         "curr": {
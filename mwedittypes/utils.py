@@ -1,8 +1,16 @@
 # helper functions for handling mwparserfromhell / wikitext
+import hashlib
 import re
+import threading
 
 import mwparserfromhell as mw
 
+# optional dependency -- only needed for set_content_hasher("xxhash")
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 from mwedittypes.constants import (
     CAT_ALIASES,
     CAT_PREFIXES,
@@ -14,79 +22,162 @@ from mwedittypes.constants import (
     TEXT_FORMATTING_TAGS,
 )
 
+# number of times wikitext has been parsed (see parse_wikitext) -- per thread so that diffs running
+# concurrently in several threads don't count each other's parses
+_parse_counts = threading.local()
+
+
+def parse_wikitext(wikitext):
+    """Parse wikitext with mwparserfromhell (style tags are treated as text) and count it.
+
+    Parsing is the most expensive step so a diff should only parse each revision once and carry the parsed
+    nodes along -- mw.parse on an already-parsed node just wraps it without parsing it again.
+    """
+    _parse_counts.num_parses = get_num_parses() + 1
+    return mw.parse(wikitext, skip_style_tags=True)
+
+
+def get_num_parses():
+    """Number of times wikitext has been parsed in this thread -- e.g., to check that a diff parses it once."""
+    return getattr(_parse_counts, "num_parses", 0)
+
+
+def blake2b_fingerprint(text):
+    """Stable fingerprint of text: its length (in characters) followed by a 64-bit blake2b digest of it.
+
+    Unlike Python's hash(), which is salted per process (PYTHONHASHSEED), this is the same in every process so
+    it can be persisted or sent to other processes. Two texts can only collide if they have the same length.
+    """
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+    return (len(text) << 64) | int.from_bytes(digest, "little")
+
+
+def xxhash_fingerprint(text):
+    """Like blake2b_fingerprint but with the (faster, non-cryptographic) 64-bit xxh3 hash."""
+    return (len(text) << 64) | xxhash.xxh3_64_intdigest(text.encode("utf-8"))
+
+
+# name -> function from text to an int -- see set_content_hasher
+CONTENT_HASHERS = {
+    "blake2b": blake2b_fingerprint,
+    "xxhash": xxhash_fingerprint,
+    "builtin": hash,  # fastest but salted per process
+}
+_content_hasher = blake2b_fingerprint
+
+
+def set_content_hasher(hasher="blake2b"):
+    """Set how content_hash fingerprints the text of nodes and sections -- a name in CONTENT_HASHERS or a function.
+
+    The hasher applies to every diff in this process and has to be set before building the trees that are
+    compared. Worker processes (e.g., StructuredEditTypes with workers=N) import this module anew so a hasher
+    other than the default has to be set there too.
+    """
+    global _content_hasher
+    if not callable(hasher):
+        if hasher not in CONTENT_HASHERS:
+            raise ValueError(f"Unknown content hasher: {hasher}")
+        if hasher == "xxhash" and xxhash is None:
+            raise ImportError(
+                "xxhash is required for set_content_hasher('xxhash'): pip install mwedittypes[xxhash]"
+            )
+        hasher = CONTENT_HASHERS[hasher]
+    _content_hasher = hasher
+
+
+def content_hash(text):
+    """Fingerprint of the text of a node or section -- by default stable across processes (see set_content_hasher)."""
+    return _content_hasher(text)
+
 
 def simple_node_class(mwnode, lang="en"):
     """e.g., "<class 'mwparserfromhell.nodes.heading.Heading'>" -> "Heading"."""
     if type(mwnode) == str:
         return "Text"
     else:
-        nc = str(type(mwnode)).split(".")[-1].split("'")[0]
+        # the class's own name rather than a new string for every node -- e.g., a tree keeps one per node
+        nc = type(mwnode).__name__
         if nc == "Wikilink":
-            n_prefix = mwnode.title.split(":", maxsplit=1)[0].lower()
-            if n_prefix in [
-                m.lower() for m in MEDIA_PREFIXES + MEDIA_ALIASES.get(lang, [])
-            ]:
-                nc = "Media"
-            elif n_prefix in [
-                c.lower() for c in CAT_PREFIXES + CAT_ALIASES.get(lang, [])
-            ]:
-                nc = "Category"
+            return wikilink_node_class(mwnode.title, lang)
         elif nc == "Tag":
-            tag_type = str(mwnode.tag).lower()
-            if tag_type in TEXT_FORMATTING_TAGS:
-                return "Text Formatting"
-            elif tag_type in LIST_TAGS:
-                return "List"
-            elif tag_type == "table":
-                return "Table"
-            elif tag_type in TABLE_ELEMENTS_TAGS:
-                return "Table Element"
-            elif tag_type == "gallery":
-                return "Gallery"
-            elif tag_type == "ref":
-                return "Reference"
-            elif tag_type == "noinclude":
-                return "Comment"
-            # any others I missed -- e.g., div, meta, etc.
-            else:
-                return "Other Tag"
+            return tag_node_class(str(mwnode.tag))
         return nc
 
 
+def wikilink_node_class(title, lang="en"):
+    """Type of a wikilink based on its title -- e.g., "File:Example.jpg" -> "Media"."""
+    n_prefix = title.split(":", maxsplit=1)[0].lower()
+    if n_prefix in [m.lower() for m in MEDIA_PREFIXES + MEDIA_ALIASES.get(lang, [])]:
+        return "Media"
+    elif n_prefix in [c.lower() for c in CAT_PREFIXES + CAT_ALIASES.get(lang, [])]:
+        return "Category"
+    return "Wikilink"
+
+
+def tag_node_class(tag):
+    """Type of a tag based on its name -- e.g., "ref" -> "Reference"."""
+    tag_type = tag.lower()
+    if tag_type in TEXT_FORMATTING_TAGS:
+        return "Text Formatting"
+    elif tag_type in LIST_TAGS:
+        return "List"
+    elif tag_type == "table":
+        return "Table"
+    elif tag_type in TABLE_ELEMENTS_TAGS:
+        return "Table Element"
+    elif tag_type == "gallery":
+        return "Gallery"
+    elif tag_type == "ref":
+        return "Reference"
+    elif tag_type == "noinclude":
+        return "Comment"
+    # any others I missed -- e.g., div, meta, etc.
+    else:
+        return "Other Tag"
+
+
 def sec_to_name(mwsection, sidx):
     """Converts a section to an interpretible and unique name."""
     if sidx == 0:
-        sectitle = "Lede"
-    else:
-        try:
-            sectitle = str(mwsection.nodes[0])
-        except IndexError:
-            sectitle = ""
-    return f"{sidx}: {sectitle}"
+        return section_name(sidx)
+    try:
+        return section_name(sidx, str(mwsection.nodes[0]))
+    except IndexError:
+        return section_name(sidx, "")
+
+
+def section_name(sidx, heading=None):
+    """Name of the sidx-th section from the wikitext of its heading (the lede has none)."""
+    if sidx == 0:
+        return f"{sidx}: Lede"
+    return f"{sidx}: {heading}"
 
 
 def node_to_name(mwnode, lang="en"):
     """Converts a mwparserfromhell node to an interpretible name."""
-    n_txt = mwnode.replace("\n", "\\n")
+    return text_to_name(str(mwnode), simple_node_class(mwnode, lang))
+
+
+def text_to_name(text, ntype):
+    """Converts the wikitext of a node of type ntype to an interpretible name."""
+    n_txt = text.replace("\n", "\\n")
     if len(n_txt) > 13:
-        return f"{simple_node_class(mwnode, lang)}: {n_txt[:10]}..."
+        return f"{ntype}: {n_txt[:10]}..."
     else:
-        return f"{simple_node_class(mwnode, lang)}: {n_txt}"
+        return f"{ntype}: {n_txt}"
 
 
 def wikitext_to_plaintext(wt, lang="en"):
     """Helper function for converting wikitext to plaintext.
 
+    wt can also be already-parsed Wikicode -- e.g., a section -- so it doesn't have to be parsed again.
     Removes text-formatting syntax (italic '', bold ''', bold-italic ''''') from nodes because
     skip_style_tags is set to True and so these syntax are treated as text by mwparserfromhell.
     This is to avoid parsing issues that arise from unclosed text-formatting syntax.
     """
-    return "".join(
-        [
-            re.sub("'{2,}", "", extract_text(n, lang))
-            for n in mw.parse(wt, skip_style_tags=True).nodes
-        ]
-    )
+    if not isinstance(wt, mw.wikicode.Wikicode):
+        wt = parse_wikitext(wt)
+    return "".join([re.sub("'{2,}", "", extract_text(n, lang)) for n in wt.nodes])
 
 
 def extract_text(mwnode, lang="en"):
@@ -15,6 +15,8 @@ LONG_DESCRIPTION = "A package that allows edit diffs and type detection for Wiki
 # Dev dependencies
 EXTRAS_REQUIRE = {
     "tests": ["pytest>=6.2.5"],
+    "numpy": ["numpy"],
+    "xxhash": ["xxhash"],
 }
 
 EXTRAS_REQUIRE["dev"] = EXTRAS_REQUIRE["tests"]
@@ -31,7 +33,7 @@ setup(
     long_description_content_type="text/markdown",
     long_description=long_description,
     packages=find_packages(),
-    install_requires=["mwparserfromhell", "anytree", "mwconstants"],
+    install_requires=["mwparserfromhell", "mwconstants"],
     keywords=[
         "python",
         "wikipedia",
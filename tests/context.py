@@ -3,9 +3,24 @@ import sys
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from mwedittypes.constants import ENGLISH_UNICODE, NON_ENGLISH_UNICODE
 from mwedittypes.mwedittypes import SimpleEditTypes, StructuredEditTypes
-from mwedittypes.tokenizer import parse_change_text
-from mwedittypes.utils import full_diff_to_simple
+from mwedittypes.scanner import AmbiguousWikitext, localize_changes, scan_sections
+from mwedittypes.tokenizer import (
+    Tokenizer,
+    get_tokenizer,
+    parse_change_text,
+    preload_tokenizers,
+)
+from mwedittypes.tree_differ import (
+    Differ,
+    DistanceMemo,
+    MaxDistanceExceeded,
+    OrderedNode,
+    WikitextTree,
+    estimate_complexity,
+)
+from mwedittypes.utils import full_diff_to_simple, set_content_hasher, simple_node_class
 
 # Basic wikitext to play with that has most of the things we're interested in (image, categories, templates, etc.)
 # Source: https://en.wikipedia.org/wiki/Karl_Aigen
@@ -1,4 +1,9 @@
-from context import StructuredEditTypes, prev_wikitext
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from context import SimpleEditTypes, StructuredEditTypes, prev_wikitext
 
 # NOTE: these tests focus specifically on the additional node details and assume that the edittypes_summary tests
 # do the heavy work to ensure that text/context changes are correctly processed.
@@ -59,3 +64,91 @@ def test_unbracketed_media():
     assert gallery.edittype == 'insert', gallery
     assert gallery.name is None, gallery
     assert len(gallery.changes) == 0, gallery
+
+
+def test_single_parse():
+    # each revision should be parsed once and the parsed nodes reused for node and text changes
+    curr_wikitext = prev_wikitext.replace('{{Use dmy dates|date=April 2017}}\n',
+                                          '{{Use dmy dates|date=April 2018}}\n',
+                                          1).replace('[[Vienna]]', '[[Wien]]').replace('goldsmith', 'painter')
+    et = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en')
+    full_diff = et.get_diff()
+    assert len(full_diff['node-edits']) == 2, full_diff
+    assert et.num_parses == 2
+    # falling back through every stage to the simple diff doesn't parse the revisions again either
+    et = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', max_cells=1)
+    et.get_diff()
+    assert et.stage == 'simple'
+    assert et.num_parses == 2
+    # localized: only the two changed sections (Life and External links) of each revision are parsed -- once
+    et = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', localize=True)
+    assert et.get_diff() == full_diff
+    assert et.num_parses == 4
+    et = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', max_cells=1, localize=True)
+    et.get_diff()
+    assert et.stage == 'simple'
+    assert et.num_parses == 4
+
+
+def test_single_parse_threads():
+    # parses are counted per thread so diffs running concurrently don't count each other's
+    curr_wikitext = prev_wikitext.replace('[[Vienna]]', '[[Wien]]')
+
+    def num_parses(localize):
+        et = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', localize=localize)
+        et.get_diff()
+        return et.num_parses
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        counts = list(pool.map(num_parses, [False, True] * 16))
+    assert counts == [2, 2] * 16
+
+
+@pytest.mark.parametrize('edit', [
+    lambda wt: wt.replace('goldsmith', 'painter'),
+    lambda wt: wt.replace('==References==', '==Notes==\n[[Link]]\n\n==References==', 1),
+    lambda wt: wt.replace('===Works===', '===Works===\n{{citation needed}}', 1) + '\n==Works==\nNew.',
+    lambda wt: wt.replace('==References==\n{{reflist}}\n\n', '', 1) + '\n==References==\n{{reflist}}\n\n',
+])
+def test_localize(edit):
+    # only changed sections are parsed but the diff is the same as for the full revisions
+    curr_wikitext = edit(prev_wikitext)
+    assert_localize_is_same(prev_wikitext, curr_wikitext)
+
+
+def assert_localize_is_same(prev_wikitext, curr_wikitext):
+    for kwargs in ({}, {'by_section': True}, {'algorithm': 'fast'}, {'max_cells': 1}):
+        assert (StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', localize=True, **kwargs).get_diff()
+                == StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', **kwargs).get_diff())
+    for backend in ('mwparserfromhell', 'scanner'):
+        assert (SimpleEditTypes(prev_wikitext, curr_wikitext, lang='en', backend=backend, localize=True).get_diff()
+                == SimpleEditTypes(prev_wikitext, curr_wikitext, lang='en', backend=backend).get_diff())
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_localize_fuzz(seed):
+    # random section-level edits -- moves, copies, removals, and edits within sections -- of articles that include
+    # markup that the scanner has to give up on (e.g., a heading that ends a template) for the same diffs
+    articles = [prev_wikitext,
+                'Intro\n{{tmpl\n==H==\n}}\nmore [[a]]\n==B==\ntext [[b]]',
+                'Lede [[x]].\n==A==\n{{t|a=\n==Z==\n}} [[y]]\n==B==\nSame [[s]]\n==C==\n<ref>a</ref> ok\n'
+                '==B==\nSame [[s]]\n']
+    rnd = random.Random(seed)
+    for _ in range(5):
+        sections = re.split(r'(?m)^(?===)', rnd.choice(articles))
+        edited = list(sections)
+        for _ in range(rnd.randint(1, 3)):
+            op = rnd.randint(0, 4)
+            i = rnd.randrange(len(edited))
+            if op == 0:
+                j = rnd.randrange(len(edited))
+                edited[i], edited[j] = edited[j], edited[i]
+            elif op == 1:
+                edited.insert(rnd.randrange(len(edited) + 1), edited[i])
+            elif op == 2 and len(edited) > 1:
+                edited.pop(i)
+            elif op == 3:
+                edited[i] = edited[i].replace('[[', '[[c', 1)
+            else:
+                edited[i] += 'Extra [[L]] {{T}}\n'
+        assert_localize_is_same(''.join(sections), ''.join(edited))
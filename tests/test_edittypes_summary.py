@@ -261,6 +261,23 @@ def test_nested_nodes_ref_temp_link():
     assert full_diff_to_simple(full_diff) == expected_changes
 
 
+def test_nested_nodes_max_depth():
+    # the wikilink is nested two levels deep (reference -> template -> wikilink)
+    curr_wikitext = prev_wikitext.replace("<ref>{{Bryan (3rd edition)|title=Aigen, Karl |volume=1}}</ref>",
+                                          "<ref>{{Bryan (3rd edition)|title=[[Aigen, Karl]] |volume=1}}</ref>",
+                                          1)
+    expected_changes = {'Reference': {'change': 1}, 'Template': {'change': 1}, 'Section': {'change': 1}}
+    diff = SimpleEditTypes(prev_wikitext, curr_wikitext, lang='en', max_depth=1).get_diff()
+    assert diff == expected_changes
+    full_diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', max_depth=1).get_diff()
+    assert full_diff_to_simple(full_diff) == expected_changes
+    expected_changes['Wikilink'] = {'insert': 1}
+    diff = SimpleEditTypes(prev_wikitext, curr_wikitext, lang='en', max_depth=2).get_diff()
+    assert diff == expected_changes
+    full_diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', max_depth=2).get_diff()
+    assert full_diff_to_simple(full_diff) == expected_changes
+
+
 def test_swap_templates():
     curr_wikitext = prev_wikitext.replace("{{commons category}}\n{{Authority control}}",
                                           "{{Authority control}}\n{{commons category}}",
@@ -328,3 +345,30 @@ def test_moved_section():
     assert diff == simple_expected_changes
     full_diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en').get_diff()
     assert full_diff_to_simple(full_diff) == full_expected_changes
+
+
+def test_repeated_nodes():
+    # many identical nodes in different sections -- only the extra ones should be counted
+    lines = [f"==Section {s}==\n" + "\n".join("Claim ''disputed''.{{citation needed}}<ref>{{cite|[[Source]]}}</ref>"
+                                               for _ in range(200)) for s in range(3)]
+    prev_wikitext = '\n'.join(lines)
+    curr_wikitext = prev_wikitext.replace("==Section 1==\n", "==Section 1==\n" + "Claim ''new''.{{citation needed}}"
+                                          "<ref>{{cite|[[Source]]}}</ref>\n" * 3, 1)
+    expected_changes = {'Text Formatting': {'insert': 3}, 'Template': {'insert': 6}, 'Wikilink': {'insert': 3},
+                        'Reference': {'insert': 3}, 'Section': {'change': 1}, 'Word': {'insert': 6},
+                        'Whitespace': {'insert': 6}, 'Punctuation': {'insert': 3}, 'Sentence': {'insert': 3},
+                        'Paragraph': {'change': 1}}
+    diff = SimpleEditTypes(prev_wikitext, curr_wikitext, lang='en').get_diff()
+    assert diff == expected_changes
+
+
+@pytest.mark.parametrize('old,new', [
+    ("Aigen was born", "Aigen was born [[link]]"),
+    ("{{Bryan (3rd edition)|title=Aigen, Karl", "{{Bryan (3rd edition)|title=Aigen, Karl [[link]]"),
+    ("===Works===", "===Paintings===\n* {{x}}"),
+    ("[[Category:", "''new'' https://example.org [[Category:"),
+])
+def test_scanner_backend(old, new):
+    curr_wikitext = prev_wikitext.replace(old, new, 1)
+    et = SimpleEditTypes(prev_wikitext, curr_wikitext, lang='en', backend='scanner')
+    assert et.get_diff() == SimpleEditTypes(prev_wikitext, curr_wikitext, lang='en').get_diff()
@@ -0,0 +1,81 @@
+import mwparserfromhell as mw
+import pytest
+from context import (
+    AmbiguousWikitext,
+    cjk_prev_wikitext,
+    localize_changes,
+    prev_wikitext,
+    scan_sections,
+    simple_node_class,
+)
+
+
+def parsed_sections(wikitext):
+    """Sections and top-level non-text nodes as found by mwparserfromhell."""
+    sections = mw.parse(wikitext, skip_style_tags=True).get_sections(flat=True)
+    return [(str(s), [(simple_node_class(n), str(n)) for n in s.nodes if simple_node_class(n) != 'Text'])
+            for s in sections]
+
+
+def scanned_sections(wikitext):
+    return [(wikitext[start:end], [(ntype, wikitext[n_start:n_end]) for ntype, n_start, n_end in nodes])
+            for start, end, nodes in scan_sections(wikitext)]
+
+
+@pytest.mark.parametrize('wikitext,ambiguous', [
+    (prev_wikitext, False),
+    (cjk_prev_wikitext, False),
+    ("Intro with [[a|link]], {{tpl|x={{nested|[[b]]}}}}, and a note.<ref name=\"n\">[https://x.org X] &amp; Y</ref>\n"
+     "==Section==\n* item <br/> {{{arg|default}}}\n;term : definition\n{|\n| cell {{x}}\n|}\n----\n"
+     "<gallery>\nFile:A.jpg|[[c\n</gallery><!-- comment -->[[Category:Z]]", False),
+    ('{{Infobox\n|a=b\n}}\n{{{arg\n|x}}}', False),
+    # mwparserfromhell ends the template at the heading / horizontal rule
+    ('Intro\n{{tmpl\n==H==\n}}\nmore [[a]]\n==B==\ntext [[b]]', True),
+    ('{{tmpl\n----\n}}', True),
+    # headings, horizontal rules, and tables at the start of a line within any other construct
+    ('{{tmpl|a=\n==H==\n}}', True),
+    ('<ref>\n----\n</ref>', True),
+    ('[[a|b\n==H==\n]]', True),
+    ('{{tmpl|x\n{|\n|}\n}}', True),
+    # new-line within a template or link name
+    ('{{tm\npl}}', True),
+    ('[[a\nb]]', True),
+])
+def test_scanner_matches_parser(wikitext, ambiguous):
+    # the scanner either finds the same sections and nodes as mwparserfromhell or gives up so that it is parsed
+    if ambiguous:
+        with pytest.raises(AmbiguousWikitext):
+            scan_sections(wikitext)
+    else:
+        assert scanned_sections(wikitext) == parsed_sections(wikitext)
+
+
+@pytest.mark.parametrize('wikitext', [
+    'Bare URL: https://example.org',
+    'Unclosed {{template',
+    'Stray </div> tag',
+    '[[[Triple brackets]]]',
+    '==Unbalanced heading=',
+    'Unknown &entity; here',
+])
+def test_scanner_ambiguous(wikitext):
+    with pytest.raises(AmbiguousWikitext):
+        scan_sections(wikitext)
+
+
+def test_localize_changes():
+    prev_wikitext = 'Lede\n==A==\nSame\n==B==\nOld\n==A==\nSame\n'
+    curr_wikitext = 'Lede\n==A==\nSame\n==B==\nNew\n'
+    prev, curr = localize_changes(prev_wikitext, curr_wikitext)
+    assert prev.names == ['0: Lede', '1: ==A==', '2: ==B==', '3: ==A==']
+    # identical sections are paired in order so the extra copy of ==A== is the last one
+    assert prev.changed == [False, False, True, True]
+    assert curr.changed == [False, False, True]
+    prev, curr = localize_changes(prev_wikitext, curr_wikitext, from_end=True)
+    assert prev.changed == [False, True, True, False]
+    # already-scanned revisions are just paired again
+    assert localize_changes(prev, curr)[0].changed == [False, False, True, True]
+    # sections are only parsed when looked up
+    assert not prev.wikicode
+    assert str(prev.wikicode['2: ==B==']) == '==B==\nOld\n'
+    assert localize_changes(prev_wikitext, curr_wikitext + 'https://example.org') is None
@@ -1,4 +1,16 @@
-from context import parse_change_text
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from context import (
+    ENGLISH_UNICODE,
+    NON_ENGLISH_UNICODE,
+    Tokenizer,
+    cjk_prev_wikitext,
+    get_tokenizer,
+    parse_change_text,
+    preload_tokenizers,
+    prev_wikitext,
+)
 
 
 def test_remove_text_count_english_punctuations():
@@ -30,3 +42,39 @@ def test_change_text_count_english_punctuations():
                         }
     get_text_structure = parse_change_text(prev_text, curr_text)
     assert expected_changes == get_text_structure
+
+
+def test_single_pass_matches_separate_methods():
+    texts = [prev_wikitext, cjk_prev_wikitext, '', '...', 'Wait for it.... 3.5 km. Why?!\n\n\nNo_one\'s well-known',
+             'أنهى النادي الموسم، بفارق نقطتين؟ لا أحد يعرف!\n\nانتهى... ', 'পাখি৤ উড়ে যায়৥ ।হ্যাঁ ॥',
+             '々〇\u3000。「これ」ですか？']
+    for text in texts:
+        for lang in ['en', 'ja', 'ar', 'bn']:
+            tokenizer = Tokenizer(ENGLISH_UNICODE, NON_ENGLISH_UNICODE, lang=lang)
+            expected = {'Whitespace': Counter(tokenizer.get_whitespace(text)),
+                        'Punctuation': Counter(tokenizer.get_punctuations(text)),
+                        'Character' if lang == 'ja' else 'Word': Counter(tokenizer.get_words(text)),
+                        'Sentence': Counter(tokenizer.get_sentences(text)),
+                        'Paragraph': Counter(tokenizer.get_paragraphs(text))}
+            # same counts in the same order (the order of structured text edits follows it)
+            occurrence = tokenizer.tokenize_and_get_occurrence(text)
+            assert [(k, list(v.items())) for k, v in occurrence.items()] == \
+                [(k, list(v.items())) for k, v in expected.items()]
+
+
+def test_get_tokenizer():
+    preload_tokenizers(['en', 'ja'])
+    assert get_tokenizer('en') is get_tokenizer('en')
+    assert get_tokenizer('ja').lang == 'ja'
+    assert get_tokenizer('en') is not get_tokenizer('ja')
+
+    # a language that hasn't been used yet is only built once even if several threads ask for it at once
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        tokenizers = list(pool.map(get_tokenizer, ['ar'] * 32))
+    assert all(t is tokenizers[0] for t in tokenizers)
+
+    # a shared tokenizer gives the same counts as a new one
+    text = 'Wait for it... awesome! More things to come. Why me?'
+    for lang in ['en', 'ja', 'ar']:
+        expected = Tokenizer(ENGLISH_UNICODE, NON_ENGLISH_UNICODE, lang=lang).tokenize_and_get_occurrence(text)
+        assert get_tokenizer(lang).tokenize_and_get_occurrence(text) == expected
@@ -1,7 +1,25 @@
 import copy
 import json
+import os
+import random
+import re
+import subprocess
+import sys
 
-from context import StructuredEditTypes, prev_wikitext
+import pytest
+from context import (
+    Differ,
+    DistanceMemo,
+    MaxDistanceExceeded,
+    OrderedNode,
+    StructuredEditTypes,
+    WikitextTree,
+    cjk_prev_wikitext,
+    estimate_complexity,
+    full_diff_to_simple,
+    prev_wikitext,
+    set_content_hasher,
+)
 
 
 def check_change_counts(diff, expected_changes):
@@ -155,3 +173,357 @@ def test_table_change():
     diff = StructuredEditTypes(table, curr_wikitext, lang='en')
     diff.get_diff()
     check_change_counts(diff.tree_diff, expected_changes)
+
+
+def test_transactions_match_distance():
+    curr_wikitext = prev_wikitext.replace('[[Vienna]]', '[[Vienna|Wien]]', 1)
+    curr_wikitext = curr_wikitext.replace('{{reflist}}', '{{reflist}}\n{{citation needed}}', 1)
+    d = Differ(WikitextTree(prev_wikitext), WikitextTree(curr_wikitext))
+    transactions = d.get_transactions()
+    assert all(i is not None or j is not None for i, j in transactions)
+    # every node-level transaction has unit cost so the rebuilt script must be as long as the minimum distance
+    nodes = d.get_transaction_nodes()
+    assert len(nodes['remove']) + len(nodes['insert']) + len(nodes['change']) == d.distances[len(d.t1) - 1][len(d.t2) - 1]
+
+
+def test_numpy_engine_matches_python():
+    pytest.importorskip('numpy')
+    curr_wikitext = prev_wikitext.replace('[[Vienna]]', '[[Vienna|Wien]]', 1)
+    curr_wikitext = curr_wikitext.replace('{{reflist}}', '{{reflist}}\n{{citation needed}}', 1)
+    curr_wikitext = '{{Austria-painter-stub}}' + curr_wikitext.replace('{{Austria-painter-stub}}', '', 1)
+    python_diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', engine='python')
+    python_diff.get_diff()
+    numpy_diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', engine='numpy')
+    numpy_diff.get_diff()
+    assert python_diff.tree_diff == numpy_diff.tree_diff
+
+
+def test_fast_algorithm():
+    curr_wikitext = prev_wikitext.replace('[[Vienna]]', '[[Vienna|Wien]]', 1)
+    curr_wikitext = curr_wikitext.replace('{{reflist}}', '{{reflist}}\n{{citation needed}}', 1)
+    curr_wikitext = '{{Austria-painter-stub}}' + curr_wikitext.replace('{{Austria-painter-stub}}', '', 1)
+    exact_diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en')
+    exact_diff.get_diff()
+    fast_diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', algorithm='fast')
+    fast_diff.get_diff()
+    assert exact_diff.tree_diff == fast_diff.tree_diff
+    assert exact_diff.actions == fast_diff.actions
+    with pytest.raises(MaxDistanceExceeded):
+        StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', algorithm='fast', max_distance=1).get_diff()
+
+
+def test_distance_memo():
+    curr_wikitext = prev_wikitext.replace('[[Vienna]]', '[[Vienna|Wien]]', 1)
+    curr_wikitext = curr_wikitext.replace('{{reflist}}', '{{reflist}}\n{{citation needed}}', 1)
+    kwargs = {'prune_unique': False, 'prune_identical': False}
+    no_memo = Differ(WikitextTree(prev_wikitext), WikitextTree(curr_wikitext), memo=DistanceMemo(max_entries=0), **kwargs)
+    memo = DistanceMemo()
+    first = Differ(WikitextTree(prev_wikitext), WikitextTree(curr_wikitext), memo=memo, **kwargs)
+    assert first.distances == no_memo.distances
+    # second diff of the same revisions: every sub-problem is already in the memo
+    misses = memo.misses
+    second = Differ(WikitextTree(prev_wikitext), WikitextTree(curr_wikitext), memo=memo, **kwargs)
+    assert memo.misses == misses and memo.hits > 0
+    assert second.distances == no_memo.distances
+    assert second.get_transactions() == no_memo.get_transactions()
+
+
+def test_max_distance():
+    curr_wikitext = prev_wikitext.replace('[[Vienna]]', '[[Vienna|Wien]]', 1)
+    curr_wikitext = curr_wikitext.replace('{{reflist}}', '{{reflist}}\n{{citation needed}}', 1)
+    full_diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en')
+    full_diff.get_diff()
+    bounded_diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', max_distance=10)
+    bounded_diff.get_diff()
+    assert full_diff.tree_diff == bounded_diff.tree_diff
+    with pytest.raises(MaxDistanceExceeded):
+        StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', max_distance=1).get_diff()
+
+
+def test_budget_stages():
+    curr_wikitext = prev_wikitext.replace('[[Vienna]]', '[[Vienna|Wien]]', 1)
+    curr_wikitext = curr_wikitext.replace('accessdate=27 March 2014', 'accessdate=28 March 2014', 1)
+    expected_stages = [({}, 'full'), ({'max_cells': 10**9}, 'full'), ({'max_cells': 2500}, 'top-level'),
+                       ({'max_cells': 100}, 'sections'), ({'max_cells': 1}, 'simple'), ({'max_seconds': 0}, 'simple')]
+    for budget, expected_stage in expected_stages:
+        diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', **budget)
+        result = diff.get_diff()
+        assert diff.stage == expected_stage, budget
+        if expected_stage == 'simple':
+            assert diff.tree_diff is None
+            assert result['Wikilink'] == {'change': 1}
+        else:
+            assert diff.tree_diff['stage'] == expected_stage
+
+
+class TickingClock:
+    """Stand-in for the time module whose perf_counter advances by one second every time it is read."""
+
+    def __init__(self):
+        self.now = 0
+
+    def perf_counter(self):
+        self.now += 1
+        return self.now
+
+
+def test_budget_stages_max_seconds(monkeypatch):
+    # with a clock that ticks once per budget check, max_seconds is the number of checks each stage may do:
+    # a stage that runs out of time must still leave the cheaper stages their own allowance
+    import mwedittypes.tree_differ as tree_differ
+
+    monkeypatch.setattr(tree_differ, 'time', TickingClock())
+    # a link within a reference changes: the full stage has to diff the nested links too
+    links = ' '.join(f'[[Link {i}]]' for i in range(10))
+    prev = prev_wikitext.replace('[[Vienna]]', '[[Vienna]]<ref>{{cite book|title=' + links + '}}</ref>', 1)
+    curr = prev.replace('[[Link 5]]', '[[Link five]]', 1)
+    stages = []
+    for max_seconds in range(0, 60):
+        diff = StructuredEditTypes(prev, curr, lang='en', max_seconds=max_seconds)
+        diff.get_diff()
+        stages.append(diff.stage)
+    # more time never gives a less detailed stage and every stage is reached for some budget
+    order = ['simple', 'sections', 'top-level', 'full']
+    assert [order.index(s) for s in stages] == sorted(order.index(s) for s in stages)
+    assert set(stages) == set(order)
+
+
+def test_by_section():
+    curr_wikitext = prev_wikitext.replace('[[Vienna]]', '[[Vienna|Wien]]', 1)
+    curr_wikitext = curr_wikitext.replace('{{reflist}}', '{{reflist}}\n{{citation needed}}', 1)
+    full_diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en')
+    full_diff.get_diff()
+    section_diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', by_section=True)
+    section_diff.get_diff()
+    assert full_diff.tree_diff == section_diff.tree_diff
+
+    # move the References section to the end of the article
+    references = prev_wikitext[prev_wikitext.index('==References=='):prev_wikitext.index('==External links==')]
+    curr_wikitext = prev_wikitext.replace(references, '', 1) + '\n' + references
+    section_diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', by_section=True)
+    section_diff.get_diff()
+    assert [m['prev']['type'] for m in section_diff.tree_diff['move']] == ['Section']
+
+
+def test_by_section_reordered():
+    # a section moves and a (maybe different) section is edited: the changed section is kept in place and the
+    # others are moved, the same as in the full diff
+    sections = re.split(r'(?m)^(?===)', prev_wikitext)
+    for moved in range(1, len(sections)):
+        for to in range(1, len(sections)):
+            for edited in range(1, len(sections)):
+                if moved == to:
+                    continue
+                reordered = list(sections)
+                reordered[edited] = reordered[edited].replace('[[', '[[New ', 1) + 'More text.\n'
+                reordered.insert(to, reordered.pop(moved))
+                curr_wikitext = ''.join(reordered)
+                full_diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en')
+                section_diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', by_section=True)
+                assert full_diff.get_diff() == section_diff.get_diff()
+                assert full_diff.tree_diff == section_diff.tree_diff
+    # both Life and Works change and swap places: each out-of-order section is diffed against its old version
+    reordered = [sections[0], sections[2].replace('[[', '[[New ', 1), sections[1].replace('[[', '[[New ', 1)]
+    curr_wikitext = ''.join(reordered + sections[3:])
+    section_diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', by_section=True)
+    section_diff.get_diff()
+    changed_sections = [c['prev']['section'] for c in section_diff.tree_diff['change'] if c['prev']['type'] == 'Section']
+    assert sorted(changed_sections) == ['1: ==Life==', '2: ===Works===']
+    assert not [n for n in section_diff.tree_diff['remove'] + section_diff.tree_diff['insert'] if n['type'] == 'Section']
+
+
+def test_moved_sections_mapping():
+    # Works and External links move up ahead of Life: nothing within the sections changes and each moved
+    # section is reported under its own name (see Diff._section_mapping)
+    lede, life, works, references, external_links = re.split(r'(?m)^(?===)', prev_wikitext)
+    curr_wikitext = ''.join([lede, works, external_links, life, references])
+    diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en')
+    result = diff.get_diff()
+    assert diff.tree_diff['change'] == []
+    assert sorted((m['prev']['section'], m['curr']['section']) for m in diff.tree_diff['move']) == [
+        ('2: ===Works===', '2: ===Works==='), ('4: ==External links==', '4: ==External links==')]
+    assert result['text-edits'] == []
+
+
+def test_section_workers():
+    curr_wikitext = prev_wikitext.replace('[[Vienna]]', '[[Vienna|Wien]]', 1)
+    curr_wikitext = curr_wikitext.replace('{{reflist}}', '{{reflist}}\n{{citation needed}}', 1)
+    curr_wikitext = curr_wikitext.replace("''Fischmarkt''", "''Fish market''", 1)
+    sequential = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', by_section=True)
+    sequential.get_diff()
+    parallel = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', workers=2)
+    parallel.get_diff()
+    assert sequential.tree_diff == parallel.tree_diff
+    assert sequential.actions == parallel.actions
+    with pytest.raises(MaxDistanceExceeded):
+        StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en', workers=2, max_distance=1).get_diff()
+
+
+def test_prune_anchors():
+    prev_list = '==List==\n' + '\n'.join(f'* [[Thing {i}]]<ref>{{{{cite web|title=Thing {i}}}}}</ref>' for i in range(50))
+    curr_list = prev_list.replace('[[Thing 20]]', '[[Thing 20]] [[New link]]', 1)
+    curr_list = curr_list.replace('[[Thing 30]]<ref>', '[[Thing 31]]<ref>', 1)
+    pruned = Differ(WikitextTree(prev_list), WikitextTree(curr_list), prune_unique=True)
+    full = Differ(WikitextTree(prev_list), WikitextTree(curr_list), prune_unique=False)
+    assert len(pruned.t1) < len(full.t1) // 2
+    pruned_diff = pruned.get_corresponding_nodes()
+    full_diff = full.get_corresponding_nodes()
+    for et in ('remove', 'insert', 'change', 'move'):
+        assert sorted(map(repr, getattr(pruned_diff, et))) == sorted(map(repr, getattr(full_diff, et)))
+
+
+def test_prune_anchors_moved_content():
+    # anchors are not pruned by default: a unique node that is in place may still be better matched elsewhere,
+    # e.g. here the category moved into {{前後番組}} means it is removed along with both of its <br />s
+    lines = cjk_prev_wikitext.split('\n')
+    moved_category = '\n'.join(lines[:115] + [lines[126]] + lines[115:126] + lines[127:])
+    simple_diff = full_diff_to_simple(StructuredEditTypes(cjk_prev_wikitext, moved_category, lang='ja').get_diff())
+    assert simple_diff['Text Formatting'] == {'remove': 2, 'insert': 2}
+    assert simple_diff['Category'] == {'move': 1}
+    sections = prev_wikitext.split('\n==')
+    reordered = [
+        '\n=='.join([sections[0], sections[2], sections[1]] + sections[3:]),
+        '\n=='.join(sections[:1] + sections[2:] + [sections[1].replace('[[Vienna]]', '[[Wien]]', 1)]),
+    ]
+    for prev, curr in [(cjk_prev_wikitext, moved_category)] + [(prev_wikitext, c) for c in reordered]:
+        default = Differ(WikitextTree(prev), WikitextTree(curr)).get_corresponding_nodes()
+        full = Differ(WikitextTree(prev), WikitextTree(curr), prune_unique=False).get_corresponding_nodes()
+        for et in ('remove', 'insert', 'change', 'move'):
+            assert list(map(repr, getattr(default, et))) == list(map(repr, getattr(full, et)))
+
+
+def test_deeply_nested_tree():
+    # much deeper than the recursion limit -- tree traversal and the differ must not recurse
+    def nested_tree(leaf_text):
+        tree = WikitextTree('')
+        node = tree.root
+        for _ in range(3000):
+            node = OrderedNode('Template: x', ntype='Template', mwnode='{{x}}', parent=node)
+        OrderedNode('Text', ntype='Text', mwnode=leaf_text, parent=node)
+        return tree
+    d = Differ(nested_tree('a'), nested_tree('b'), stage='top-level', max_distance=2)
+    diff = d.get_corresponding_nodes()
+    assert [(c['prev']['text'], c['curr']['text']) for c in diff.change] == [('a', 'b')]
+
+
+def test_detect_moves_reshuffle():
+    prev_nodes = [OrderedNode(f'Category {i}', ntype='Category', mwnode=f'[[Category:{i}]]') for i in range(5000)]
+    curr_nodes = [OrderedNode(f'Category {i}', ntype='Category', mwnode=f'[[Category:{i}]]') for i in range(5000)]
+    random.Random(0).shuffle(curr_nodes)
+    # a few nodes are part of changes: Change(A,B) + Insert(A) -> Move(A,A) + Insert(B)
+    changed = [(prev_nodes.pop(), OrderedNode('Category new', ntype='Category', mwnode='[[Category:new]]'))]
+    diff = {'remove': prev_nodes, 'insert': curr_nodes, 'change': changed}
+    Differ.detect_moves(diff)
+    assert len(diff['move']) == 5000
+    assert all(pn.content_hash == cn.content_hash for pn, cn in diff['move'])
+    assert diff['remove'] == [] and diff['change'] == []
+    assert [n.text for n in diff['insert']] == ['[[Category:new]]']
+
+
+def test_duplicate_sections():
+    # many sections with the same content -- each should only be matched once
+    prev_wikitext = ''.join(f'==Results==\nSee [[Election {i % 2}]].\n' for i in range(300))
+    curr_wikitext = prev_wikitext.replace('==Results==\nSee [[Election 1]].\n', '', 1)
+    diff = StructuredEditTypes(prev_wikitext, curr_wikitext, lang='en').get_diff()
+    simple_diff = full_diff_to_simple(diff)
+    assert simple_diff['Section'] == {'remove': 1}
+    assert simple_diff['Heading'] == {'remove': 1}
+    assert simple_diff['Wikilink'] == {'remove': 1}
+
+
+def test_prune_identical_subtrees():
+    ref = '<ref>{{cite web|title=Source|url=https://example.org|publisher=[[Example]]}}</ref>'
+    prev_wikitext = f'==Works==\nA painting{ref} and a drawing{ref} of [[Vienna]].\n'
+    # repeated (non-unique) reference is unchanged -- only needs to be diffed as a single node
+    curr_wikitext = prev_wikitext.replace('[[Vienna]]', '[[Vienna|Wien]]', 1)
+    pruned = Differ(WikitextTree(prev_wikitext), WikitextTree(curr_wikitext), prune_unique=False)
+    full = Differ(WikitextTree(prev_wikitext), WikitextTree(curr_wikitext), prune_unique=False, prune_identical=False)
+    assert len(pruned.t1) == len(full.t1) - 6
+    assert pruned.get_corresponding_nodes().change == full.get_corresponding_nodes().change
+    # a collapsed reference that is moved is still reported along with everything within it
+    templates = '{{t|[[a]]}}{{t|[[b]]}}{{t|[[c]]}}{{t|[[d]]}}'
+    prev_wikitext = f'==Works==\nA painting{ref}{templates}\n'
+    curr_wikitext = f'==Works==\nA painting{templates}{ref}\n'
+    pruned = Differ(WikitextTree(prev_wikitext), WikitextTree(curr_wikitext), prune_unique=False)
+    full = Differ(WikitextTree(prev_wikitext), WikitextTree(curr_wikitext), prune_unique=False, prune_identical=False)
+    assert pruned.collapsed
+    pruned_diff = pruned.get_corresponding_nodes()
+    assert [m['prev']['type'] for m in pruned_diff.move] == ['ExternalLink', 'Wikilink', 'Template', 'Reference']
+    assert pruned_diff.move == full.get_corresponding_nodes().move
+
+
+def test_max_depth():
+    def nodes(tree):
+        return [(n.ntype, n.text, n.parent.text) for n in tree.root.postorder() if not n.is_root]
+
+    full = WikitextTree(prev_wikitext)
+    full.expand_nested()
+    prev_size = 0
+    for max_depth in range(3):
+        tree = WikitextTree(prev_wikitext)
+        tree.expand_nested(max_depth=max_depth)
+        # nodes that are expanded are the same as in the full tree (same parents too), just fewer of them
+        assert set(nodes(tree)) <= set(nodes(full))
+        assert len(nodes(tree)) > prev_size
+        prev_size = len(nodes(tree))
+    assert nodes(tree) == nodes(full)
+    tree = WikitextTree(prev_wikitext)
+    tree.expand_nested(max_depth=0)
+    assert all(n.parent.ntype == 'Section' for n in tree.root.postorder() if n.ntype not in ('Article', 'Section'))
+
+
+def test_unnest_wide_node():
+    # many nested nodes within a single template -- each one should be attached to its direct parent
+    params = '|'.join(f"p{i}=''[[Link {i}]]'' {{{{t|[[Nested {i}]]}}}}" for i in range(500))
+    tree = WikitextTree(f'==Info==\n{{{{Infobox|{params}}}}}\n')
+    tree.expand_nested()
+    infobox = [n for n in tree.root.postorder() if n.ntype == 'Template' and n.parent.ntype == 'Section']
+    assert len(infobox) == 1
+    children = infobox[0].children
+    assert [n.ntype for n in children[:4]] == ['Wikilink', 'Template', 'Wikilink', 'Template']
+    assert len([n for n in children if n.ntype == 'Text Formatting']) == 1000
+    assert len(children) == 2000
+    nested = [n for n in children if n.ntype == 'Template']
+    assert [c.text for c in nested[-1].children] == ['[[Nested 499]]']
+
+
+def test_estimate_complexity():
+    tree = WikitextTree(prev_wikitext)
+    estimate = estimate_complexity(tree)
+    assert estimate['nodes'] == len(list(tree.root.postorder()))
+    tree.expand_nested()
+    expanded = len(list(tree.root.postorder()))
+    # nested nodes are estimated without parsing them so the estimate is close but not necessarily exact
+    assert abs(estimate['nodes'] + estimate['nested'] - expanded) <= 0.1 * expanded
+    # cells of the expanded tree: sum of the sizes of the sub-trees rooted at keyroots (see Differ.get_num_cells)
+    _, leftmost, keyroots, _, _ = Differ.flatten(tree, {})
+    cells = sum(kr.idx - leftmost[kr.idx] + 1 for kr in keyroots)
+    assert 0.5 * cells <= estimate['cells'] <= 2 * cells
+
+
+def test_stable_content_hash():
+    # content and Merkle hashes are the same in every process -- e.g., whatever PYTHONHASHSEED is
+    script = ('from context import Differ, WikitextTree, prev_wikitext\n'
+              'd = Differ(WikitextTree(prev_wikitext), WikitextTree(prev_wikitext.replace("Vienna", "Wien")))\n'
+              'print([n.content_hash for n in d.t1], d.t1_subtree_hashes, d.t2_subtree_hashes)')
+    outputs = set()
+    for seed in ('1', '2'):
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        outputs.add(subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True,
+                                   cwd=os.path.dirname(__file__), check=True).stdout)
+    assert len(outputs) == 1
+
+
+def test_content_hasher():
+    tree = WikitextTree(prev_wikitext)
+    set_content_hasher('builtin')
+    try:
+        builtin_tree = WikitextTree(prev_wikitext)
+    finally:
+        set_content_hasher()
+    nodes = list(tree.root.postorder())
+    # text is hashed along with its length
+    assert all(n.content_hash >> 64 == len(n.text) for n in nodes)
+    assert [n.content_hash == hash(n.text) for n in builtin_tree.root.postorder()] == [True] * len(nodes)
+    with pytest.raises(ValueError):
+        set_content_hasher('md5')